@@ -0,0 +1,653 @@
+"""
+Асинхронный клиент для сайта Samal (добавление в корзину и оформление заказа)
+
+Все запросы выполняются через httpx.AsyncClient, поэтому оформление одного
+заказа не блокирует event loop бота и остальные чаты.
+"""
+import asyncio
+import datetime
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from checkout_parser import CheckoutPageFields, aparse_checkout_chunks
+from config import (
+    SAMAL_BASE_URL, SAMAL_SHOP_URL, SAMAL_CHECKOUT_URL, DEFAULT_PRODUCT_ID, DEFAULT_QUANTITY,
+    ORDER_FAST_COMPLETION, ORDER_VERIFY_RECEIVED_PAGE,
+)
+from http_transport import get_shared_async_transport
+from metrics import order_step, reset_order_outcome, set_order_outcome, track_order
+from rate_governor import checkout_budget
+from resilience import CircuitOpenError, acall_with_retry, error_outcome, samal_breaker
+from samal_api import (
+    SamalAPI,
+    SELENIUM_AVAILABLE,
+    CheckoutPageMixin,
+    DEFAULT_HEADERS,
+    CHECKOUT_AJAX_URL,
+    CHECKOUT_AJAX_HEADERS,
+    ADD_TO_CART_AJAX_URL,
+    DRAIN_LIMIT,
+    REMOVE_FROM_CART_AJAX_URL,
+    archive_order_html,
+    confirm_checkout_submit,
+    normalize_order_items,
+    site_unavailable_result,
+)
+from tracing import trace
+
+# Настройка логирования (только для критичных ошибок)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Таймаут одного HTTP-запроса к samal.kz (секунды)
+REQUEST_TIMEOUT = 30
+
+# Заголовки AJAX-запросов корзины
+CART_AJAX_HEADERS = {
+    'X-Requested-With': 'XMLHttpRequest',
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+    'Origin': SAMAL_BASE_URL,
+    'Referer': SAMAL_SHOP_URL,
+}
+
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks = set()
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """Запускает корутину в фоне, не дожидаясь ее результата"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+@dataclass
+class WarmSession:
+    """Подготовленная анонимная сессия WooCommerce с пустой корзиной"""
+    cookies: httpx.Cookies
+    nonce: str
+    payment_method: Optional[str]
+    created_at: float
+    expires_at: float
+    hidden_fields: Dict[str, str] = field(default_factory=dict)
+
+    def is_fresh(self, margin: float = 0) -> bool:
+        """True, если nonce еще действителен (с запасом margin секунд)"""
+        return time.time() + margin < self.expires_at
+
+
+@dataclass
+class PreparedCheckout:
+    """Корзина с товарами и nonce, готовые к отправке формы checkout"""
+    nonce: str
+    payment_method: Optional[str]
+    hidden_fields: Dict[str, str] = field(default_factory=dict)
+
+
+class AsyncSamalAPI(CheckoutPageMixin):
+    """
+    Асинхронная версия SamalAPI.
+
+    Создавать внутри работающего event loop. Использование:
+        async with AsyncSamalAPI() as api:
+            result = await api.create_order(product_id, quantity, user_data)
+            result = await api.create_order(user_data=user_data, items=[
+                {'product_id': 224, 'quantity': 2}, {'product_id': 226, 'quantity': 2},
+            ])
+    """
+
+    def __init__(self, cookies: Optional[httpx.Cookies] = None, local_order_id: Optional[int] = None):
+        """
+        Args:
+            cookies: Cookies WooCommerce для продолжения существующей сессии.
+                По умолчанию у каждого клиента своя пустая cookie jar,
+                поэтому корзины разных заказов не смешиваются.
+            local_order_id: Номер заказа в локальной базе (для архива снимков ответа)
+        """
+        self.local_order_id = local_order_id
+        headers = dict(DEFAULT_HEADERS)
+        # httpx без brotli не умеет распаковывать br, поэтому не запрашиваем его
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        # Соединения берутся из общего пула, закрытие клиента пул не закрывает
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            cookies=cookies if cookies is not None else httpx.Cookies(),
+            transport=get_shared_async_transport(),
+            follow_redirects=True,
+            timeout=REQUEST_TIMEOUT,
+        )
+
+    async def __aenter__(self) -> 'AsyncSamalAPI':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Закрывает HTTP-клиент (общий пул соединений остается открытым)"""
+        await self.client.aclose()
+
+    async def add_to_cart(self, product_id: int, quantity: int = 2) -> bool:
+        """
+        Добавляет товар в корзину
+
+        Args:
+            product_id: ID товара на сайте
+            quantity: Количество товара
+
+        Returns:
+            True если успешно, False если ошибка
+        """
+        return await self.add_items_to_cart([(product_id, quantity)])
+
+    async def add_items_to_cart(self, items: List[Tuple[int, int]]) -> bool:
+        """
+        Добавляет несколько товаров в корзину одной сессии
+
+        Args:
+            items: Список (product_id, quantity)
+
+        Returns:
+            True если все товары добавлены, False если ошибка
+        """
+        try:
+            # Получаем главную страницу для установки cookies (идемпотентно - с повторами)
+            with order_step('httpx', 'shop_get'):
+                await acall_with_retry(self.client.get, SAMAL_SHOP_URL)
+
+            # Товары добавляем по очереди: WooCommerce сохраняет корзину сессии
+            # целиком, параллельные запросы перезаписали бы друг друга
+            for product_id, quantity in items:
+                # Повтор мог бы добавить товар дважды
+                with order_step('httpx', 'add_to_cart'):
+                    response = await acall_with_retry(
+                        self.client.get,
+                        SAMAL_SHOP_URL,
+                        params={'add-to-cart': product_id, 'quantity': quantity},
+                        attempts=1,
+                    )
+                if response.status_code != 200:
+                    logger.error(f"Ошибка добавления в корзину товара {product_id}. Статус: {response.status_code}")
+                    return False
+
+            return True
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении в корзину: {str(e)}")
+            set_order_outcome(error_outcome(e))
+            return False
+
+    async def get_checkout_page(self) -> Optional[str]:
+        """
+        Получает HTML страницы оформления заказа
+
+        Returns:
+            HTML содержимое страницы или None
+        """
+        try:
+            response = await acall_with_retry(self.client.get, SAMAL_CHECKOUT_URL)
+
+            if response.status_code == 200:
+                return response.text
+            else:
+                logger.error(f"Ошибка получения checkout. Статус: {response.status_code}")
+                return None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы checkout: {str(e)}")
+            return None
+
+    async def fetch_checkout_fields(self) -> Optional[CheckoutPageFields]:
+        """
+        Загружает страницу checkout потоком и за один проход извлекает nonce,
+        способ оплаты и скрытые поля формы. Чтение останавливается на </form>,
+        остаток страницы дочитывается в фоне, чтобы соединение вернулось в пул.
+
+        Returns:
+            CheckoutPageFields с nonce или None
+        """
+        with order_step('httpx', 'checkout_page'):
+            fields = await self._fetch_checkout_fields()
+        if fields is not None and not fields.nonce:
+            logger.error("Не удалось извлечь nonce из HTML")
+            set_order_outcome('nonce_missing')
+            return None
+        return fields
+
+    async def _fetch_checkout_fields(self) -> Optional[CheckoutPageFields]:
+        try:
+            request = self.client.build_request('GET', SAMAL_CHECKOUT_URL)
+            response = await acall_with_retry(self.client.send, request, stream=True)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы checkout: {str(e)}")
+            set_order_outcome('checkout_page_failed')
+            return None
+
+        if response.status_code != 200:
+            logger.error(f"Ошибка получения checkout. Статус: {response.status_code}")
+            set_order_outcome('checkout_page_failed')
+            await response.aclose()
+            return None
+
+        chunks = response.aiter_bytes()
+        try:
+            fields = await aparse_checkout_chunks(chunks, response.charset_encoding or 'utf-8')
+        except Exception as e:
+            logger.error(f"Ошибка при разборе страницы checkout: {str(e)}")
+            set_order_outcome('checkout_page_failed')
+            await response.aclose()
+            return None
+        spawn_background(self._drain_response(response, chunks))
+        return fields
+
+    async def _drain_response(self, response: httpx.Response, chunks) -> None:
+        """Дочитывает остаток ответа без разбора и закрывает его"""
+        try:
+            drained = 0
+            async for chunk in chunks:
+                drained += len(chunk)
+                if drained > DRAIN_LIMIT:
+                    break
+        except Exception:
+            pass
+        finally:
+            await response.aclose()
+
+    async def place_order(self, user_data: Dict, use_browser: bool = False,
+                          product_id: Optional[int] = None, quantity: Optional[int] = None,
+                          items: Optional[List[Tuple[int, int]]] = None) -> Dict:
+        """
+        Оформляет заказ на сайте
+
+        Args:
+            user_data: Словарь с данными пользователя (first_name, phone, address, comment)
+            use_browser: Если True, использует Selenium в отдельном потоке
+
+        Returns:
+            Словарь с результатом: {'success': bool, 'message': str, 'order_id': int или None}
+        """
+        if use_browser and SELENIUM_AVAILABLE:
+            # Selenium синхронный - выполняем его вне event loop
+            return await asyncio.to_thread(
+                SamalAPI(self.local_order_id).place_order, user_data, True, product_id, quantity, items
+            )
+        return await self._place_order_with_requests(user_data)
+
+    async def add_to_cart_ajax(self, product_id: int, quantity: int) -> bool:
+        """
+        Добавляет товар в корзину через AJAX endpoint (без загрузки страницы магазина)
+
+        Returns:
+            True если товар добавлен
+        """
+        try:
+            with order_step('httpx', 'add_to_cart_ajax'):
+                response = await acall_with_retry(
+                    self.client.post,
+                    ADD_TO_CART_AJAX_URL,
+                    data={'product_id': product_id, 'quantity': quantity},
+                    headers=CART_AJAX_HEADERS,
+                    attempts=1,
+                )
+            if response.status_code != 200:
+                logger.error(f"Ошибка AJAX добавления в корзину. Статус: {response.status_code}")
+                return False
+            # При ошибке WooCommerce возвращает {"error": true, "product_url": ...}
+            try:
+                return not response.json().get('error')
+            except ValueError:
+                return False
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при AJAX добавлении в корзину: {str(e)}")
+            return False
+
+    async def remove_from_cart_ajax(self, product_id: int) -> bool:
+        """
+        Удаляет товар из корзины через AJAX endpoint
+
+        Returns:
+            True если товар удален
+        """
+        try:
+            # Удаление по ключу корзины идемпотентно - можно повторять
+            response = await acall_with_retry(
+                self.client.post,
+                REMOVE_FROM_CART_AJAX_URL,
+                data={'cart_item_key': self.cart_item_key(product_id)},
+                headers=CART_AJAX_HEADERS,
+            )
+            if response.status_code != 200:
+                return False
+            try:
+                # wp_send_json_error() -> {"success": false}
+                return response.json().get('success', True) is not False
+            except ValueError:
+                return False
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при AJAX удалении из корзины: {str(e)}")
+            return False
+
+    async def warm_session(self, ttl: int) -> Optional[WarmSession]:
+        """
+        Готовит анонимную сессию WooCommerce для пула: cookies сессии,
+        nonce и способ оплаты. Корзина сессии после подготовки пустая.
+
+        Checkout без товара недоступен, поэтому nonce получаем с временным
+        товаром в корзине и затем удаляем его. Nonce WooCommerce привязан к
+        сессии покупателя, а не к содержимому корзины.
+
+        Args:
+            ttl: Сколько секунд считать nonce действительным
+
+        Returns:
+            WarmSession или None при ошибке
+        """
+        if not await self.add_to_cart(DEFAULT_PRODUCT_ID, DEFAULT_QUANTITY):
+            return None
+
+        fields = await self.fetch_checkout_fields()
+        if fields is None:
+            return None
+
+        # Если временный товар не удалился, сессия не годится - он попал бы в чужой заказ
+        if not await self.remove_from_cart_ajax(DEFAULT_PRODUCT_ID):
+            return None
+
+        now = time.time()
+        return WarmSession(
+            cookies=httpx.Cookies(self.client.cookies),
+            nonce=fields.nonce,
+            payment_method=fields.payment_method,
+            hidden_fields=fields.hidden_fields,
+            created_at=now,
+            expires_at=now + ttl,
+        )
+
+    async def _place_order_with_requests(self, user_data: Dict) -> Dict:
+        """
+        Оформляет заказ через AJAX endpoint WooCommerce
+        """
+        try:
+            # Получаем со страницы checkout nonce, способ оплаты и скрытые поля
+            fields = await self.fetch_checkout_fields()
+            if fields is None:
+                return {'success': False, 'message': 'Не удалось получить nonce для оформления заказа', 'order_id': None}
+
+            result, _ = await self.submit_checkout(
+                user_data, fields.nonce, fields.payment_method, fields.hidden_fields
+            )
+            return result
+
+        except CircuitOpenError as e:
+            return site_unavailable_result(e.retry_after)
+        except Exception as e:
+            logger.error(f"Ошибка при оформлении заказа: {str(e)}")
+            set_order_outcome(error_outcome(e))
+            return {
+                'success': False,
+                'message': f'Произошла ошибка: {str(e)}',
+                'order_id': None
+            }
+
+    async def submit_checkout(self, user_data: Dict, nonce: str, payment_method: Optional[str],
+                              hidden_fields: Optional[Dict[str, str]] = None) -> Tuple[Dict, bool]:
+        """
+        Отправляет форму checkout на AJAX endpoint и разбирает результат
+
+        Args:
+            user_data: Данные пользователя
+            nonce: woocommerce-process-checkout-nonce
+            payment_method: Способ оплаты
+            hidden_fields: Скрытые поля формы checkout
+
+        Returns:
+            (результат заказа, stale) - stale=True, если WooCommerce отклонил
+            форму из-за устаревшего nonce или сессии и ее можно отправить заново
+        """
+        form_data = self.build_checkout_form(user_data, nonce, payment_method, hidden_fields)
+
+        print(f"📤 Отправляю AJAX-запрос на: {CHECKOUT_AJAX_URL}")
+        # Проверка воркера очереди пишет в базу - выполняем ее вне event loop
+        await asyncio.to_thread(confirm_checkout_submit)
+        # Отправку заказа не повторяем: заказ мог быть создан, даже если ответ не пришел
+        with order_step('httpx', 'checkout_post'):
+            response = await acall_with_retry(
+                self.client.post,
+                CHECKOUT_AJAX_URL,
+                data=form_data,
+                headers=CHECKOUT_AJAX_HEADERS,
+                follow_redirects=False,
+                attempts=1,
+                budget=checkout_budget,
+            )
+        print(f"📡 Ответ получен. Status: {response.status_code}")
+
+        # Приоритет: 1) JSON redirect, 2) Location header
+        final_url = self.parse_checkout_response(response.text, response.headers.get('Content-Type', ''))
+        if not final_url and 'Location' in response.headers:
+            final_url = self.absolute_url(response.headers['Location'])
+        trace('checkout_response', location='async_samal_api.py:submit_checkout',
+              status=response.status_code, redirect=final_url)
+
+        # Быстрое завершение: номер заказа уже есть в redirect (order-received/<id>),
+        # страница подтверждения при необходимости проверяется в фоне
+        fast_order_id = self.extract_order_id_from_url(final_url) if ORDER_FAST_COMPLETION else None
+        if fast_order_id:
+            archive_order_html('order_response', response.text, [
+                f"Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                f"Status Code: {response.status_code}",
+                f"Redirect: {final_url}",
+            ], self.local_order_id)
+            if ORDER_VERIFY_RECEIVED_PAGE:
+                spawn_background(self._verify_order_received(
+                    final_url, fast_order_id, httpx.Cookies(self.client.cookies)
+                ))
+            return self.fast_completion_result(fast_order_id), False
+
+        final_response = response
+        if final_url:
+            print(f"📍 Редирект: {final_url}")
+            # Ждем небольшую задержку для обработки на сервере
+            with order_step('httpx', 'redirect_wait'):
+                await asyncio.sleep(2)
+            try:
+                with order_step('httpx', 'order_received_get'):
+                    final_response = await acall_with_retry(self.client.get, final_url)
+                print(f"✅ Финальная страница получена. Status: {final_response.status_code}")
+            except Exception as e:
+                print(f"⚠️  Ошибка при запросе финальной страницы: {str(e)}")
+        else:
+            print("⚠️  Редирект не найден в ответе. Возможно, заказ не был создан или есть ошибки.")
+
+        # Сохраняем снимок ответа в архив (сжатие и запись - в фоновом потоке)
+        header_lines = [
+            f"Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Первый Status Code: {response.status_code}",
+            f"Финальный Status Code: {final_response.status_code}",
+            f"Финальный URL: {final_response.url}",
+        ]
+        snapshot_ref = archive_order_html('order_response', final_response.text, header_lines, self.local_order_id)
+
+        location_header = final_response.headers.get('Location') or response.headers.get('Location')
+        order_id = self.extract_order_id(final_response.text, location_header or final_url)
+
+        # Заказ считается успешным ТОЛЬКО если найден order_id
+        if order_id:
+            return {
+                'success': True,
+                'message': f'✅ Заказ успешно оформлен!\nНомер заказа: {order_id}\n',
+                'order_id': order_id
+            }, False
+
+        logger.error(f"Order ID не найден в ответе. Статус: {response.status_code}")
+        set_order_outcome('checkout_rejected' if self.is_checkout_rejected(response.text) else 'order_id_missing')
+        message = f'❌ Не удалось получить номер заказа.\n'
+        message += f'Статус ответа: {response.status_code}\n'
+        message += f'Возможно заказ не был создан. Проверьте снимок {snapshot_ref if snapshot_ref else "ответа"} для деталей.\n'
+        return {
+            'success': False,
+            'message': message,
+            'order_id': None
+        }, self.is_checkout_stale(response.text)
+
+    async def _verify_order_received(self, final_url: str, order_id: int, cookies: httpx.Cookies) -> None:
+        """
+        Фоновая проверка страницы order-received после быстрого завершения.
+        Использует свой клиент: основной к этому моменту уже закрыт.
+        """
+        try:
+            async with AsyncSamalAPI(cookies=cookies, local_order_id=self.local_order_id) as api:
+                final_response = await acall_with_retry(api.client.get, final_url)
+            if not self.check_order_received_page(final_response.text, str(final_response.url), order_id):
+                archive_order_html('order_unverified', final_response.text, [f"URL: {final_response.url}"],
+                                   self.local_order_id)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке страницы подтверждения заказа {order_id}: {str(e)}")
+
+    @track_order('httpx')
+    async def create_order(self, product_id: Optional[int] = None, quantity: Optional[int] = None,
+                           user_data: Optional[Dict] = None, use_browser: bool = False,
+                           warm_session: Optional[WarmSession] = None, items: Optional[List[Dict]] = None) -> Dict:
+        """
+        Полный цикл создания заказа: добавление в корзину + оформление
+
+        Args:
+            product_id: ID товара
+            quantity: Количество
+            user_data: Данные пользователя
+            use_browser: Если True, использует реальный браузер для оформления заказа
+            warm_session: Подготовленная сессия из пула. Клиент должен быть создан
+                с ее cookies: AsyncSamalAPI(cookies=warm_session.cookies)
+            items: Несколько товаров в одном заказе вместо product_id/quantity:
+                [{'product_id': 224, 'quantity': 2}, {'product_id': 226, 'quantity': 2}]
+
+        Returns:
+            Результат оформления заказа
+        """
+        cart_items = normalize_order_items(product_id, quantity, items)
+
+        # Пока сайт недоступен, не заставляем пользователя ждать таймаутов
+        if samal_breaker.is_open:
+            return site_unavailable_result(samal_breaker.retry_after())
+
+        if use_browser and SELENIUM_AVAILABLE:
+            # Браузер сам добавляет товары в корзину (внутри place_order)
+            return await self.place_order(user_data, use_browser=True, items=cart_items)
+
+        try:
+            if warm_session is not None:
+                # Быстрый путь: товары добавляются AJAX-запросами и форма сразу
+                # отправляется с nonce из пула, без загрузки страниц магазина и checkout
+                prepared = await self.prepare_checkout(cart_items, warm_session)
+                if prepared is None:
+                    set_order_outcome('cart_failed')
+                    return {
+                        'success': False,
+                        'message': 'Не удалось подготовить заказ',
+                        'order_id': None
+                    }
+                return await self.complete_checkout(user_data, prepared)
+
+            if not await self.add_items_to_cart(cart_items):
+                set_order_outcome('cart_failed')
+                return {
+                    'success': False,
+                    'message': 'Не удалось добавить товар в корзину',
+                    'order_id': None
+                }
+        except CircuitOpenError as e:
+            return site_unavailable_result(e.retry_after)
+        return await self.place_order(user_data)
+
+    async def prepare_checkout(self, items: List[Tuple[int, int]],
+                               warm_session: Optional[WarmSession] = None) -> Optional[PreparedCheckout]:
+        """
+        Выполняет все шаги заказа, кроме финальной отправки формы:
+        добавляет товары в корзину и получает nonce.
+
+        Args:
+            items: Список (product_id, quantity)
+            warm_session: Подготовленная сессия из пула (клиент создан с ее cookies)
+
+        Returns:
+            PreparedCheckout или None при ошибке
+        """
+        try:
+            if warm_session is not None:
+                first_product_id, first_quantity = items[0]
+                if await self.add_to_cart_ajax(first_product_id, first_quantity):
+                    for product_id, quantity in items[1:]:
+                        if not await self.add_to_cart_ajax(product_id, quantity):
+                            # Корзина заполнена частично - обычный путь добавил бы товары повторно
+                            logger.error(f"Не удалось добавить товар {product_id} в подготовленную сессию")
+                            return None
+                    return PreparedCheckout(
+                        warm_session.nonce, warm_session.payment_method, warm_session.hidden_fields
+                    )
+                # Сессия могла истечь на сервере - готовим заказ обычным путем
+                print("⚠️  Подготовленная сессия не принята, использую обычный путь")
+
+            if not await self.add_items_to_cart(items):
+                return None
+
+            fields = await self.fetch_checkout_fields()
+            if fields is None:
+                return None
+            return PreparedCheckout(fields.nonce, fields.payment_method, fields.hidden_fields)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке заказа: {str(e)}")
+            set_order_outcome(error_outcome(e))
+            return None
+
+    @track_order('httpx')
+    async def complete_checkout(self, user_data: Dict, prepared: PreparedCheckout) -> Dict:
+        """
+        Отправляет форму для корзины, подготовленной prepare_checkout.
+        Если WooCommerce отклонил nonce или сессию, повторяем через обычную
+        страницу checkout. Остальные отказы (ошибки в полях формы) возвращаются
+        как есть - повторная отправка вернула бы ту же ошибку.
+
+        Args:
+            user_data: Данные пользователя
+            prepared: Результат prepare_checkout
+
+        Returns:
+            Результат оформления заказа
+        """
+        try:
+            result, stale = await self.submit_checkout(
+                user_data, prepared.nonce, prepared.payment_method, prepared.hidden_fields
+            )
+            if stale:
+                # Товар уже в корзине, нужен только свежий nonce со страницы checkout
+                print("⚠️  Подготовленный nonce отклонен, получаю новый")
+                # Отказ устаревшего nonce - не итог заказа: его определит повтор
+                reset_order_outcome()
+                return await self._place_order_with_requests(user_data)
+            return result
+        except CircuitOpenError as e:
+            return site_unavailable_result(e.retry_after)
+        except Exception as e:
+            logger.error(f"Ошибка при оформлении заказа: {str(e)}")
+            set_order_outcome(error_outcome(e))
+            return {
+                'success': False,
+                'message': f'Произошла ошибка: {str(e)}',
+                'order_id': None
+            }
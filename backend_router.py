@@ -0,0 +1,245 @@
+"""
+Выбор способа оформления заказа: HTTP-запросы или браузер (Selenium)
+
+По умолчанию заказы идут дешевым HTTP-путем. Роутер хранит результаты
+последних заказов каждого способа (скользящее окно) и, если доля успешных
+HTTP-заказов падает ниже ORDER_BACKEND_MIN_SUCCESS (например, после
+изменения сайта перестал извлекаться nonce), переключает заказы на браузер.
+Неудачей считаются только сбои самого способа (BACKEND_FAILURES): отказ
+сайта из-за данных покупателя HTTP-путь на браузер не переключает.
+Пока заказы идут через браузер, фоновая задача периодически проверяет
+HTTP-путь без отправки заказа (корзина + nonce, как при подготовке сессии
+пула) и после успешной проверки возвращает заказы на HTTP.
+
+Использование:
+    await order_router.start()                   # при запуске бота
+    backend = order_router.choose()              # 'http' или 'browser'
+    order_router.record(backend, result, elapsed)
+    await order_router.stop()                    # при остановке бота
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from async_samal_api import AsyncSamalAPI
+from browser_pool import SELENIUM_AVAILABLE
+from config import (
+    ORDER_BACKEND,
+    ORDER_BACKEND_WINDOW,
+    ORDER_BACKEND_MIN_SAMPLES,
+    ORDER_BACKEND_MIN_SUCCESS,
+    ORDER_BACKEND_PROBE_INTERVAL,
+)
+from resilience import samal_breaker
+from tracing import trace
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+BACKEND_HTTP = 'http'
+BACKEND_BROWSER = 'browser'
+
+# Итоги заказа (metrics.track_order), которые говорят о сбое способа оформления.
+# Отказы из-за данных покупателя (checkout_rejected: неверный телефон, адрес)
+# и пустая корзина способ оформления не характеризуют и в статистику не идут.
+BACKEND_FAILURES = frozenset({
+    'nonce_missing', 'order_id_missing', 'checkout_page_failed', 'timeout', 'transport_error', 'browser_error',
+})
+
+
+class BackendStats:
+    """Результаты последних заказов одного способа: (успех, длительность в секундах)"""
+
+    def __init__(self, window: int):
+        self._samples: Deque[Tuple[bool, Optional[float]]] = deque(maxlen=max(1, window))
+
+    def add(self, success: bool, elapsed: Optional[float]) -> None:
+        self._samples.append((success, elapsed))
+
+    def clear(self) -> None:
+        self._samples.clear()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    @property
+    def success_rate(self) -> float:
+        if not self._samples:
+            return 1.0
+        return sum(1 for success, _ in self._samples if success) / len(self._samples)
+
+    def summary(self) -> Dict:
+        latencies = sorted(elapsed for _, elapsed in self._samples if elapsed is not None)
+        return {
+            'samples': len(self._samples),
+            'success_rate': round(self.success_rate, 3),
+            'p50_ms': int(_percentile(latencies, 0.50) * 1000),
+            'p95_ms': int(_percentile(latencies, 0.95) * 1000),
+        }
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+class BackendRouter:
+    """
+    Адаптивный выбор HTTP/браузер.
+
+    Потокобезопасен: результаты пишут воркеры очереди, статистику может
+    читать любой поток.
+    """
+
+    def __init__(self, mode: str = ORDER_BACKEND, window: int = ORDER_BACKEND_WINDOW,
+                 min_samples: int = ORDER_BACKEND_MIN_SAMPLES, min_success: float = ORDER_BACKEND_MIN_SUCCESS,
+                 probe_interval: float = ORDER_BACKEND_PROBE_INTERVAL):
+        """
+        Args:
+            mode: 'auto' - выбирать по статистике, 'http' или 'browser' - всегда этот способ
+            window: Сколько последних заказов каждого способа учитывать
+            min_samples: Минимум заказов в окне, чтобы считать HTTP-путь сломанным
+            min_success: Доля успешных HTTP-заказов, ниже которой включается браузер
+            probe_interval: Как часто проверять HTTP-путь, пока заказы идут через браузер (сек)
+        """
+        self.mode = mode
+        self.min_samples = max(1, min_samples)
+        self.min_success = min_success
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stats = {BACKEND_HTTP: BackendStats(window), BACKEND_BROWSER: BackendStats(window)}
+        self._fallback = False
+        self._fallback_since = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def browser_available(self) -> bool:
+        return SELENIUM_AVAILABLE
+
+    @property
+    def in_fallback(self) -> bool:
+        """True, если заказы сейчас идут через браузер из-за сбоев HTTP-пути"""
+        return self._fallback
+
+    def choose(self) -> str:
+        """Способ оформления следующего заказа: 'http' или 'browser'"""
+        if self.mode == BACKEND_BROWSER and self.browser_available:
+            return BACKEND_BROWSER
+        if self.mode != 'auto' or not self.browser_available:
+            return BACKEND_HTTP
+        with self._lock:
+            if not self._fallback:
+                return BACKEND_HTTP
+            browser = self._stats[BACKEND_BROWSER]
+            # Браузер тоже не справляется - нет смысла платить за него
+            if len(browser) >= self.min_samples and browser.success_rate < self._stats[BACKEND_HTTP].success_rate:
+                return BACKEND_HTTP
+            return BACKEND_BROWSER
+
+    def record(self, backend: str, result: Dict, elapsed: float) -> None:
+        """
+        Учитывает результат заказа
+
+        Args:
+            backend: Способ, которым оформлялся заказ
+            result: Результат create_order (с итогом result['outcome'] от track_order)
+            elapsed: Длительность оформления (секунды)
+        """
+        if result.get('site_unavailable'):
+            # Сайт недоступен целиком - способ оформления тут ни при чем
+            return
+        success = bool(result.get('success'))
+        if not success and result.get('outcome') not in BACKEND_FAILURES:
+            return
+        with self._lock:
+            stats = self._stats[backend]
+            stats.add(success, elapsed)
+            rate = stats.success_rate
+            switch = (backend == BACKEND_HTTP and not self._fallback and self.mode == 'auto'
+                      and self.browser_available and len(stats) >= self.min_samples
+                      and rate < self.min_success)
+            if switch:
+                self._fallback = True
+                self._fallback_since = time.monotonic()
+        if not switch:
+            return
+        logger.error(f"HTTP-путь заказа дает {rate:.0%} успешных заказов, переключаюсь на браузер")
+        trace('backend_fallback', level='warning', location='backend_router.py:record',
+              success_rate=round(rate, 3))
+
+    async def start(self) -> None:
+        """Запускает фоновую проверку HTTP-пути"""
+        if self.mode != 'auto' or not self.browser_available or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def probe_http(self) -> bool:
+        """
+        Проверяет HTTP-путь без отправки заказа: корзина, страница checkout и nonce
+
+        Returns:
+            True, если заказ через HTTP снова можно оформить
+        """
+        started = time.monotonic()
+        async with AsyncSamalAPI() as api:
+            session = await api.warm_session(ttl=0)
+        ok = session is not None
+        trace('backend_probe', level='debug', location='backend_router.py:probe_http',
+              ok=ok, elapsed_ms=int((time.monotonic() - started) * 1000))
+        return ok
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            # Пока сайт недоступен целиком, проверка ничего не скажет о HTTP-пути
+            if not self._fallback or samal_breaker.is_open:
+                continue
+            try:
+                ok = await self.probe_http()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при проверке HTTP-пути: {str(e)}")
+                ok = False
+            if ok:
+                self._restore()
+
+    def _restore(self) -> None:
+        with self._lock:
+            if not self._fallback:
+                return
+            self._fallback = False
+            # Старые сбои не должны сразу вернуть заказы на браузер
+            self._stats[BACKEND_HTTP].clear()
+            duration = time.monotonic() - self._fallback_since
+        print("✅ HTTP-путь заказа снова работает")
+        trace('backend_restored', location='backend_router.py:_restore', fallback_seconds=int(duration))
+
+    def stats(self) -> Dict:
+        """Статистика способов оформления и текущий режим"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'fallback': self._fallback,
+                BACKEND_HTTP: self._stats[BACKEND_HTTP].summary(),
+                BACKEND_BROWSER: self._stats[BACKEND_BROWSER].summary(),
+            }
+
+
+# Общий роутер бота
+order_router = BackendRouter()
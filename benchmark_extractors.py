@@ -0,0 +1,264 @@
+"""
+Микро-бенчмарк функций разбора HTML (nonce, способ оплаты, номер заказа)
+
+Страницы для замеров строятся из checkout_page.html: исходная страница,
+увеличенная страница, варианты, где срабатывают только запасные регулярные
+выражения, и страницы без искомых данных. Для каждого экстрактора и страницы
+измеряется время вызова, пропускная способность (МБ/с) и пик выделенной
+памяти (tracemalloc).
+
+Замеры идут раундами: в каждом раунде сначала калибровка (эталонная работа
+из регулярного выражения, стандартного html.parser и цикла на Python), затем
+по одной серии каждого экстрактора. Время серии делится на калибровку того
+же раунда, а в отчет идет медиана по раундам - так изменение частоты
+процессора и фоновая нагрузка действуют на обе величины одинаково, а
+случайные выбросы отбрасываются. Сохраненный результат можно сравнивать
+между запусками на одной машине:
+    python benchmark_extractors.py --save          # до изменения парсера
+    python benchmark_extractors.py --compare       # после: код 1 при регрессии
+    python benchmark_extractors.py --compare --threshold 2 --only extract_nonce
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import timeit
+import tracemalloc
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+from checkout_parser import parse_checkout_chunks
+from samal_api import CHECKOUT_CHUNK_SIZE, CheckoutPageMixin
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkout_page.html')
+BASELINE_PATH = 'bench_baseline.json'
+# Во сколько раз (время или память) результат может быть хуже сохраненного.
+# Разброс медиан между запусками на одной машине - в пределах 15%
+DEFAULT_THRESHOLD = 1.5
+# Раундов замеров (в отчет идет медиана)
+ROUNDS = 9
+# Минимальная длительность одной серии вызовов (секунды)
+MIN_SERIES_TIME = 0.05
+
+NONCE_ATTRS = 'name="woocommerce-process-checkout-nonce" value="'
+ORDER_ID = '189575'
+
+
+def build_pages() -> Dict[str, str]:
+    """Страницы для замеров"""
+    with open(TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+        checkout = f.read()
+
+    filler = '<div class="product-card"><img src="/p.jpg"><span>Вода Samal 18,9 л</span></div>\n' * 2000
+    # Способ оплаты без checked - срабатывает только второй шаблон
+    no_checked = re.sub(r'\s+checked(=["\']checked["\'])?', '', checkout)
+    order_tail = (f'<ul class="woocommerce-order-overview"><li class="woocommerce-order-overview__order">'
+                  f'Номер заказа: <strong>{ORDER_ID}</strong></li></ul></body></html>')
+
+    return {
+        'checkout': checkout,
+        # Большая страница: товары и виджеты перед формой
+        'checkout_large': checkout.replace('<body', filler + '<body', 1),
+        # Nonce находится только запасным шаблоном (между name и value есть другой атрибут)
+        'checkout_nonce_fallback': checkout.replace(
+            NONCE_ATTRS, 'name="woocommerce-process-checkout-nonce" autocomplete="off" value="'),
+        'checkout_no_checked_payment': no_checked,
+        # Ни nonce, ни способа оплаты - проходят все шаблоны до конца
+        'checkout_no_match': re.sub(r'payment[_-]?method', 'pm', checkout.replace(
+            'woocommerce-process-checkout-nonce', 'checkout-token')),
+        'order_received_url': checkout.replace('</body>', f'<a href="/checkout/order-received/{ORDER_ID}/?key=wc">'
+                                                          f'Заказ</a></body>', 1),
+        'order_received_overview': re.sub(r'order-received/\d+', '', checkout).replace('</body></html>', order_tail),
+        'order_missing': re.sub(r'order-received/\d+', '', checkout),
+    }
+
+
+def regex_checkout_fields(mixin: CheckoutPageMixin, body: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Nonce и способ оплаты так, как их получали до потокового разбора"""
+    html = body.decode('utf-8')
+    return mixin.extract_nonce(html), mixin.extract_payment_method(html)
+
+
+def build_cases(pages: Dict[str, str]) -> List[Tuple[str, str, Callable[[], object]]]:
+    """(экстрактор, страница, вызов) для всех осмысленных сочетаний"""
+    mixin = CheckoutPageMixin()
+    cases = []
+    checkout_pages = [name for name in pages if name.startswith('checkout')]
+    order_pages = [name for name in pages if name.startswith('order_')] + ['checkout_large']
+    for name in checkout_pages:
+        html = pages[name]
+        body = html.encode('utf-8')
+        # Страница в том виде, в каком ее отдает потоковая загрузка
+        chunks = [body[i:i + CHECKOUT_CHUNK_SIZE] for i in range(0, len(body), CHECKOUT_CHUNK_SIZE)]
+        cases.append(('extract_nonce', name, lambda html=html: mixin.extract_nonce(html)))
+        cases.append(('extract_payment_method', name, lambda html=html: mixin.extract_payment_method(html)))
+        # Путь до потокового разбора: декодирование всего ответа и регулярные выражения
+        cases.append(('regex_checkout_fields', name, lambda body=body: regex_checkout_fields(mixin, body)))
+        cases.append(('parse_checkout_chunks', name, lambda chunks=chunks: parse_checkout_chunks(chunks)))
+    for name in order_pages:
+        html = pages[name]
+        cases.append(('extract_order_id', name, lambda html=html: mixin.extract_order_id(html)))
+    return cases
+
+
+def calibration_workload(html: str) -> Callable[[], object]:
+    """
+    Эталонная работа, похожая на экстракторы по составу: проход регулярного
+    выражения (код на C), разбор начала страницы стандартным html.parser
+    (интерпретатор) и простой цикл на Python. Код бота в ней не участвует.
+    """
+    pattern = re.compile(r'zzz-not-present-(\d+)')
+    head = html[:20000]
+
+    def workload() -> int:
+        pattern.search(html)
+        parser = HTMLParser()
+        parser.feed(head)
+        parser.close()
+        return sum(i * i for i in range(2000))
+    return workload
+
+
+class Series:
+    """Серия вызовов одной функции с числом повторов, подобранным один раз"""
+
+    def __init__(self, func: Callable[[], object]):
+        self.timer = timeit.Timer(func)
+        self.number = 1
+        while self.timer.timeit(self.number) < MIN_SERIES_TIME:
+            self.number *= 2
+
+    def measure(self) -> float:
+        """Время одного вызова в этой серии, микросекунды"""
+        return self.timer.timeit(self.number) / self.number * 1_000_000
+
+
+def peak_allocation(func: Callable[[], object]) -> int:
+    """Пик памяти, выделенной за один вызов, байты"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(only: Optional[str] = None) -> Dict:
+    """
+    Выполняет замеры
+
+    Args:
+        only: Имя экстрактора (None - все)
+
+    Returns:
+        Словарь: calibration_us и results ("экстрактор/страница" -> замеры)
+    """
+    pages = build_pages()
+    cases = [case for case in build_cases(pages) if not only or case[0] == only]
+    # Экстракторы печатают и логируют результат - в замерах это только шум
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            calibration = Series(calibration_workload(pages['checkout']))
+            series = []
+            for _, _, func in cases:
+                func()  # прогрев (компиляция регулярных выражений)
+                series.append(Series(func))
+
+            calibration_times = []
+            times: List[List[float]] = [[] for _ in cases]
+            relative: List[List[float]] = [[] for _ in cases]
+            for _ in range(ROUNDS):
+                calibration_us = calibration.measure()
+                calibration_times.append(calibration_us)
+                for index, case_series in enumerate(series):
+                    elapsed_us = case_series.measure()
+                    times[index].append(elapsed_us)
+                    relative[index].append(elapsed_us / calibration_us)
+
+            results = {}
+            for index, (extractor, page, func) in enumerate(cases):
+                elapsed_us = statistics.median(times[index])
+                results[f"{extractor}/{page}"] = {
+                    'us': round(elapsed_us, 2),
+                    'relative': round(statistics.median(relative[index]), 4),
+                    'mb_per_s': round(len(pages[page].encode('utf-8')) / elapsed_us, 1),
+                    'peak_bytes': peak_allocation(func),
+                }
+    finally:
+        logging.disable(logging.NOTSET)
+    return {'calibration_us': round(statistics.median(calibration_times), 2), 'results': results}
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None) -> None:
+    print(f"Калибровка: {report['calibration_us']} мкс\n")
+    print(f"{'экстрактор/страница':<55}{'мкс':>10}{'МБ/с':>9}{'память, КБ':>12}{'к базе':>9}")
+    for key, item in report['results'].items():
+        ratio = ''
+        if baseline and key in baseline['results']:
+            ratio = f"{item['relative'] / baseline['results'][key]['relative']:.2f}x"
+        print(f"{key:<55}{item['us']:>10.1f}{item['mb_per_s']:>9.1f}{item['peak_bytes'] / 1024:>12.1f}{ratio:>9}")
+
+
+def find_regressions(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Замеры, которые хуже сохраненных более чем в threshold раз"""
+    regressions = []
+    for key, item in report['results'].items():
+        base = baseline['results'].get(key)
+        if not base:
+            continue
+        time_ratio = item['relative'] / base['relative']
+        if time_ratio > threshold:
+            regressions.append(f"{key}: время x{time_ratio:.2f}")
+        # Небольшие выделения памяти сильно зависят от версии Python - сравниваем от 4 КБ
+        if base['peak_bytes'] >= 4096 and item['peak_bytes'] / base['peak_bytes'] > threshold:
+            regressions.append(f"{key}: память x{item['peak_bytes'] / base['peak_bytes']:.2f}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарк разбора HTML страниц samal.kz')
+    parser.add_argument('--save', action='store_true', help='Сохранить результат как базовый')
+    parser.add_argument('--compare', action='store_true', help='Сравнить с базовым, код 1 при регрессии')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Файл базового результата')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Допустимое ухудшение (1.5 - на 50%%)')
+    parser.add_argument('--only', help='Только один экстрактор (extract_nonce, extract_order_id, ...)')
+    args = parser.parse_args(argv)
+
+    report = run(args.only)
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"❌ Нет базового результата {args.baseline}, сначала запустите с --save")
+            return 2
+
+    print_report(report, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Базовый результат сохранен в {args.baseline}")
+
+    if baseline is not None:
+        regressions = find_regressions(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ Регрессия (порог x{args.threshold}):")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print(f"\n✅ Регрессий нет (порог x{args.threshold})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
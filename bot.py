@@ -1,20 +1,46 @@
 """
 Telegram бот для заказа воды Samal
 """
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
+from typing import Optional
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    KeyboardButton,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+)
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
 
-from config import TELEGRAM_BOT_TOKEN, PRODUCTS, DEFAULT_PRODUCT_ID, DEFAULT_QUANTITY
-from database import Database
-from samal_api import SamalAPI
+from backend_router import order_router
+from browser_pool import SELENIUM_AVAILABLE, BrowserNotReady, check_browser_ready
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    PRODUCTS,
+    DEFAULT_PRODUCT_ID,
+    DEFAULT_QUANTITY,
+    BROWSER_CHECK_ON_START,
+    ORDER_CONVERSATION_TIMEOUT,
+)
+from database import AsyncDatabase
+from http_transport import aclose_shared_transport
+from metrics import register_cache_metrics, start_metrics_server
+from order_queue import order_workers
+from resilience import samal_breaker
+from samal_api import site_unavailable_result
+from session_pool import checkout_pool
+from speculative_checkout import SpeculativeCheckout
 
 # Настройка логирования (только ошибки для production)
 logging.basicConfig(
@@ -26,10 +52,15 @@ logger = logging.getLogger(__name__)
 # Состояния разговора
 (CHOOSING_ACTION, CHOOSING_PRODUCT, CHOOSING_QUANTITY, ENTERING_NAME, ENTERING_PHONE, 
  ENTERING_ADDRESS, ENTERING_COMMENT, CONFIRMING_ORDER, EDIT_MENU, EDIT_NAME, 
- EDIT_PHONE, EDIT_ADDRESS, EDIT_COMMENT, CONFIRM_DELETE) = range(14)
+ EDIT_PHONE, EDIT_ADDRESS, EDIT_COMMENT, CONFIRM_DELETE, EDITING_BASKET) = range(15)
 
 # Инициализация базы данных
-db = Database()
+db = AsyncDatabase()
+
+# Заказов на одной странице истории
+HISTORY_PAGE_SIZE = 10
+# callback_data кнопки "Показать еще": history:<номер первого заказа>:<id>:<created_at>
+HISTORY_CALLBACK_PREFIX = 'history:'
 
 
 def get_main_menu_keyboard(has_user_data=False):
@@ -46,13 +77,73 @@ def get_main_menu_keyboard(has_user_data=False):
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+def get_product_key_by_id(product_id: int) -> Optional[str]:
+    """Возвращает ключ PRODUCTS по ID товара на сайте"""
+    for key, prod in PRODUCTS.items():
+        if prod['id'] == product_id:
+            return key
+    return None
+
+
+def get_basket_items(context: ContextTypes.DEFAULT_TYPE) -> list:
+    """
+    Товары корзины в формате заказа
+    
+    Returns:
+        Список словарей: product_id, product_name, quantity, price
+    """
+    items = []
+    for entry in context.user_data.get('basket', []):
+        product = PRODUCTS[entry['product_key']]
+        items.append({
+            'product_id': product['id'],
+            'product_name': product['name'],
+            'quantity': entry['quantity'],
+            'price': product['price']
+        })
+    return items
+
+
+def format_basket(context: ContextTypes.DEFAULT_TYPE) -> tuple:
+    """
+    Текст со списком товаров корзины
+    
+    Returns:
+        (текст, общая сумма)
+    """
+    text = ""
+    total_price = 0
+    for entry in context.user_data.get('basket', []):
+        product = PRODUCTS[entry['product_key']]
+        quantity = entry['quantity']
+        pack_size = product.get('pack_size', 1)
+        price = product['price'] * quantity
+        total_price += price
+        
+        text += f"🚰 {product['name']}\n"
+        text += f"   📦 Количество: {quantity}"
+        if pack_size > 1:
+            text += f" упаковок ({quantity * pack_size} ед.)"
+        else:
+            text += " бутылей"
+        text += f" - {price}₸\n"
+    return text, total_price
+
+
+async def discard_speculative_checkout(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выбрасывает заранее подготовленную корзину (если есть)"""
+    speculative = context.user_data.pop('speculative_checkout', None)
+    if speculative:
+        await speculative.discard()
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик команды /start"""
     user = update.effective_user
     chat_id = update.effective_chat.id
     
     # Проверяем есть ли пользователь в базе
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     
     welcome_text = f"👋 Здравствуйте, {user.first_name}!\n\n"
@@ -76,7 +167,7 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик главного меню"""
     text = update.message.text
     chat_id = update.effective_chat.id
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     
     if text == "🚰 Быстрый заказ":
@@ -87,26 +178,29 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return ConversationHandler.END
         
-        # Показываем последний заказ или стандартный продукт
-        recent_orders = db.get_user_orders(chat_id, limit=1)
+        # Повторяем последний заказ (все его товары) или берем стандартный продукт
+        recent_orders = await db.get_user_orders(chat_id, limit=1)
+        basket = []
         
         if recent_orders and len(recent_orders) > 0:
             last_order = recent_orders[0]
-            # Находим продукт по имени
-            selected_product = None
-            for key, product in PRODUCTS.items():
-                if product['name'] == last_order['product_name']:
-                    selected_product = product
-                    context.user_data['product'] = product
-                    context.user_data['product_key'] = key
-                    context.user_data['quantity'] = last_order['quantity']
-                    break
+            for item in await db.get_order_items(last_order['id']):
+                key = get_product_key_by_id(item['product_id'])
+                if key:
+                    basket.append({'product_key': key, 'quantity': item['quantity']})
+            
+            if not basket:
+                # Заказ из одного товара старого формата - находим продукт по имени
+                for key, product in PRODUCTS.items():
+                    if product['name'] == last_order['product_name']:
+                        basket.append({'product_key': key, 'quantity': last_order['quantity']})
+                        break
         
-        if not selected_product:
+        if not basket:
             # Используем продукт по умолчанию
-            context.user_data['product'] = PRODUCTS['18.9л']
-            context.user_data['product_key'] = '18.9л'
-            context.user_data['quantity'] = DEFAULT_QUANTITY
+            basket.append({'product_key': '18.9л', 'quantity': DEFAULT_QUANTITY})
+        
+        context.user_data['basket'] = basket
         
         # Сразу показываем подтверждение
         return await show_order_confirmation(update, context, user_data)
@@ -134,9 +228,15 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начало процесса заказа"""
-    chat_id = update.effective_chat.id
-    user_data = db.get_user(chat_id)
+    # Новый заказ - пустая корзина
+    context.user_data['basket'] = []
+    await discard_speculative_checkout(context)
     
+    return await choose_product(update, context)
+
+
+async def choose_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Показывает список продуктов"""
     # Создаем клавиатуру с продуктами
     keyboard = []
     for key, product in PRODUCTS.items():
@@ -209,11 +309,59 @@ async def quantity_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return CHOOSING_QUANTITY
         
-        context.user_data['quantity'] = quantity
+        # Кладем товар в корзину (повторный выбор того же товара меняет количество)
+        basket = context.user_data.setdefault('basket', [])
+        product_key = context.user_data['product_key']
+        for entry in basket:
+            if entry['product_key'] == product_key:
+                entry['quantity'] = quantity
+                break
+        else:
+            basket.append({'product_key': product_key, 'quantity': quantity})
         
+        return await show_basket(update, context)
+            
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Пожалуйста, введите корректное число:"
+        )
+        return CHOOSING_QUANTITY
+
+
+async def show_basket(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Показывает корзину и предлагает добавить товар или оформить заказ"""
+    basket_text, total_price = format_basket(context)
+    
+    text = "🧺 Ваша корзина:\n\n" + basket_text
+    text += f"\n💰 Итого: {total_price}₸\n\n"
+    text += "Добавить еще товар или оформить заказ?"
+    
+    keyboard = [
+        [KeyboardButton("➕ Добавить товар")],
+        [KeyboardButton("✅ Оформить заказ")],
+        [KeyboardButton("❌ Отменить")]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    
+    await update.message.reply_text(text, reply_markup=reply_markup)
+    
+    return EDITING_BASKET
+
+
+async def basket_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработка действий с корзиной"""
+    choice = update.message.text
+    
+    if choice == "❌ Отменить":
+        return await cancel(update, context)
+    
+    if choice == "➕ Добавить товар":
+        return await choose_product(update, context)
+    
+    if choice == "✅ Оформить заказ":
         # Проверяем есть ли данные пользователя
         chat_id = update.effective_chat.id
-        user_data = db.get_user(chat_id)
+        user_data = await db.get_user(chat_id)
         
         if user_data and user_data.get('phone') and user_data.get('address'):
             # Данные есть, показываем подтверждение
@@ -221,15 +369,15 @@ async def quantity_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         else:
             # Данных нет, запрашиваем
             await update.message.reply_text(
-                "👤 Введите ваше имя:"
+                "👤 Введите ваше имя:",
+                reply_markup=ReplyKeyboardRemove()
             )
             return ENTERING_NAME
-            
-    except ValueError:
-        await update.message.reply_text(
-            "❌ Пожалуйста, введите корректное число:"
-        )
-        return CHOOSING_QUANTITY
+    
+    await update.message.reply_text(
+        "❌ Пожалуйста, выберите действие с помощью кнопок."
+    )
+    return EDITING_BASKET
 
 
 async def name_entered(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -284,7 +432,7 @@ async def comment_entered(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Сохраняем данные пользователя
     chat_id = update.effective_chat.id
-    db.save_user(
+    await db.save_user(
         chat_id,
         first_name=context.user_data.get('first_name', ''),
         phone=context.user_data.get('phone', ''),
@@ -305,21 +453,10 @@ async def comment_entered(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def show_order_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, user_data: dict) -> int:
     """Показывает подтверждение заказа"""
-    product = context.user_data['product']
-    quantity = context.user_data['quantity']
-    
-    # Рассчитываем стоимость
-    pack_size = product.get('pack_size', 1)
-    total_items = quantity * pack_size if pack_size > 1 else quantity
-    total_price = product['price'] * quantity
+    basket_text, total_price = format_basket(context)
     
     confirmation_text = "📋 Подтверждение заказа:\n\n"
-    confirmation_text += f"🚰 Товар: {product['name']}\n"
-    confirmation_text += f"📦 Количество: {quantity}"
-    if pack_size > 1:
-        confirmation_text += f" упаковок ({total_items} ед.)"
-    else:
-        confirmation_text += " бутылей"
+    confirmation_text += basket_text
     confirmation_text += f"\n💰 Сумма: {total_price}₸\n\n"
     
     confirmation_text += f"👤 Имя: {user_data.get('first_name', '')}\n"
@@ -338,6 +475,14 @@ async def show_order_confirmation(update: Update, context: ContextTypes.DEFAULT_
     
     await update.message.reply_text(confirmation_text, reply_markup=reply_markup)
     
+    # Пока пользователь читает подтверждение, в фоне добавляем товары в корзину
+    # и получаем nonce - после подтверждения останется только отправить форму
+    await discard_speculative_checkout(context)
+    if not samal_breaker.is_open:
+        context.user_data['speculative_checkout'] = SpeculativeCheckout([
+            (item['product_id'], item['quantity']) for item in get_basket_items(context)
+        ])
+    
     return CONFIRMING_ORDER
 
 
@@ -345,10 +490,11 @@ async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     """Подтверждение и отправка заказа"""
     choice = update.message.text
     chat_id = update.effective_chat.id
-    user_data_db = db.get_user(chat_id)
+    user_data_db = await db.get_user(chat_id)
     has_data = user_data_db and user_data_db.get('phone')
     
     if choice == "❌ Отменить":
+        await discard_speculative_checkout(context)
         keyboard = get_main_menu_keyboard(has_data)
         await update.message.reply_text(
             "❌ Заказ отменен.",
@@ -357,84 +503,76 @@ async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return ConversationHandler.END
     
     if choice == "✅ Подтвердить заказ":
-        # Отправляем заказ
-        await update.message.reply_text(
-            "⏳ Обрабатываю заказ...",
-            reply_markup=ReplyKeyboardRemove()
-        )
+        # Сайт недавно перестал отвечать - сообщаем сразу, а не после таймаутов
+        if samal_breaker.is_open:
+            await discard_speculative_checkout(context)
+            result = site_unavailable_result(samal_breaker.retry_after())
+            await update.message.reply_text(
+                f"⚠️ {result['message']}\n\nВаш заказ не отправлен.",
+                reply_markup=get_main_menu_keyboard(has_data)
+            )
+            return ConversationHandler.END
         
-        chat_id = update.effective_chat.id
-        product = context.user_data['product']
-        quantity = context.user_data['quantity']
+        items = get_basket_items(context)
+        if not items:
+            await update.message.reply_text(
+                "❌ Корзина пуста. Нажмите '📦 Новый заказ'.",
+                reply_markup=get_main_menu_keyboard(has_data)
+            )
+            return ConversationHandler.END
         
         # Получаем данные пользователя из БД
-        user_data = db.get_user(chat_id)
+        user_data = await db.get_user(chat_id)
         
-        # Создаем API клиент и отправляем заказ
-        api = SamalAPI()
-        
-        # Получаем product_id из конфига PRODUCTS
-        product_id = None
-        for key, prod in PRODUCTS.items():
-            if prod['name'] == product['name']:
-                product_id = prod['id']
-                break
+        total_price = sum(item['price'] * item['quantity'] for item in items)
+        if len(items) == 1:
+            product_name = items[0]['product_name']
+        else:
+            product_name = ", ".join(f"{item['product_name']} × {item['quantity']}" for item in items)
+        order_user_data = {
+            'first_name': user_data.get('first_name', ''),
+            'phone': user_data.get('phone', ''),
+            'address': user_data.get('address', ''),
+            'comment': user_data.get('comment', '')
+        }
         
-        if not product_id:
-            product_id = DEFAULT_PRODUCT_ID
+        payload = {
+            'items': items,
+            'total_price': total_price,
+            'user_data': order_user_data
+        }
+        # Подготовленная корзина регистрируется до записи заказа: воркер может
+        # забрать заказ сразу после enqueue_order
+        speculative = context.user_data.pop('speculative_checkout', None)
+        if speculative:
+            payload['speculative_key'] = order_workers.attach_speculative(speculative)
         
-        result = api.create_order(
-            product_id=product_id,
-            quantity=quantity,
-            user_data={
-                'first_name': user_data.get('first_name', ''),
-                'phone': user_data.get('phone', ''),
-                'address': user_data.get('address', ''),
-                'comment': user_data.get('comment', '')
-            }
-        )
+        # Сохраняем заказ в очередь - его отправит на сайт фоновый воркер,
+        # поэтому ответ пользователю не ждет samal.kz
+        try:
+            order_id = await db.enqueue_order(
+                chat_id=chat_id,
+                product_id=items[0]['product_id'],
+                product_name=product_name,
+                quantity=sum(item['quantity'] for item in items),
+                total_price=total_price,
+                payload=payload,
+                items=items
+            )
+        except Exception:
+            if speculative:
+                await order_workers.detach_speculative(payload['speculative_key'])
+            raise
+        context.user_data.pop('basket', None)
         
-        # Сохраняем заказ в БД
-        pack_size = product.get('pack_size', 1)
-        total_price = product['price'] * quantity
-        order_status = 'success' if result['success'] else 'failed'
+        order_workers.wake()
         
-        order_id = db.save_order(
-            chat_id=chat_id,
-            product_id=product_id,
-            product_name=product['name'],
-            quantity=quantity,
-            total_price=total_price,
-            status=order_status
+        await update.message.reply_text(
+            f"⏳ Заказ #{order_id} принят и оформляется на сайте.\n"
+            "Я пришлю сообщение, как только Samal подтвердит заказ.",
+            reply_markup=get_main_menu_keyboard(has_data)
         )
         
-        # Отправляем результат пользователю
-        user_data_final = db.get_user(chat_id)
-        has_data = user_data_final and user_data_final.get('phone')
-        keyboard = get_main_menu_keyboard(has_data)
-        
-        if result['success']:
-            success_text = "✅ Заказ успешно оформлен!\n\n"
-            
-            # Добавляем номер заказа, если он получен от API
-            order_id = result.get('order_id')
-            if order_id:
-                success_text += f"📋 Номер заказа: {order_id}\n\n"
-            
-            success_text += f"🚰 {product['name']}\n"
-            success_text += f"📦 Количество: {quantity}\n"
-            success_text += f"💰 Сумма: {total_price}₸\n\n"
-            success_text += "📞 С вами свяжется оператор для подтверждения доставки.\n\n"
-            success_text += "Спасибо за заказ! 💙\n\n"
-            success_text += "💡 Теперь вы можете использовать кнопку '🚰 Быстрый заказ' для повторных заказов!"
-            
-            await update.message.reply_text(success_text, reply_markup=keyboard)
-        else:
-            error_text = f"❌ Ошибка при оформлении заказа:\n{result['message']}\n\n"
-            error_text += "Пожалуйста, попробуйте позже или свяжитесь с нами напрямую."
-            
-            await update.message.reply_text(error_text, reply_markup=keyboard)
-        
         return ConversationHandler.END
     
     await update.message.reply_text(
@@ -446,7 +584,7 @@ async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показывает профиль пользователя"""
     chat_id = update.effective_chat.id
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     
     if not has_data:
@@ -481,7 +619,7 @@ async def profile_action(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Обработка действий в профиле"""
     text = update.message.text
     chat_id = update.effective_chat.id
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     
     if text == "⬅️ Назад в меню":
@@ -572,9 +710,9 @@ async def save_edited_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     chat_id = update.effective_chat.id
     new_name = update.message.text
     
-    db.save_user(chat_id, first_name=new_name)
+    await db.save_user(chat_id, first_name=new_name)
     
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     keyboard = get_main_menu_keyboard(has_data)
     
@@ -590,9 +728,9 @@ async def save_edited_phone(update: Update, context: ContextTypes.DEFAULT_TYPE)
     chat_id = update.effective_chat.id
     new_phone = update.message.text
     
-    db.save_user(chat_id, phone=new_phone)
+    await db.save_user(chat_id, phone=new_phone)
     
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     keyboard = get_main_menu_keyboard(has_data)
     
@@ -608,9 +746,9 @@ async def save_edited_address(update: Update, context: ContextTypes.DEFAULT_TYPE
     chat_id = update.effective_chat.id
     new_address = update.message.text
     
-    db.save_user(chat_id, address=new_address)
+    await db.save_user(chat_id, address=new_address)
     
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     keyboard = get_main_menu_keyboard(has_data)
     
@@ -633,9 +771,9 @@ async def save_edited_comment(update: Update, context: ContextTypes.DEFAULT_TYPE
         new_comment = text
         message = f"✅ Комментарий успешно изменен на: {new_comment}"
     
-    db.save_user(chat_id, comment=new_comment)
+    await db.save_user(chat_id, comment=new_comment)
     
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     keyboard = get_main_menu_keyboard(has_data)
     
@@ -653,7 +791,7 @@ async def confirm_delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     elif text == "✅ Да, удалить все данные":
         # Удаляем пользователя из базы данных
-        db.delete_user(chat_id)
+        await db.delete_user(chat_id)
         
         keyboard = get_main_menu_keyboard(False)  # has_data = False
         
@@ -668,11 +806,32 @@ async def confirm_delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE
     return CONFIRM_DELETE
 
 
+def format_history_page(orders: list, start: int) -> str:
+    """Текст страницы истории заказов (start - номер первого заказа страницы)"""
+    history_text = ""
+    for i, order in enumerate(orders, start):
+        status_emoji = {'success': "✅", 'pending': "⏳"}.get(order['status'], "❌")
+        history_text += f"{i}. {status_emoji} {order['product_name']}\n"
+        history_text += f"   Количество: {order['quantity']}\n"
+        history_text += f"   Сумма: {order['total_price']}₸\n"
+        history_text += f"   Дата: {order['created_at']}\n\n"
+    return history_text
+
+
+def get_history_more_keyboard(next_number: int, cursor: tuple) -> InlineKeyboardMarkup:
+    """Кнопка следующей страницы истории"""
+    created_at, order_id = cursor
+    return InlineKeyboardMarkup([[InlineKeyboardButton(
+        "⬇️ Показать еще",
+        callback_data=f"{HISTORY_CALLBACK_PREFIX}{next_number}:{order_id}:{created_at}"
+    )]])
+
+
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает историю заказов"""
     chat_id = update.effective_chat.id
-    orders = db.get_user_orders(chat_id, limit=10)
-    user_data = db.get_user(chat_id)
+    orders, cursor = await db.get_order_history(chat_id, limit=HISTORY_PAGE_SIZE)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     
     keyboard = get_main_menu_keyboard(has_data)
@@ -685,22 +844,50 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
     
-    history_text = "📜 История ваших заказов:\n\n"
-    
-    for i, order in enumerate(orders, 1):
-        status_emoji = "✅" if order['status'] == 'success' else "❌"
-        history_text += f"{i}. {status_emoji} {order['product_name']}\n"
-        history_text += f"   Количество: {order['quantity']}\n"
-        history_text += f"   Сумма: {order['total_price']}₸\n"
-        history_text += f"   Дата: {order['created_at']}\n\n"
+    history_text = "📜 История ваших заказов:\n\n" + format_history_page(orders, 1)
     
+    # У сообщения одна клавиатура: если есть еще заказы, под ним кнопка
+    # "Показать еще", а меню остается от предыдущих сообщений
+    if cursor:
+        keyboard = get_history_more_keyboard(len(orders) + 1, cursor)
     await update.message.reply_text(history_text, reply_markup=keyboard)
 
 
+async def history_more(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Следующая страница истории заказов (кнопка "Показать еще")"""
+    query = update.callback_query
+    await query.answer()
+    
+    try:
+        start, order_id, created_at = query.data[len(HISTORY_CALLBACK_PREFIX):].split(':', 2)
+        start, before = int(start), (created_at, int(order_id))
+    except ValueError:
+        logger.error(f"Некорректная кнопка истории: {query.data}")
+        return
+    
+    orders, cursor = await db.get_order_history(update.effective_chat.id, limit=HISTORY_PAGE_SIZE, before=before)
+    # Кнопка нажата - убираем ее, чтобы страницу не загрузили второй раз
+    await query.edit_message_reply_markup(reply_markup=None)
+    
+    if not orders:
+        await query.message.reply_text("📜 Больше заказов нет.")
+        return
+    
+    keyboard = get_history_more_keyboard(start + len(orders), cursor) if cursor else None
+    await query.message.reply_text(format_history_page(orders, start), reply_markup=keyboard)
+
+
+async def order_conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Оформление заказа брошено: выбрасываем подготовленную корзину"""
+    await discard_speculative_checkout(context)
+    context.user_data.pop('basket', None)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отмена текущего действия"""
+    await discard_speculative_checkout(context)
     chat_id = update.effective_chat.id
-    user_data = db.get_user(chat_id)
+    user_data = await db.get_user(chat_id)
     has_data = user_data and user_data.get('phone')
     
     keyboard = get_main_menu_keyboard(has_data)
@@ -713,6 +900,69 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
+async def notify_order_result(application: Application, job: dict, result: dict) -> None:
+    """Отправляет пользователю результат оформления заказа из очереди"""
+    payload = job['payload']
+    user_data = await db.get_user(job['chat_id'])
+    has_data = user_data and user_data.get('phone')
+    keyboard = get_main_menu_keyboard(has_data)
+    
+    if result['success']:
+        success_text = "✅ Заказ успешно оформлен!\n\n"
+        
+        # Добавляем номер заказа, если он получен от API
+        order_id = result.get('order_id')
+        if order_id:
+            success_text += f"📋 Номер заказа: {order_id}\n\n"
+        
+        # Задания до появления корзины содержат один товар
+        items = payload.get('items') or [payload]
+        for item in items:
+            success_text += f"🚰 {item['product_name']}\n"
+            success_text += f"📦 Количество: {item['quantity']}\n"
+        success_text += f"💰 Сумма: {payload['total_price']}₸\n\n"
+        success_text += "📞 С вами свяжется оператор для подтверждения доставки.\n\n"
+        success_text += "Спасибо за заказ! 💙\n\n"
+        success_text += "💡 Теперь вы можете использовать кнопку '🚰 Быстрый заказ' для повторных заказов!"
+        
+        await application.bot.send_message(job['chat_id'], success_text, reply_markup=keyboard)
+    else:
+        error_text = f"❌ Ошибка при оформлении заказа #{job['order_id']}:\n{result['message']}\n\n"
+        error_text += "Пожалуйста, попробуйте позже или свяжитесь с нами напрямую."
+        
+        await application.bot.send_message(job['chat_id'], error_text, reply_markup=keyboard)
+
+
+async def post_init(application: Application) -> None:
+    """Запускает фоновые задачи после инициализации бота"""
+    if SELENIUM_AVAILABLE and BROWSER_CHECK_ON_START:
+        # Ненайденный chromedriver виден в логе сразу, а не на заказе через браузер
+        try:
+            info = await asyncio.to_thread(check_browser_ready)
+            logger.info(f"ChromeDriver {info['driver_version']}: {info['path']}")
+        except BrowserNotReady as e:
+            logger.error(f"Заказ через браузер недоступен: {str(e)}")
+    
+    register_cache_metrics('user_profile', db.sync.user_cache.stats)
+    start_metrics_server()
+    await checkout_pool.start()
+    
+    async def notify(job: dict, result: dict) -> None:
+        await notify_order_result(application, job, result)
+    
+    await order_workers.start(db, notify)
+    await order_router.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Освобождает общие ресурсы при остановке бота"""
+    await order_workers.stop()
+    await order_router.stop()
+    await checkout_pool.stop()
+    await aclose_shared_transport()
+    await db.close()
+
+
 def main():
     """Запуск бота"""
     # Проверяем наличие токена
@@ -721,7 +971,13 @@ def main():
         return
     
     # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Обработчик диалога заказа
     order_conv_handler = ConversationHandler(
@@ -736,9 +992,13 @@ def main():
             ENTERING_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, phone_entered)],
             ENTERING_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, address_entered)],
             ENTERING_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, comment_entered)],
+            EDITING_BASKET: [MessageHandler(filters.TEXT & ~filters.COMMAND, basket_action)],
             CONFIRMING_ORDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_order)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, order_conversation_timeout)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        # Таймаут требует JobQueue (python-telegram-bot[job-queue])
+        conversation_timeout=ORDER_CONVERSATION_TIMEOUT or None,
     )
     
     # Обработчик редактирования профиля
@@ -763,6 +1023,7 @@ def main():
     application.add_handler(profile_conv_handler)
     application.add_handler(CommandHandler('profile', profile))
     application.add_handler(CommandHandler('history', history))
+    application.add_handler(CallbackQueryHandler(history_more, pattern=f'^{HISTORY_CALLBACK_PREFIX}'))
     application.add_handler(CommandHandler('cancel', cancel))
     
     # Запускаем бота
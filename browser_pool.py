@@ -0,0 +1,517 @@
+"""
+Пул запущенных браузеров Chrome для оформления заказа через Selenium
+
+Запуск Chrome занимает несколько секунд, поэтому драйверы не закрываются
+после заказа, а возвращаются в пул. Перед каждым заказом cookies и
+хранилище сайта очищаются, так что заказы не видят корзины друг друга.
+Драйвер, который не отвечает, заменяется новым, а после BROWSER_MAX_USES
+заказов перезапускается (Chrome со временем разрастается по памяти).
+Одновременно работает не больше BROWSER_POOL_SIZE браузеров.
+
+По умолчанию Chrome запускается без окна (headless) и не загружает
+картинки, шрифты, медиа и скрипты аналитики - для оформления заказа нужны
+только HTML, CSS и скрипты WooCommerce.
+
+Путь к chromedriver ищется один раз и запоминается в CHROMEDRIVER_CACHE_PATH,
+поэтому запуск браузера не ищет драйвер заново. check_browser_ready()
+вызывается при старте бота и сообщает о ненайденном драйвере сразу, а не
+на заказе клиента.
+
+Использование:
+    with browser_pool.driver() as driver:
+        driver.get(SAMAL_CHECKOUT_URL)
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from config import (
+    SAMAL_BASE_URL,
+    BROWSER_POOL_SIZE,
+    BROWSER_MAX_USES,
+    BROWSER_ACQUIRE_TIMEOUT,
+    BROWSER_HEADLESS,
+    BROWSER_BLOCK_RESOURCES,
+    BROWSER_EXTRA_BLOCKED_URLS,
+    CHROMEDRIVER_PATH,
+    CHROMEDRIVER_CACHE_PATH,
+    CHROMEDRIVER_RETRY_INTERVAL,
+)
+
+# Импорты для Selenium (опционально, только если используется браузер)
+try:
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+    SELENIUM_AVAILABLE = True
+except ImportError:
+    SELENIUM_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Размер окна вместо maximize_window (не зависит от экрана и работает без него)
+WINDOW_SIZE = '1366,900'
+
+# Запросы, которые браузер не отправляет (шаблоны Network.setBlockedURLs)
+BLOCKED_URL_PATTERNS = [
+    # Картинки, медиа и шрифты
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.mp3', '*.ogg',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    # Аналитика, реклама и виджеты
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*mc.yandex.ru*', '*mc.yandex.kz*', '*connect.facebook.net*', '*facebook.com/tr*',
+    '*top-fwz1.mail.ru*', '*vk.com/rtrg*', '*jivosite.com*', '*jivo.ru*',
+]
+
+# Возможности Chrome, которые не нужны для оформления заказа
+DISABLED_CHROME_FEATURES = 'Translate,OptimizationHints,MediaRouter,InterestFeedContentSuggestions,AutofillServerCommunication'
+
+# Исполняемые файлы Chrome, по которым определяется его версия
+CHROME_BINARIES = ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome')
+
+
+class BrowserPoolTimeout(Exception):
+    """Все браузеры заняты дольше BROWSER_ACQUIRE_TIMEOUT"""
+
+
+@dataclass
+class PooledDriver:
+    """Драйвер в пуле и его счетчик заказов"""
+    driver: object
+    created_at: float = field(default_factory=time.time)
+    uses: int = 0
+
+
+def build_chrome_options() -> 'Options':
+    """Настройки Chrome для оформления заказа"""
+    chrome_options = Options()
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument(f'--window-size={WINDOW_SIZE}')
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    if BROWSER_HEADLESS:
+        chrome_options.add_argument('--headless=new')
+        chrome_options.add_argument('--disable-gpu')
+    # Фоновые службы Chrome только отнимают память и сеть
+    for argument in ('--disable-extensions', '--disable-background-networking', '--disable-sync',
+                     '--disable-default-apps', '--disable-component-update', '--no-first-run',
+                     '--disable-notifications', '--mute-audio', f'--disable-features={DISABLED_CHROME_FEATURES}'):
+        chrome_options.add_argument(argument)
+    if BROWSER_BLOCK_RESOURCES:
+        chrome_options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+        })
+    return chrome_options
+
+
+def configure_driver(driver) -> None:
+    """
+    Настраивает только что запущенный Chrome: блокировка лишних запросов
+    и User-Agent без признака headless
+    """
+    if BROWSER_BLOCK_RESOURCES:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {
+            'urls': BLOCKED_URL_PATTERNS + BROWSER_EXTRA_BLOCKED_URLS,
+        })
+    if BROWSER_HEADLESS:
+        # Сайт видит обычный Chrome, а не HeadlessChrome
+        user_agent = driver.execute_script('return navigator.userAgent')
+        driver.execute_cdp_cmd('Network.setUserAgentOverride', {
+            'userAgent': user_agent.replace('HeadlessChrome', 'Chrome'),
+        })
+
+
+class BrowserNotReady(Exception):
+    """chromedriver не найден или не запускается"""
+
+
+class ChromedriverRetryPending(BrowserNotReady):
+    """chromedriver недавно не нашелся, новый поиск - после CHROMEDRIVER_RETRY_INTERVAL"""
+
+
+# Найденный chromedriver (на весь процесс)
+_resolve_lock = threading.Lock()
+_resolved_driver: Optional[Dict] = None
+_resolve_error: Optional[BrowserNotReady] = None
+# Когда поиск закончился ошибкой (time.monotonic())
+_resolve_failed_at = 0.0
+
+
+def _binary_version(path: str) -> str:
+    """Версия из вывода '<path> --version' (например '141.0.7390.54')"""
+    result = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=15)
+    match = re.search(r'(\d+(?:\.\d+)+)', result.stdout)
+    return match.group(1) if match else ''
+
+
+def _load_driver_cache() -> Optional[Dict]:
+    """Читает запомненный chromedriver, если файл драйвера с тех пор не менялся"""
+    try:
+        with open(CHROMEDRIVER_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        path = cached['path']
+        if os.access(path, os.X_OK) and os.path.getmtime(path) == cached['mtime']:
+            return cached
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _save_driver_cache(info: Dict) -> None:
+    try:
+        with open(CHROMEDRIVER_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить {CHROMEDRIVER_CACHE_PATH}: {str(e)}")
+
+
+def _find_chromedriver() -> str:
+    """
+    Ищет исполняемый файл chromedriver: CHROMEDRIVER_PATH, PATH, webdriver-manager
+
+    Raises:
+        BrowserNotReady: chromedriver не найден
+    """
+    if CHROMEDRIVER_PATH:
+        if not os.access(CHROMEDRIVER_PATH, os.X_OK):
+            raise BrowserNotReady(f"CHROMEDRIVER_PATH={CHROMEDRIVER_PATH} не найден или не исполняемый")
+        return CHROMEDRIVER_PATH
+
+    # Системный ChromeDriver (например, установлен через Homebrew)
+    system_driver = shutil.which('chromedriver')
+    if system_driver:
+        return system_driver
+
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager  # type: ignore
+    except ImportError:
+        raise BrowserNotReady("ChromeDriver не найден в PATH, webdriver-manager не установлен")
+    try:
+        driver_path = ChromeDriverManager().install()
+    except Exception as e:
+        raise BrowserNotReady(f"webdriver-manager не смог загрузить ChromeDriver: {str(e)}")
+    # webdriver-manager иногда возвращает директорию, а не файл
+    if os.path.isdir(driver_path):
+        for root, dirs, files in os.walk(driver_path):
+            if 'chromedriver' in files:
+                driver_path = os.path.join(root, 'chromedriver')
+                break
+        else:
+            raise BrowserNotReady(f"Исполняемый файл chromedriver не найден в {driver_path}")
+    # Делаем файл исполняемым (на macOS/Linux)
+    os.chmod(driver_path, 0o755)
+    return driver_path
+
+
+def _chrome_version() -> str:
+    for name in CHROME_BINARIES:
+        path = shutil.which(name)
+        if path:
+            try:
+                return _binary_version(path)
+            except (OSError, subprocess.SubprocessError):
+                continue
+    return ''
+
+
+def resolve_chromedriver() -> Dict:
+    """
+    Возвращает найденный chromedriver (ищет только при первом вызове)
+
+    Ошибка поиска запоминается на CHROMEDRIVER_RETRY_INTERVAL секунд,
+    затем поиск повторяется.
+
+    Returns:
+        Словарь: path, driver_version, chrome_version, mtime
+
+    Raises:
+        BrowserNotReady: chromedriver не найден
+    """
+    global _resolved_driver, _resolve_error, _resolve_failed_at
+    if _resolved_driver is not None:
+        return _resolved_driver
+    with _resolve_lock:
+        if _resolved_driver is not None:
+            return _resolved_driver
+        if _resolve_error is not None:
+            retry_in = CHROMEDRIVER_RETRY_INTERVAL - (time.monotonic() - _resolve_failed_at)
+            if retry_in > 0:
+                # Недавно искали и не нашли - не повторяем поиск на каждом заказе
+                raise ChromedriverRetryPending(f"{_resolve_error} (повторный поиск через {retry_in:.0f} с)")
+            _resolve_error = None
+        info = _load_driver_cache()
+        if info is None or (CHROMEDRIVER_PATH and info['path'] != CHROMEDRIVER_PATH):
+            try:
+                path = _find_chromedriver()
+                try:
+                    driver_version = _binary_version(path)
+                except (OSError, subprocess.SubprocessError) as e:
+                    raise BrowserNotReady(f"chromedriver {path} не запускается: {str(e)}")
+            except BrowserNotReady as e:
+                _resolve_error = e
+                _resolve_failed_at = time.monotonic()
+                raise
+            info = {
+                'path': path,
+                'driver_version': driver_version,
+                'chrome_version': _chrome_version(),
+                'mtime': os.path.getmtime(path),
+            }
+            _save_driver_cache(info)
+        _resolved_driver = info
+        return info
+
+
+def _remember_found_driver(driver) -> None:
+    """Запоминает chromedriver, который нашел сам Selenium (Selenium Manager)"""
+    global _resolved_driver, _resolve_error
+    path = getattr(getattr(driver, 'service', None), 'path', None)
+    if not path or not os.access(path, os.X_OK):
+        return
+    try:
+        driver_version = _binary_version(path)
+    except (OSError, subprocess.SubprocessError):
+        driver_version = ''
+    info = {
+        'path': path,
+        'driver_version': driver_version,
+        'chrome_version': (driver.capabilities or {}).get('browserVersion', ''),
+        'mtime': os.path.getmtime(path),
+    }
+    with _resolve_lock:
+        _resolved_driver = info
+        _resolve_error = None
+    _save_driver_cache(info)
+
+
+def forget_chromedriver() -> None:
+    """Сбрасывает запомненный chromedriver (например, после обновления Chrome)"""
+    global _resolved_driver, _resolve_error
+    with _resolve_lock:
+        _resolved_driver = None
+        _resolve_error = None
+        try:
+            os.remove(CHROMEDRIVER_CACHE_PATH)
+        except OSError:
+            pass
+
+
+def check_browser_ready() -> Dict:
+    """
+    Быстрая проверка при запуске: chromedriver найден и подходит к Chrome
+
+    Returns:
+        Данные chromedriver (см. resolve_chromedriver)
+
+    Raises:
+        BrowserNotReady: Selenium не установлен или chromedriver не найден
+    """
+    if not SELENIUM_AVAILABLE:
+        raise BrowserNotReady("Selenium не установлен")
+    info = resolve_chromedriver()
+    driver_major = info['driver_version'].split('.')[0]
+    chrome_major = info['chrome_version'].split('.')[0]
+    if driver_major and chrome_major and driver_major != chrome_major:
+        print(f"⚠️  Версии не совпадают: ChromeDriver {info['driver_version']}, Chrome {info['chrome_version']}")
+    return info
+
+
+def create_driver():
+    """
+    Запускает новый Chrome
+
+    Returns:
+        WebDriver
+
+    Raises:
+        ChromedriverRetryPending: chromedriver недавно не нашелся (без новой попытки)
+        Exception: если не удалось создать WebDriver
+    """
+    chrome_options = build_chrome_options()
+    try:
+        try:
+            service = Service(resolve_chromedriver()['path'])
+        except ChromedriverRetryPending:
+            raise
+        except BrowserNotReady as e:
+            # Последняя попытка: Selenium сам ищет драйвер. Если и он не найдет,
+            # до следующего поиска заказы через браузер отклоняются сразу
+            print(f"⚠️  {str(e)}, пробую использовать ChromeDriver из PATH")
+            driver = webdriver.Chrome(options=chrome_options)
+            _remember_found_driver(driver)
+            return driver
+        try:
+            return webdriver.Chrome(service=service, options=chrome_options)
+        except Exception:
+            # Драйвер мог устареть после обновления Chrome - в следующий раз ищем заново
+            forget_chromedriver()
+            raise
+    except ChromedriverRetryPending:
+        raise
+    except Exception as e:
+        error_msg = str(e)
+        print(f"⚠️  Ошибка при создании драйвера: {error_msg}")
+        print("\n💡 Решения:")
+        print("   1. Установите ChromeDriver через Homebrew: brew install chromedriver")
+        print("   2. Или установите webdriver-manager: pip install webdriver-manager")
+        print("   3. Или скачайте ChromeDriver вручную с https://chromedriver.chromium.org/")
+        raise Exception(f"Не удалось создать WebDriver: {error_msg}")
+
+
+class BrowserPool:
+    """
+    Пул долгоживущих драйверов Chrome.
+
+    Потокобезопасен: заказы через браузер выполняются в отдельных потоках
+    (asyncio.to_thread), каждый берет свой драйвер.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_MAX_USES,
+                 acquire_timeout: float = BROWSER_ACQUIRE_TIMEOUT):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: 'queue.LifoQueue[PooledDriver]' = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._all: List[PooledDriver] = []
+        self._closed = False
+        atexit.register(self.close)
+
+    @contextmanager
+    def driver(self) -> Iterator[object]:
+        """
+        Выдает готовый драйвер с чистыми cookies на время одного заказа
+
+        Raises:
+            BrowserPoolTimeout: все браузеры заняты
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise BrowserPoolTimeout(f"Все браузеры заняты ({self.size}), попробуйте позже")
+        pooled = None
+        try:
+            pooled = self._checkout()
+            yield pooled.driver
+        finally:
+            if pooled is not None:
+                self._checkin(pooled)
+            self._slots.release()
+
+    def warm(self, count: Optional[int] = None) -> int:
+        """
+        Заранее запускает браузеры (например, при старте бота)
+
+        Returns:
+            Сколько браузеров запущено
+        """
+        started = 0
+        for _ in range(min(count or self.size, self.size) - len(self._all)):
+            try:
+                self._idle.put(self._launch())
+                started += 1
+            except Exception as e:
+                logger.error(f"Не удалось заранее запустить браузер: {str(e)}")
+                break
+        return started
+
+    def _launch(self) -> PooledDriver:
+        print("🌐 Запускаю браузер для пула...")
+        driver = create_driver()
+        try:
+            configure_driver(driver)
+        except AttributeError:
+            # Не Chrome: CDP недоступен, работаем без блокировки
+            pass
+        except Exception:
+            driver.quit()
+            raise
+        pooled = PooledDriver(driver)
+        with self._lock:
+            self._all.append(pooled)
+        return pooled
+
+    def _checkout(self) -> PooledDriver:
+        """Берет свободный исправный драйвер или запускает новый"""
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                pooled = self._launch()
+                try:
+                    return self._prepare(pooled)
+                except Exception:
+                    # Иначе Chrome остался бы запущенным и навсегда занимал место в пуле
+                    self._discard(pooled)
+                    raise
+            if self._is_healthy(pooled):
+                try:
+                    return self._prepare(pooled)
+                except Exception as e:
+                    logger.error(f"Не удалось очистить сессию браузера: {str(e)}")
+            self._discard(pooled)
+
+    def _checkin(self, pooled: PooledDriver) -> None:
+        """Возвращает драйвер в пул или закрывает его после max_uses заказов"""
+        pooled.uses += 1
+        if self._closed or (self.max_uses > 0 and pooled.uses >= self.max_uses):
+            self._discard(pooled)
+        else:
+            self._idle.put(pooled)
+
+    def _is_healthy(self, pooled: PooledDriver) -> bool:
+        try:
+            pooled.driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+    def _prepare(self, pooled: PooledDriver) -> PooledDriver:
+        """Очищает cookies и хранилище сайта - у каждого заказа своя корзина"""
+        driver = pooled.driver
+        try:
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                'origin': SAMAL_BASE_URL,
+                'storageTypes': 'local_storage,session_storage,indexeddb,cache_storage,service_workers',
+            })
+        except AttributeError:
+            # Не Chrome: удаляем хотя бы cookies
+            driver.delete_all_cookies()
+        return pooled
+
+    def _discard(self, pooled: PooledDriver) -> None:
+        with self._lock:
+            if pooled in self._all:
+                self._all.remove(pooled)
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """Закрывает все свободные браузеры (занятые закроются при возврате)"""
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+# Общий пул процесса
+browser_pool = BrowserPool()
@@ -0,0 +1,160 @@
+"""
+Потоковый разбор страницы checkout WooCommerce
+
+За один проход по странице извлекает nonce, выбранный способ оплаты и все
+скрытые поля формы woocommerce-checkout. Страница подается кусками байт
+по мере загрузки и просматривается без декодирования: регулярные выражения
+ищут только открывающий тег формы, теги <input> внутри нее и закрывающий
+</form>. Декодируются лишь значения найденных полей, а после </form>
+остаток страницы не читается. Между кусками хранится только незаконченный
+тег на границе куска.
+"""
+import html
+import re
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Dict, Iterable, Optional
+
+NONCE_FIELD = 'woocommerce-process-checkout-nonce'
+# Способ оплаты, если на странице его нет (как в CheckoutPageMixin.extract_payment_method)
+DEFAULT_PAYMENT_METHOD = 'cheque'
+
+# Тег целиком; '>' внутри значения в кавычках тег не заканчивает
+_TAG_BODY = rb'''(?:[^>"']|"[^"]*"|'[^']*')*>'''
+FORM_OPEN_PATTERN = re.compile(rb'<form\b' + _TAG_BODY, re.IGNORECASE)
+FORM_CONTENT_PATTERN = re.compile(rb'<input\b' + _TAG_BODY + rb'|</form\s*>', re.IGNORECASE)
+TAG_PATTERN = re.compile(rb'<' + _TAG_BODY)
+ATTRIBUTE_PATTERN = re.compile(rb'''([^\s=/>"']+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+)))?''')
+
+
+@dataclass
+class CheckoutPageFields:
+    """Данные формы checkout, нужные для отправки заказа"""
+    nonce: Optional[str] = None
+    payment_method: Optional[str] = None
+    hidden_fields: Dict[str, str] = field(default_factory=dict)
+
+
+class CheckoutFormParser:
+    """
+    Инкрементальный разбор формы checkout.
+
+    Использование:
+        parser = CheckoutFormParser()
+        for chunk in chunks:
+            parser.feed_bytes(chunk)
+            if parser.done:
+                break
+        fields = parser.close_fields()
+    """
+
+    def __init__(self, encoding: str = 'utf-8'):
+        self.encoding = encoding
+        # Незаконченный тег с конца предыдущего куска
+        self._tail = b''
+        self._in_form = False
+        self._first_payment_method: Optional[str] = None
+        self.done = False
+        self.fields = CheckoutPageFields()
+
+    def feed_bytes(self, chunk: bytes) -> None:
+        """Подает очередной кусок ответа (байты)"""
+        if self.done:
+            return
+        buffer = self._tail + chunk if self._tail else chunk
+        position = 0
+        if not self._in_form:
+            position = self._find_form(buffer)
+            if position is None:
+                self._tail = self._unfinished_tag(buffer, 0)
+                return
+
+        for match in FORM_CONTENT_PATTERN.finditer(buffer, position):
+            tag = match.group()
+            if tag[1:2] == b'/':
+                # Форма закрыта - дальше страницу не разбираем
+                self._in_form = False
+                self.done = True
+                self._tail = b''
+                return
+            self._handle_input(tag)
+            position = match.end()
+        self._tail = self._unfinished_tag(buffer, position)
+
+    def close_fields(self) -> CheckoutPageFields:
+        """Завершает разбор и возвращает найденные поля"""
+        self._tail = b''
+        if self.fields.payment_method is None:
+            self.fields.payment_method = self._first_payment_method or DEFAULT_PAYMENT_METHOD
+        return self.fields
+
+    def _find_form(self, buffer: bytes) -> Optional[int]:
+        """Позиция сразу после тега формы checkout или None, если его еще нет"""
+        for match in FORM_OPEN_PATTERN.finditer(buffer):
+            classes = self._attributes(match.group()[5:]).get('class') or ''
+            if 'woocommerce-checkout' in classes.split():
+                self._in_form = True
+                return match.end()
+        return None
+
+    def _handle_input(self, tag: bytes) -> None:
+        attributes = self._attributes(tag[6:])
+        name = attributes.get('name')
+        if not name:
+            return
+        value = attributes.get('value') or ''
+        input_type = (attributes.get('type') or 'text').lower()
+
+        if name == 'payment_method':
+            if self._first_payment_method is None:
+                self._first_payment_method = value
+            if 'checked' in attributes and self.fields.payment_method is None:
+                self.fields.payment_method = value
+        elif input_type == 'hidden':
+            self.fields.hidden_fields[name] = value
+            if name == NONCE_FIELD:
+                self.fields.nonce = value
+
+    def _attributes(self, tag_body: bytes) -> Dict[str, Optional[str]]:
+        """Атрибуты тега (без '<имя'); у атрибута без значения - None"""
+        attributes = {}
+        for match in ATTRIBUTE_PATTERN.finditer(tag_body):
+            raw_value = match.group(2)
+            if raw_value is None:
+                raw_value = match.group(3) if match.group(3) is not None else match.group(4)
+            name = match.group(1).decode('ascii', errors='replace').lower()
+            attributes[name] = (html.unescape(raw_value.decode(self.encoding, errors='replace'))
+                                if raw_value is not None else None)
+        return attributes
+
+    @staticmethod
+    def _unfinished_tag(buffer: bytes, position: int) -> bytes:
+        """Последний тег куска, если он оборвался на границе (иначе пусто)"""
+        start = buffer.rfind(b'<', position)
+        if start == -1 or TAG_PATTERN.match(buffer, start):
+            return b''
+        return buffer[start:]
+
+
+def parse_checkout_html(html_text: str) -> CheckoutPageFields:
+    """Разбирает уже загруженную страницу checkout целиком"""
+    return parse_checkout_chunks([html_text.encode('utf-8')])
+
+
+def parse_checkout_chunks(chunks: Iterable[bytes], encoding: str = 'utf-8') -> CheckoutPageFields:
+    """Разбирает страницу checkout из потока байт, останавливаясь на </form>"""
+    parser = CheckoutFormParser(encoding)
+    for chunk in chunks:
+        parser.feed_bytes(chunk)
+        if parser.done:
+            break
+    return parser.close_fields()
+
+
+async def aparse_checkout_chunks(chunks: AsyncIterable[bytes], encoding: str = 'utf-8') -> CheckoutPageFields:
+    """Асинхронная версия parse_checkout_chunks"""
+    parser = CheckoutFormParser(encoding)
+    async for chunk in chunks:
+        parser.feed_bytes(chunk)
+        if parser.done:
+            break
+    return parser.close_fields()
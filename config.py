@@ -15,14 +15,88 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Трассировка событий заказа (JSONL файлы с ротацией, пишутся в фоне)
+TRACE_LEVEL = os.getenv('TRACE_LEVEL', 'info')  # debug | info | warning | error | off
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))  # Доля записываемых событий (ошибки - всегда)
+TRACE_DIR = os.getenv('TRACE_DIR', 'traces')
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(5 * 1024 * 1024)))  # Размер файла до ротации
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', '3'))  # Сколько старых файлов хранить
+TRACE_FLUSH_INTERVAL = float(os.getenv('TRACE_FLUSH_INTERVAL', '1.0'))  # Период записи пачки (сек)
+
+# Метрики Prometheus (нужен пакет prometheus-client)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # Порт endpoint /metrics (0 - отключить)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # Только локально - метрики не публикуются наружу
+
 # Telegram Bot Token
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 
 # Настройки для Samal API
-SAMAL_BASE_URL = 'https://samal.kz'
+SAMAL_BASE_URL = os.getenv('SAMAL_BASE_URL', 'https://samal.kz').rstrip('/')  # Для тестов - адрес mock_samal_server.py
 SAMAL_SHOP_URL = f'{SAMAL_BASE_URL}/shop/'
 SAMAL_CHECKOUT_URL = f'{SAMAL_BASE_URL}/checkout/'
 
+# Общий пул HTTP-соединений к samal.kz (переиспользуется всеми заказами)
+SAMAL_HTTP_POOL_SIZE = int(os.getenv('SAMAL_HTTP_POOL_SIZE', '20'))  # Макс. соединений
+SAMAL_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('SAMAL_HTTP_KEEPALIVE_EXPIRY', '60'))  # Секунды простоя keep-alive
+
+# Завершение заказа сразу по номеру из JSON-ответа checkout (без паузы и загрузки order-received)
+ORDER_FAST_COMPLETION = os.getenv('ORDER_FAST_COMPLETION', '1') == '1'
+# Проверять страницу order-received в фоне после быстрого завершения
+ORDER_VERIFY_RECEIVED_PAGE = os.getenv('ORDER_VERIFY_RECEIVED_PAGE', '0') == '1'
+
+# Повторы запросов к samal.kz и circuit breaker
+SAMAL_RETRY_ATTEMPTS = int(os.getenv('SAMAL_RETRY_ATTEMPTS', '3'))  # Попыток для идемпотентных GET
+SAMAL_RETRY_BASE_DELAY = float(os.getenv('SAMAL_RETRY_BASE_DELAY', '0.5'))  # Базовая задержка повтора (сек)
+SAMAL_RETRY_MAX_DELAY = float(os.getenv('SAMAL_RETRY_MAX_DELAY', '4'))  # Макс. задержка повтора (сек)
+SAMAL_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SAMAL_BREAKER_FAILURE_THRESHOLD', '5'))  # Ошибок подряд до размыкания (0 - отключить)
+SAMAL_BREAKER_RESET_TIMEOUT = float(os.getenv('SAMAL_BREAKER_RESET_TIMEOUT', '60'))  # Пауза до пробного запроса (сек)
+
+# Ограничение нагрузки на samal.kz: загрузка страниц и отправка заказов
+SAMAL_PAGE_RATE = float(os.getenv('SAMAL_PAGE_RATE', '5'))  # Запросов страниц в секунду (0 - без ограничения)
+SAMAL_PAGE_BURST = int(os.getenv('SAMAL_PAGE_BURST', '10'))  # Допустимый всплеск запросов страниц
+SAMAL_PAGE_CONCURRENCY = int(os.getenv('SAMAL_PAGE_CONCURRENCY', '8'))  # Одновременных запросов страниц (0 - без ограничения)
+SAMAL_CHECKOUT_RATE = float(os.getenv('SAMAL_CHECKOUT_RATE', '1'))  # Отправок заказа в секунду
+SAMAL_CHECKOUT_BURST = int(os.getenv('SAMAL_CHECKOUT_BURST', '3'))
+SAMAL_CHECKOUT_CONCURRENCY = int(os.getenv('SAMAL_CHECKOUT_CONCURRENCY', '3'))
+
+# Пул браузеров Chrome для оформления заказа через Selenium
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', '2'))  # Одновременно открытых браузеров
+BROWSER_MAX_USES = int(os.getenv('BROWSER_MAX_USES', '20'))  # Заказов до перезапуска браузера (0 - без перезапуска)
+BROWSER_ACQUIRE_TIMEOUT = float(os.getenv('BROWSER_ACQUIRE_TIMEOUT', '60'))  # Сколько ждать свободный браузер (сек)
+BROWSER_HEADLESS = os.getenv('BROWSER_HEADLESS', '1') == '1'  # 0 - видимое окно (для отладки)
+BROWSER_BLOCK_RESOURCES = os.getenv('BROWSER_BLOCK_RESOURCES', '1') == '1'  # Не загружать картинки, шрифты, медиа и аналитику
+BROWSER_EXTRA_BLOCKED_URLS = [
+    pattern.strip() for pattern in os.getenv('BROWSER_EXTRA_BLOCKED_URLS', '').split(',') if pattern.strip()
+]  # Дополнительные шаблоны URL через запятую, например *widget.example.com*
+CHROMEDRIVER_PATH = os.getenv('CHROMEDRIVER_PATH', '')  # Путь к chromedriver (пусто - найти автоматически)
+CHROMEDRIVER_CACHE_PATH = os.getenv('CHROMEDRIVER_CACHE_PATH', '.chromedriver_cache.json')  # Где запомнить найденный chromedriver
+CHROMEDRIVER_RETRY_INTERVAL = float(os.getenv('CHROMEDRIVER_RETRY_INTERVAL', '60'))  # Через сколько секунд снова искать ненайденный chromedriver
+BROWSER_CHECK_ON_START = os.getenv('BROWSER_CHECK_ON_START', '1') == '1'  # Проверять chromedriver при запуске бота
+
+# Выбор способа оформления заказа (HTTP-запросы или браузер)
+ORDER_BACKEND = os.getenv('ORDER_BACKEND', 'auto')  # auto | http | browser
+ORDER_BACKEND_WINDOW = int(os.getenv('ORDER_BACKEND_WINDOW', '20'))  # Последних заказов в статистике каждого способа
+ORDER_BACKEND_MIN_SAMPLES = int(os.getenv('ORDER_BACKEND_MIN_SAMPLES', '5'))  # Минимум заказов до переключения
+ORDER_BACKEND_MIN_SUCCESS = float(os.getenv('ORDER_BACKEND_MIN_SUCCESS', '0.6'))  # Доля успешных HTTP-заказов, ниже которой включается браузер
+ORDER_BACKEND_PROBE_INTERVAL = float(os.getenv('ORDER_BACKEND_PROBE_INTERVAL', '300'))  # Как часто проверять HTTP-путь в режиме браузера (сек)
+
+# Пул заранее подготовленных сессий checkout (cookies WooCommerce + nonce)
+CHECKOUT_POOL_SIZE = int(os.getenv('CHECKOUT_POOL_SIZE', '3'))  # 0 - пул отключен
+CHECKOUT_POOL_NONCE_TTL = int(os.getenv('CHECKOUT_POOL_NONCE_TTL', '21600'))  # Срок жизни nonce (сек), WP nonce живет 12-24 ч
+CHECKOUT_POOL_REFRESH_INTERVAL = int(os.getenv('CHECKOUT_POOL_REFRESH_INTERVAL', '60'))  # Период проверки пула (сек)
+
+# Очередь заказов: фоновые воркеры отправляют заказы на сайт
+ORDER_WORKERS = int(os.getenv('ORDER_WORKERS', '3'))  # Заказов, оформляемых одновременно
+ORDER_JOB_LEASE = float(os.getenv('ORDER_JOB_LEASE', '120'))  # Аренда задания (сек), затем его может забрать другой воркер
+ORDER_QUEUE_POLL_INTERVAL = float(os.getenv('ORDER_QUEUE_POLL_INTERVAL', '5'))  # Период проверки очереди (сек)
+ORDER_JOB_MAX_ATTEMPTS = int(os.getenv('ORDER_JOB_MAX_ATTEMPTS', '2'))  # Попыток после прерванного оформления
+ORDER_CONVERSATION_TIMEOUT = float(os.getenv('ORDER_CONVERSATION_TIMEOUT', '900'))  # Через сколько секунд бездействия бросить оформление заказа
+
+# Архив HTML ответов заказов (сжатые снимки в SQLite)
+ORDER_ARCHIVE_PATH = os.getenv('ORDER_ARCHIVE_PATH', 'order_archive.db')
+ORDER_ARCHIVE_MAX_MB = int(os.getenv('ORDER_ARCHIVE_MAX_MB', '200'))  # Макс. размер сжатых снимков
+ORDER_ARCHIVE_MAX_AGE_DAYS = int(os.getenv('ORDER_ARCHIVE_MAX_AGE_DAYS', '30'))  # Срок хранения снимков
+
 # Настройки продуктов
 DEFAULT_PRODUCT_ID = int(os.getenv('DEFAULT_PRODUCT_ID', '224'))  # Вода Samal 18,9 л
 DEFAULT_QUANTITY = int(os.getenv('DEFAULT_QUANTITY', '2'))
@@ -38,4 +112,12 @@ PRODUCTS = {
 }
 
 # База данных
-DATABASE_PATH = 'samal_bot.db'
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'samal_bot.db')
+DATABASE_SYNCHRONOUS = os.getenv('DATABASE_SYNCHRONOUS', 'NORMAL').upper()  # NORMAL (с WAL без потери целостности) | FULL
+DATABASE_CACHE_MB = int(os.getenv('DATABASE_CACHE_MB', '16'))  # Кеш страниц SQLite на одно подключение
+DATABASE_BUSY_TIMEOUT = float(os.getenv('DATABASE_BUSY_TIMEOUT', '10'))  # Сколько секунд ждать блокировку записи
+DATABASE_READERS = int(os.getenv('DATABASE_READERS', '4'))  # Потоков для чтения из базы (запись - в одном потоке)
+DATABASE_GROUP_COMMIT_MS = float(os.getenv('DATABASE_GROUP_COMMIT_MS', '0'))  # Объединять записи за N мс в одну транзакцию (0 - выкл.)
+DATABASE_GROUP_COMMIT_MAX = int(os.getenv('DATABASE_GROUP_COMMIT_MAX', '100'))  # Макс. записей в одной транзакции
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))  # Профилей в кеше памяти (0 - отключить)
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '600'))  # Сколько секунд профиль живет в кеше
@@ -1,56 +1,342 @@
 """
 Модуль для работы с базой данных SQLite
+
+Каждый поток работает через свое долгоживущее подключение: бот, воркеры
+очереди (asyncio.to_thread) и т.д. не открывают файл базы на каждый запрос.
+База в режиме WAL - чтение профиля не ждет, пока записывается заказ.
+Изменения из нескольких запросов выполняются в transaction().
+
+Профили пользователей кешируются в памяти (UserCache): save_user и
+delete_user обновляют кеш после commit, поэтому get_user почти не
+обращается к SQLite.
+
+Обработчики бота работают через AsyncDatabase - запросы выполняются в
+отдельных потоках и не останавливают цикл событий.
 """
+import asyncio
+import functools
+import json
+import logging
+import queue
 import sqlite3
-from typing import Optional, Dict
-from config import DATABASE_PATH
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Dict, List, Tuple
+from config import (
+    DATABASE_PATH,
+    DATABASE_SYNCHRONOUS,
+    DATABASE_CACHE_MB,
+    DATABASE_BUSY_TIMEOUT,
+    DATABASE_READERS,
+    DATABASE_GROUP_COMMIT_MS,
+    DATABASE_GROUP_COMMIT_MAX,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Сколько подготовленных выражений кешировать на каждое подключение
+STATEMENT_CACHE_SIZE = 64
+
+USER_FIELDS = ('phone', 'contact_phone', 'address', 'first_name', 'comment')
+
+# Миграции схемы: (версия, описание, SQL). Номер последней примененной
+# миграции хранится в PRAGMA user_version, новые добавляются в конец списка
+MIGRATIONS = [
+    (1, 'Индекс истории заказов пользователя', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_chat_created ON orders (chat_id, created_at)',
+    ]),
+    (2, 'Отметка отправки формы checkout в очереди заказов', [
+        'ALTER TABLE order_jobs ADD COLUMN submitted_at REAL',
+    ]),
+]
+
+# Позиция в истории заказов для следующей страницы: (created_at, id) последнего показанного заказа
+HistoryCursor = Tuple[str, int]
+
+
+class UserCache:
+    """
+    LRU-кеш профилей пользователей с ограничением времени жизни записи.
+    
+    Хранит и отсутствие профиля (None). Запись из базы (put_loaded) не
+    попадает в кеш, если с момента начала чтения профиль изменялся: иначе
+    чтение, начатое до save_user, могло бы вернуть в кеш старые данные.
+    """
+    
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        """
+        Args:
+            max_size: Макс. число профилей (0 - кеш отключен)
+            ttl: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[int, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Увеличивается при каждом изменении профилей
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+    
+    def get(self, chat_id: int) -> Tuple[bool, Optional[Dict]]:
+        """
+        Returns:
+            (найден ли профиль в кеше, копия профиля или None)
+        """
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is not None and item[0] > time.monotonic():
+                self._items.move_to_end(chat_id)
+                self.hits += 1
+                value = item[1]
+                return True, dict(value) if value is not None else None
+            if item is not None:
+                del self._items[chat_id]
+            self.misses += 1
+            return False, None
+    
+    def version(self) -> int:
+        """Отметка перед чтением профиля из базы (для put_loaded)"""
+        return self._version
+    
+    def put_loaded(self, chat_id: int, value: Optional[Dict], version: int) -> None:
+        """Кладет профиль, прочитанный из базы, если с отметки version профили не менялись"""
+        with self._lock:
+            if self._version == version:
+                self._store(chat_id, value)
+    
+    def put_written(self, chat_id: int, value: Optional[Dict]) -> None:
+        """Кладет профиль, только что записанный в базу (None - профиль удален)"""
+        with self._lock:
+            self._version += 1
+            self._store(chat_id, value)
+    
+    def invalidate(self, chat_id: int) -> None:
+        with self._lock:
+            self._version += 1
+            self._items.pop(chat_id, None)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._items.clear()
+    
+    def _store(self, chat_id: int, value: Optional[Dict]) -> None:
+        if not self.enabled:
+            return
+        self._items[chat_id] = (time.monotonic() + self.ttl, dict(value) if value is not None else None)
+        self._items.move_to_end(chat_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        """Размер кеша и число попаданий/промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
 
 
 class Database:
     def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Увеличивается в close(): подключения потоков, открытые раньше, уже закрыты
+        self._generation = 0
+        self.user_cache = UserCache()
+        # Commit и применение отложенных обновлений кеша выполняются под одной
+        # блокировкой - порядок обновлений кеша совпадает с порядком коммитов
+        self._commit_lock = threading.Lock()
         self.init_db()
+        self.migrate()
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """Возвращает подключение текущего потока (открывается при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._connect()
+            with self._connections_lock:
+                self._connections.append(conn)
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
     
-    def get_connection(self):
-        """Создает подключение к базе данных"""
-        return sqlite3.connect(self.db_path)
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None - транзакции открываются явно (transaction()),
+        # check_same_thread=False - чтобы close() мог закрыть подключения всех потоков
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DATABASE_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute(f'PRAGMA synchronous = {DATABASE_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = {-DATABASE_CACHE_MB * 1024}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+    
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[sqlite3.Cursor]:
+        """
+        Транзакция на подключении текущего потока: commit при выходе, rollback при исключении
+        
+        Вложенный вызов выполняется внутри уже открытой транзакции.
+        
+        Args:
+            immediate: Сразу взять блокировку записи (BEGIN IMMEDIATE) - нужно,
+                       когда транзакция читает строку и затем изменяет ее
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        self._local.cache_updates = []
+        try:
+            yield conn.cursor()
+            with self._commit_lock:
+                conn.commit()
+                for chat_id, user in self._local.cache_updates:
+                    self.user_cache.put_written(chat_id, user)
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._local.cache_updates = []
+    
+    def _cache_after_commit(self, chat_id: int, user: Optional[Dict]) -> None:
+        """
+        Откладывает запись профиля в кеш до commit внешней транзакции
+        
+        Сразу после изменения строки кеш только сбрасывается: читатели идут
+        в базу и видят последнюю закоммиченную версию. При rollback
+        отложенное обновление отбрасывается.
+        """
+        self.user_cache.invalidate(chat_id)
+        self._local.cache_updates.append((chat_id, user))
+    
+    def close(self):
+        """Закрывает подключения всех потоков (при следующем запросе поток откроет новое)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка при закрытии подключения к базе: {str(e)}")
     
     def init_db(self):
         """Инициализирует базу данных и создает таблицы"""
         conn = self.get_connection()
-        cursor = conn.cursor()
+        # WAL сохраняется в файле базы - достаточно включить один раз
+        conn.execute('PRAGMA journal_mode = WAL')
         
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                chat_id INTEGER PRIMARY KEY,
-                phone TEXT,
-                contact_phone TEXT,
-                address TEXT,
-                first_name TEXT,
-                comment TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        with self.transaction() as cursor:
+            # Таблица пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    chat_id INTEGER PRIMARY KEY,
+                    phone TEXT,
+                    contact_phone TEXT,
+                    address TEXT,
+                    first_name TEXT,
+                    comment TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Таблица заказов (для истории)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    product_id INTEGER,
+                    product_name TEXT,
+                    quantity INTEGER,
+                    total_price INTEGER,
+                    status TEXT DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (chat_id) REFERENCES users (chat_id)
+                )
+            ''')
+            
+            # Товары заказа (заказ может содержать несколько продуктов)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS order_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER,
+                    product_id INTEGER,
+                    product_name TEXT,
+                    quantity INTEGER,
+                    price INTEGER,
+                    FOREIGN KEY (order_id) REFERENCES orders (id)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)')
+            
+            # Очередь заказов на отправку на сайт (обрабатывается воркерами order_queue)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS order_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER UNIQUE,
+                    chat_id INTEGER,
+                    payload TEXT,
+                    status TEXT DEFAULT 'queued',
+                    attempts INTEGER DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (order_id) REFERENCES orders (id)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_jobs_status ON order_jobs (status, id)')
+    
+    def migrate(self) -> int:
+        """
+        Применяет миграции схемы, которых еще нет в базе
         
-        # Таблица заказов (для истории)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                product_id INTEGER,
-                product_name TEXT,
-                quantity INTEGER,
-                total_price INTEGER,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (chat_id) REFERENCES users (chat_id)
-            )
-        ''')
+        Каждая миграция выполняется в своей транзакции вместе с обновлением
+        user_version, поэтому прерванная миграция повторится при следующем запуске.
         
-        conn.commit()
-        conn.close()
+        Returns:
+            Версия схемы после миграций
+        """
+        version = self.get_connection().execute('PRAGMA user_version').fetchone()[0]
+        for migration_version, description, statements in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            with self.transaction(immediate=True) as cursor:
+                # Другой процесс бота мог применить миграцию, пока мы ждали блокировку
+                if cursor.execute('PRAGMA user_version').fetchone()[0] >= migration_version:
+                    continue
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {migration_version}')
+            print(f"🗄 Миграция базы {migration_version}: {description}")
+            version = migration_version
+        return version
     
     def save_user(self, chat_id: int, **kwargs):
         """
@@ -60,32 +346,20 @@ class Database:
             chat_id: Telegram chat ID
             **kwargs: Дополнительные поля (phone, contact_phone, address, first_name, comment)
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем существует ли пользователь
-        cursor.execute('SELECT chat_id FROM users WHERE chat_id = ?', (chat_id,))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Обновляем существующего пользователя
-            update_fields = []
-            values = []
-            for key, value in kwargs.items():
-                if key in ['phone', 'contact_phone', 'address', 'first_name', 'comment']:
-                    update_fields.append(f'{key} = ?')
-                    values.append(value)
-            
-            if update_fields:
-                update_fields.append('updated_at = CURRENT_TIMESTAMP')
-                values.append(chat_id)
-                query = f"UPDATE users SET {', '.join(update_fields)} WHERE chat_id = ?"
-                cursor.execute(query, values)
+        fields = [key for key in USER_FIELDS if key in kwargs]
+        # Одна команда вместо SELECT + INSERT/UPDATE: новый пользователь создается
+        # с пустыми полями, у существующего меняются только переданные поля
+        if fields:
+            assignments = ', '.join(f'{key} = excluded.{key}' for key in fields)
+            on_conflict = f'DO UPDATE SET {assignments}, updated_at = CURRENT_TIMESTAMP'
         else:
-            # Создаем нового пользователя
-            cursor.execute('''
+            on_conflict = 'DO NOTHING'
+        
+        with self.transaction() as cursor:
+            cursor.execute(f'''
                 INSERT INTO users (chat_id, phone, contact_phone, address, first_name, comment)
                 VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id) {on_conflict}
             ''', (
                 chat_id,
                 kwargs.get('phone', ''),
@@ -94,9 +368,7 @@ class Database:
                 kwargs.get('first_name', ''),
                 kwargs.get('comment', '')
             ))
-        
-        conn.commit()
-        conn.close()
+            self._cache_after_commit(chat_id, self._select_user(cursor, chat_id))
     
     def get_user(self, chat_id: int) -> Optional[Dict]:
         """
@@ -108,17 +380,26 @@ class Database:
         Returns:
             Словарь с данными пользователя или None
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+        found, user = self.user_cache.get(chat_id)
+        if found:
+            return user
+        return self._load_user(chat_id)
+    
+    def _load_user(self, chat_id: int) -> Optional[Dict]:
+        """Читает профиль из базы и кладет его в кеш"""
+        version = self.user_cache.version()
+        user = self._select_user(self.get_connection().cursor(), chat_id)
+        self.user_cache.put_loaded(chat_id, user, version)
+        return user
+    
+    @staticmethod
+    def _select_user(cursor: sqlite3.Cursor, chat_id: int) -> Optional[Dict]:
         cursor.execute('''
             SELECT chat_id, phone, contact_phone, address, first_name, comment
             FROM users WHERE chat_id = ?
         ''', (chat_id,))
         
         row = cursor.fetchone()
-        conn.close()
-        
         if row:
             return {
                 'chat_id': row[0],
@@ -133,45 +414,220 @@ class Database:
     def save_order(self, chat_id: int, product_id: int, product_name: str, 
                    quantity: int, total_price: int, status: str = 'pending'):
         """Сохраняет информацию о заказе"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO orders (chat_id, product_id, product_name, quantity, total_price, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (chat_id, product_id, product_name, quantity, total_price, status))
-        
-        order_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO orders (chat_id, product_id, product_name, quantity, total_price, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (chat_id, product_id, product_name, quantity, total_price, status))
+            order_id = cursor.lastrowid
         
         return order_id
     
     def update_order_status(self, order_id: int, status: str):
         """Обновляет статус заказа"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+    
+    def enqueue_order(self, chat_id: int, product_id: int, product_name: str,
+                      quantity: int, total_price: int, payload: Dict,
+                      items: Optional[List[Dict]] = None) -> int:
+        """
+        Сохраняет заказ со статусом pending и ставит его в очередь на отправку
         
-        cursor.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+        Args:
+            payload: Данные для отправки на сайт (items, user_data, ...)
+            items: Товары заказа: [{'product_id', 'product_name', 'quantity', 'price'}, ...]
+            
+        Returns:
+            ID заказа
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO orders (chat_id, product_id, product_name, quantity, total_price, status)
+                VALUES (?, ?, ?, ?, ?, 'pending')
+            ''', (chat_id, product_id, product_name, quantity, total_price))
+            order_id = cursor.lastrowid
+            
+            if items:
+                cursor.executemany('''
+                    INSERT INTO order_items (order_id, product_id, product_name, quantity, price)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [
+                    (order_id, item['product_id'], item['product_name'], item['quantity'], item['price'])
+                    for item in items
+                ])
+            
+            cursor.execute('''
+                INSERT INTO order_jobs (order_id, chat_id, payload)
+                VALUES (?, ?, ?)
+            ''', (order_id, chat_id, json.dumps(payload, ensure_ascii=False)))
         
-        conn.commit()
-        conn.close()
+        return order_id
     
-    def get_user_orders(self, chat_id: int, limit: int = 10):
-        """Получает последние заказы пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def claim_order_job(self, worker_id: str, lease_seconds: float, max_attempts: int) -> Optional[Dict]:
+        """
+        Забирает следующий заказ из очереди под аренду (lease)
         
-        cursor.execute('''
-            SELECT id, product_name, quantity, total_price, status, created_at
-            FROM orders
-            WHERE chat_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-        ''', (chat_id, limit))
+        Заказ, чья аренда истекла (воркер упал или бот перезапущен), снова
+        выдается, пока не исчерпаны попытки и если форма checkout еще не
+        отправлялась (submitted_at): иначе повтор создал бы дубликат заказа.
         
-        orders = cursor.fetchall()
-        conn.close()
+        Args:
+            worker_id: Идентификатор воркера
+            lease_seconds: Срок аренды
+            max_attempts: Макс. число попыток обработки
+            
+        Returns:
+            Словарь с данными задания или None, если очередь пуста
+        """
+        now = time.time()
+        
+        # BEGIN IMMEDIATE - два воркера не заберут одно задание
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT id, order_id, chat_id, payload, attempts
+                FROM order_jobs
+                WHERE (status = 'queued'
+                       OR (status = 'running' AND lease_expires_at < ? AND submitted_at IS NULL))
+                  AND attempts < ?
+                ORDER BY id
+                LIMIT 1
+            ''', (now, max_attempts))
+            row = cursor.fetchone()
+            
+            if row:
+                cursor.execute('''
+                    UPDATE order_jobs
+                    SET status = 'running', attempts = attempts + 1, lease_owner = ?,
+                        lease_expires_at = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (worker_id, now + lease_seconds, row[0]))
+        
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'order_id': row[1],
+            'chat_id': row[2],
+            'payload': json.loads(row[3]),
+            'attempts': row[4] + 1
+        }
+    
+    def extend_order_job_lease(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Продлевает аренду задания. False, если задание уже забрал другой воркер"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE order_jobs SET lease_expires_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            ''', (time.time() + lease_seconds, job_id, worker_id))
+            extended = cursor.rowcount > 0
+        
+        return extended
+    
+    def mark_order_job_submitted(self, job_id: int, worker_id: str) -> bool:
+        """
+        Отмечает, что форма checkout задания отправляется на сайт
+        
+        Вызывается прямо перед отправкой формы. После отметки задание больше
+        не выдается повторно: при прерывании оно завершается failed с просьбой
+        проверить подтверждение от Samal.
+        
+        Returns:
+            False, если аренду задания уже забрал другой воркер (отправлять нельзя)
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE order_jobs SET submitted_at = COALESCE(submitted_at, ?), updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            ''', (time.time(), job_id, worker_id))
+            marked = cursor.rowcount > 0
+        
+        return marked
+    
+    def complete_order_job(self, job_id: int, order_id: int, worker_id: str, status: str,
+                           error: Optional[str] = None) -> bool:
+        """
+        Завершает задание и обновляет статус заказа
+        
+        Args:
+            worker_id: Воркер, который держит аренду задания
+            status: 'success' или 'failed'
+            error: Текст ошибки (для failed)
+            
+        Returns:
+            False, если аренда задания потеряна и статус не изменен
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE order_jobs
+                SET status = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ?
+            ''', ('done' if status == 'success' else 'failed', error, job_id, worker_id))
+            completed = cursor.rowcount > 0
+            if completed:
+                cursor.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+        
+        return completed
+    
+    def fail_abandoned_order_jobs(self, max_attempts: int) -> List[Dict]:
+        """
+        Помечает failed задания, которые прерывались max_attempts раз или
+        прервались после отправки формы checkout (повторная отправка могла бы
+        создать дубликат заказа на сайте)
+        
+        Returns:
+            Список заданий (id, order_id, chat_id, payload) для уведомления пользователей
+        """
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT id, order_id, chat_id, payload FROM order_jobs
+                WHERE status = 'running' AND lease_expires_at < ?
+                  AND (attempts >= ? OR submitted_at IS NOT NULL)
+            ''', (time.time(), max_attempts))
+            rows = cursor.fetchall()
+            for job_id, order_id, _, _ in rows:
+                cursor.execute('''
+                    UPDATE order_jobs
+                    SET status = 'failed', last_error = 'abandoned', lease_owner = NULL,
+                        lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (job_id,))
+                cursor.execute("UPDATE orders SET status = 'failed' WHERE id = ?", (order_id,))
+        
+        return [{
+            'id': row[0],
+            'order_id': row[1],
+            'chat_id': row[2],
+            'payload': json.loads(row[3])
+        } for row in rows]
+    
+    def get_user_orders(self, chat_id: int, limit: int = 10, before: Optional[HistoryCursor] = None) -> List[Dict]:
+        """
+        Получает последние заказы пользователя (новые первыми)
+        
+        Args:
+            limit: Сколько заказов вернуть
+            before: Вернуть заказы старше этой позиции (см. get_order_history)
+        """
+        # Индекс (chat_id, created_at) отдает строки уже в нужном порядке - без
+        # сортировки, а страница по позиции стоит одинаково в любом месте истории
+        if before is None:
+            orders = self.get_connection().execute('''
+                SELECT id, product_name, quantity, total_price, status, created_at
+                FROM orders
+                WHERE chat_id = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (chat_id, limit)).fetchall()
+        else:
+            orders = self.get_connection().execute('''
+                SELECT id, product_name, quantity, total_price, status, created_at
+                FROM orders
+                WHERE chat_id = ? AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (chat_id, before[0], before[1], limit)).fetchall()
         
         return [{
             'id': row[0],
@@ -182,17 +638,239 @@ class Database:
             'created_at': row[5]
         } for row in orders]
     
-    def delete_user(self, chat_id: int):
-        """Удаляет пользователя и все его заказы из базы данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Удаляем заказы пользователя
-        cursor.execute('DELETE FROM orders WHERE chat_id = ?', (chat_id,))
+    def get_order_history(self, chat_id: int, limit: int = 10,
+                          before: Optional[HistoryCursor] = None) -> Tuple[List[Dict], Optional[HistoryCursor]]:
+        """
+        Страница истории заказов
         
-        # Удаляем пользователя
-        cursor.execute('DELETE FROM users WHERE chat_id = ?', (chat_id,))
+        Args:
+            limit: Заказов на странице
+            before: Позиция из предыдущей страницы (None - первая страница)
+            
+        Returns:
+            (заказы страницы, позиция следующей страницы или None, если заказов больше нет)
+        """
+        orders = self.get_user_orders(chat_id, limit + 1, before)
+        if len(orders) <= limit:
+            return orders, None
+        orders = orders[:limit]
+        return orders, (orders[-1]['created_at'], orders[-1]['id'])
+    
+    def get_order_items(self, order_id: int) -> List[Dict]:
+        """Получает товары заказа (пустой список для заказов из одного товара старого формата)"""
+        items = self.get_connection().execute('''
+            SELECT product_id, product_name, quantity, price
+            FROM order_items
+            WHERE order_id = ?
+            ORDER BY id
+        ''', (order_id,)).fetchall()
         
-        conn.commit()
-        conn.close()
+        return [{
+            'product_id': row[0],
+            'product_name': row[1],
+            'quantity': row[2],
+            'price': row[3]
+        } for row in items]
+    
+    def delete_user(self, chat_id: int):
+        """Удаляет пользователя и все его заказы из базы данных"""
+        with self.transaction() as cursor:
+            # Удаляем заказы пользователя
+            cursor.execute('DELETE FROM order_jobs WHERE chat_id = ?', (chat_id,))
+            cursor.execute(
+                'DELETE FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE chat_id = ?)', (chat_id,)
+            )
+            cursor.execute('DELETE FROM orders WHERE chat_id = ?', (chat_id,))
+            
+            # Удаляем пользователя
+            cursor.execute('DELETE FROM users WHERE chat_id = ?', (chat_id,))
+            self._cache_after_commit(chat_id, None)
+
+
+class GroupCommitWriter:
+    """
+    Поток записи с объединением транзакций (group commit).
+    
+    Изменения, пришедшие в течение window секунд после первого, выполняются
+    в одной транзакции - пачка стоит один fsync вместо одного на каждую запись.
+    Вызывающий получает результат после общего commit, то есть данные уже
+    в базе. Если одна из записей пачки завершилась ошибкой, транзакция
+    откатывается и записи выполняются по одной - ошибку получит только ее автор.
+    """
+    
+    def __init__(self, db: Database, window: float, max_batch: int = DATABASE_GROUP_COMMIT_MAX):
+        """
+        Args:
+            db: База, в которую пишутся изменения
+            window: Сколько секунд ждать другие записи после первой
+            max_batch: Макс. записей в одной транзакции
+        """
+        self.db = db
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.writes = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """Ставит запись в очередь; результат - в возвращаемом Future"""
+        future: Future = Future()
+        self._queue.put((future, functools.partial(func, *args, **kwargs)))
+        return future
+    
+    def shutdown(self) -> None:
+        """Выполняет оставшиеся записи и останавливает поток"""
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit([(future, call) for future, call in batch if future.set_running_or_notify_cancel()])
+    
+    def _commit(self, batch: List[Tuple[Future, Callable]]) -> None:
+        if not batch:
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        if len(batch) > 1:
+            results = []
+            try:
+                # Транзакции внутри методов Database становятся частью общей
+                with self.db.transaction(immediate=True):
+                    for _, call in batch:
+                        results.append(call())
+            except Exception as e:
+                logger.error(f"Пачка из {len(batch)} записей откатилась ({str(e)}), выполняю по одной")
+            else:
+                for (future, _), result in zip(batch, results):
+                    future.set_result(result)
+                return
+        for future, call in batch:
+            try:
+                future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+
 
+class AsyncDatabase:
+    """
+    Асинхронная обертка над Database с тем же API для обработчиков бота и воркеров очереди
+    
+    Запросы выполняются вне цикла событий: все изменения - в одном потоке
+    записи (они и так выполняются в SQLite по одному, зато не ждут друг друга
+    на блокировке), чтение - в пуле потоков чтения. Благодаря WAL чтение
+    профиля не ждет fsync записи заказа. При DATABASE_GROUP_COMMIT_MS > 0
+    поток записи объединяет близкие по времени изменения в одну транзакцию.
+    
+    Использование:
+        db = AsyncDatabase()
+        user_data = await db.get_user(chat_id)
+        await db.save_user(chat_id, phone=phone)
+    """
+    
+    def __init__(self, db: Optional[Database] = None, readers: int = DATABASE_READERS,
+                 group_commit_ms: float = DATABASE_GROUP_COMMIT_MS):
+        """
+        Args:
+            db: Синхронная база (по умолчанию - Database() с DATABASE_PATH)
+            readers: Потоков для чтения
+            group_commit_ms: Окно объединения записей в одну транзакцию (0 - каждая запись отдельно)
+        """
+        self.sync = db or Database()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._group: Optional[GroupCommitWriter] = None
+        if group_commit_ms > 0:
+            self._group = GroupCommitWriter(self.sync, group_commit_ms / 1000)
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix='db-reader')
+    
+    async def _read(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(func, *args, **kwargs))
+    
+    async def _write(self, func: Callable, *args, **kwargs) -> Any:
+        if self._group is not None:
+            return await asyncio.wrap_future(self._group.submit(func, *args, **kwargs))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(func, *args, **kwargs))
+    
+    async def get_user(self, chat_id: int) -> Optional[Dict]:
+        # Профиль из кеша отдается сразу, без перехода в поток чтения
+        found, user = self.sync.user_cache.get(chat_id)
+        if found:
+            return user
+        return await self._read(self.sync._load_user, chat_id)
+    
+    async def get_user_orders(self, chat_id: int, limit: int = 10,
+                              before: Optional[HistoryCursor] = None) -> List[Dict]:
+        return await self._read(self.sync.get_user_orders, chat_id, limit, before)
+    
+    async def get_order_history(self, chat_id: int, limit: int = 10,
+                                before: Optional[HistoryCursor] = None) -> Tuple[List[Dict], Optional[HistoryCursor]]:
+        return await self._read(self.sync.get_order_history, chat_id, limit, before)
+    
+    async def get_order_items(self, order_id: int) -> List[Dict]:
+        return await self._read(self.sync.get_order_items, order_id)
+    
+    async def save_user(self, chat_id: int, **kwargs) -> None:
+        await self._write(self.sync.save_user, chat_id, **kwargs)
+    
+    async def save_order(self, chat_id: int, product_id: int, product_name: str,
+                         quantity: int, total_price: int, status: str = 'pending') -> int:
+        return await self._write(self.sync.save_order, chat_id, product_id, product_name,
+                                 quantity, total_price, status)
+    
+    async def update_order_status(self, order_id: int, status: str) -> None:
+        await self._write(self.sync.update_order_status, order_id, status)
+    
+    async def enqueue_order(self, chat_id: int, product_id: int, product_name: str,
+                            quantity: int, total_price: int, payload: Dict,
+                            items: Optional[List[Dict]] = None) -> int:
+        return await self._write(self.sync.enqueue_order, chat_id, product_id, product_name,
+                                 quantity, total_price, payload, items)
+    
+    async def claim_order_job(self, worker_id: str, lease_seconds: float, max_attempts: int) -> Optional[Dict]:
+        return await self._write(self.sync.claim_order_job, worker_id, lease_seconds, max_attempts)
+    
+    async def extend_order_job_lease(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        return await self._write(self.sync.extend_order_job_lease, job_id, worker_id, lease_seconds)
+    
+    async def mark_order_job_submitted(self, job_id: int, worker_id: str) -> bool:
+        return await self._write(self.sync.mark_order_job_submitted, job_id, worker_id)
+    
+    async def complete_order_job(self, job_id: int, order_id: int, worker_id: str, status: str,
+                                 error: Optional[str] = None) -> bool:
+        return await self._write(self.sync.complete_order_job, job_id, order_id, worker_id, status, error)
+    
+    async def fail_abandoned_order_jobs(self, max_attempts: int) -> List[Dict]:
+        return await self._write(self.sync.fail_abandoned_order_jobs, max_attempts)
+    
+    async def delete_user(self, chat_id: int) -> None:
+        await self._write(self.sync.delete_user, chat_id)
+    
+    async def close(self) -> None:
+        """Дожидается начатых запросов и закрывает подключения"""
+        if self._group is not None:
+            await asyncio.to_thread(self._group.shutdown)
+        await asyncio.to_thread(self._writer.shutdown, wait=True)
+        await asyncio.to_thread(self._readers.shutdown, wait=True)
+        self.sync.close()
@@ -0,0 +1,115 @@
+"""
+Общий пул HTTP-соединений к samal.kz
+
+Соединения (DNS, TCP, TLS) переиспользуются всеми заказами, а cookies
+(и вместе с ними корзина WooCommerce) остаются у каждого клиента свои.
+"""
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+import httpx
+from requests.adapters import HTTPAdapter
+
+from config import SAMAL_HTTP_POOL_SIZE, SAMAL_HTTP_KEEPALIVE_EXPIRY
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+
+class _SharedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, который не закрывается вместе с requests.Session.
+    Пул соединений живет до вызова close_shared_transports().
+    """
+
+    def close(self):
+        pass
+
+    def close_pool(self):
+        super().close()
+
+
+class _SharedAsyncTransport(httpx.AsyncHTTPTransport):
+    """
+    Транспорт httpx, который не закрывается вместе с AsyncClient.
+    Пул соединений живет до вызова aclose_shared_transport().
+    """
+
+    async def aclose(self) -> None:
+        pass
+
+    async def aclose_pool(self) -> None:
+        await super().aclose()
+
+
+_adapter_lock = threading.Lock()
+_shared_adapter: Optional[_SharedHTTPAdapter] = None
+
+_shared_async_transport: Optional[_SharedAsyncTransport] = None
+_shared_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_shared_adapter() -> HTTPAdapter:
+    """
+    Возвращает общий HTTPAdapter для requests.Session
+
+    Returns:
+        HTTPAdapter с пулом keep-alive соединений
+    """
+    global _shared_adapter
+    with _adapter_lock:
+        if _shared_adapter is None:
+            _shared_adapter = _SharedHTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=SAMAL_HTTP_POOL_SIZE,
+            )
+        return _shared_adapter
+
+
+def get_shared_async_transport() -> httpx.AsyncBaseTransport:
+    """
+    Возвращает общий транспорт httpx для текущего event loop
+
+    Соединения httpx привязаны к event loop, поэтому при смене loop
+    (например, в отдельных asyncio.run) создается новый пул.
+
+    Returns:
+        AsyncHTTPTransport с пулом keep-alive соединений
+    """
+    global _shared_async_transport, _shared_async_loop
+    loop = asyncio.get_running_loop()
+    if _shared_async_transport is None or _shared_async_loop is not loop:
+        _shared_async_transport = _SharedAsyncTransport(
+            limits=httpx.Limits(
+                max_connections=SAMAL_HTTP_POOL_SIZE,
+                max_keepalive_connections=SAMAL_HTTP_POOL_SIZE,
+                keepalive_expiry=SAMAL_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            retries=0,
+        )
+        _shared_async_loop = loop
+    return _shared_async_transport
+
+
+def close_shared_adapter() -> None:
+    """Закрывает общий пул соединений requests"""
+    global _shared_adapter
+    with _adapter_lock:
+        if _shared_adapter is not None:
+            _shared_adapter.close_pool()
+            _shared_adapter = None
+
+
+async def aclose_shared_transport() -> None:
+    """Закрывает общий пул соединений httpx (вызывается при остановке бота)"""
+    global _shared_async_transport, _shared_async_loop
+    if _shared_async_transport is not None:
+        transport = _shared_async_transport
+        _shared_async_transport = None
+        _shared_async_loop = None
+        try:
+            await transport.aclose_pool()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии пула соединений: {str(e)}")
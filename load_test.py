@@ -0,0 +1,161 @@
+"""
+Нагрузочный тест оформления заказов
+
+Запускает N заказов с заданной параллельностью и печатает пропускную
+способность и задержки (p50/p95/p99). По умолчанию поднимает в том же
+процессе mock_samal_server.py, поэтому настоящие заказы не создаются.
+
+Примеры:
+    python load_test.py --orders 200 --concurrency 20
+    python load_test.py --orders 50 --concurrency 10 --error-rate 0.05 --nonce-ttl 5
+    python load_test.py --client sync --orders 50 --concurrency 5
+    python load_test.py --base-url http://127.0.0.1:8081 --orders 100   # внешний mock
+
+ВНИМАНИЕ: --base-url https://samal.kz создаст настоящие заказы.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from mock_samal_server import MockSamalServer, add_shop_arguments, shop_from_args
+
+TEST_USER = {
+    'first_name': 'Нагрузочный тест',
+    'phone': '+77000000000',
+    'address': 'ул. Тестовая, 1',
+    'comment': 'load_test.py',
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def outcome(result: Dict) -> str:
+    if result.get('success'):
+        return 'success'
+    if result.get('site_unavailable'):
+        return 'site_unavailable'
+    return 'failed'
+
+
+async def run_async(orders: int, concurrency: int, items: List[Dict]) -> List[Tuple[float, str]]:
+    """Заказы через AsyncSamalAPI (как у воркеров очереди бота)"""
+    from async_samal_api import AsyncSamalAPI
+    from http_transport import aclose_shared_transport
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_order() -> Tuple[float, str]:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with AsyncSamalAPI() as api:
+                    result = await api.create_order(user_data=TEST_USER, items=items)
+            except Exception as e:
+                result = {'success': False, 'message': str(e)}
+            return time.perf_counter() - started, outcome(result)
+
+    try:
+        return await asyncio.gather(*(one_order() for _ in range(orders)))
+    finally:
+        await aclose_shared_transport()
+
+
+def run_sync(orders: int, concurrency: int, items: List[Dict]) -> List[Tuple[float, str]]:
+    """Заказы через SamalAPI (requests) в пуле потоков"""
+    from samal_api import SamalAPI
+
+    def one_order(_) -> Tuple[float, str]:
+        started = time.perf_counter()
+        try:
+            result = SamalAPI().create_order(user_data=TEST_USER, items=items)
+        except Exception as e:
+            result = {'success': False, 'message': str(e)}
+        return time.perf_counter() - started, outcome(result)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(one_order, range(orders)))
+
+
+def report(results: List[Tuple[float, str]], elapsed: float) -> None:
+    latencies = sorted(latency for latency, _ in results)
+    outcomes = Counter(result for _, result in results)
+    print("\n📊 Результаты")
+    print(f"   Заказов:            {len(results)} за {elapsed:.2f} с")
+    print(f"   Пропускная способность: {len(results) / max(elapsed, 1e-9):.2f} заказов/с")
+    for name in ('success', 'failed', 'site_unavailable'):
+        if outcomes.get(name):
+            print(f"   {name:<20}{outcomes[name]}")
+    print(f"   p50: {percentile(latencies, 0.50) * 1000:.0f} мс   "
+          f"p95: {percentile(latencies, 0.95) * 1000:.0f} мс   "
+          f"p99: {percentile(latencies, 0.99) * 1000:.0f} мс   "
+          f"max: {(latencies[-1] if latencies else 0) * 1000:.0f} мс")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест оформления заказов')
+    parser.add_argument('--orders', type=int, default=100, help='Сколько заказов оформить')
+    parser.add_argument('--concurrency', type=int, default=10, help='Заказов одновременно')
+    parser.add_argument('--client', choices=('async', 'sync'), default='async',
+                        help='async - AsyncSamalAPI (бот), sync - SamalAPI (requests)')
+    parser.add_argument('--items', default='224:2', help='Товары заказа: id:количество через запятую')
+    parser.add_argument('--base-url', help='Адрес уже запущенного сайта вместо встроенного mock')
+    parser.add_argument('--keep-limits', action='store_true',
+                        help='Не отключать ограничение частоты запросов (rate_governor)')
+    parser.add_argument('--verbose', action='store_true', help='Показывать вывод каждого заказа')
+    add_shop_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url.rstrip('/')
+    else:
+        server = MockSamalServer(shop_from_args(args)).start()
+        base_url = server.base_url
+        print(f"🧪 Mock samal.kz: {base_url}")
+
+    # Настройки читаются при импорте config, поэтому модули бота импортируются ниже
+    os.environ['SAMAL_BASE_URL'] = base_url
+    if not args.keep_limits:
+        for name in ('SAMAL_PAGE_RATE', 'SAMAL_PAGE_CONCURRENCY', 'SAMAL_CHECKOUT_RATE', 'SAMAL_CHECKOUT_CONCURRENCY'):
+            os.environ.setdefault(name, '0')
+    if server is not None:
+        # Снимки тестовых ответов не должны попадать в рабочий архив
+        os.environ.setdefault('ORDER_ARCHIVE_PATH', os.path.join(tempfile.gettempdir(), 'load_test_archive.db'))
+
+    items = []
+    for part in args.items.split(','):
+        product_id, _, quantity = part.partition(':')
+        items.append({'product_id': int(product_id), 'quantity': int(quantity or 1)})
+
+    print(f"🚀 {args.orders} заказов, параллельно {args.concurrency}, клиент {args.client}")
+    started = time.perf_counter()
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    try:
+        with output:
+            if args.client == 'async':
+                results = asyncio.run(run_async(args.orders, args.concurrency, items))
+            else:
+                results = run_sync(args.orders, args.concurrency, items)
+    finally:
+        if server is not None:
+            server.stop()
+    report(results, time.perf_counter() - started)
+    if server is not None:
+        print(f"   Сервер: {server.shop.stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
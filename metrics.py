@@ -0,0 +1,235 @@
+"""
+Метрики оформления заказа для Prometheus
+
+Каждый шаг заказа (загрузка магазина, корзина, страница checkout, отправка
+формы, ожидание и загрузка order-received, шаги браузера) пишется в
+гистограмму samal_order_step_seconds, а итог заказа - в счетчик
+samal_orders_total по результату (success, nonce_missing, order_id_missing,
+timeout, ...). Там же - очереди бюджетов запросов к сайту (samal_rate_budget_*)
+и счетчики кешей. Бот отдает метрики на http://METRICS_HOST:METRICS_PORT/metrics.
+
+prometheus_client необязателен: без него все функции ничего не делают.
+
+Использование:
+    @track_order('requests')
+    def create_order(...): ...
+
+    with order_step('requests', 'checkout_post'):
+        response = session.post(...)
+    set_order_outcome('nonce_missing')
+    reset_order_outcome()      # перед повтором, который сам определит итог
+"""
+import asyncio
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional
+
+from config import METRICS_HOST, METRICS_PORT
+from rate_governor import governor_stats
+
+try:
+    from prometheus_client import Counter, Histogram, start_http_server
+    from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Границы корзин гистограммы (секунды): от AJAX-запроса до заказа через браузер
+STEP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+if PROMETHEUS_AVAILABLE:
+    ORDER_STEP_SECONDS = Histogram(
+        'samal_order_step_seconds', 'Длительность шагов оформления заказа на samal.kz',
+        ['backend', 'step'], buckets=STEP_BUCKETS,
+    )
+    ORDERS_TOTAL = Counter(
+        'samal_orders_total', 'Заказы на samal.kz по результату', ['backend', 'outcome'],
+    )
+
+# Состояние текущего заказа: результат и способ оформления. Словарь (а не
+# значения) в ContextVar - чтобы изменения из asyncio.to_thread были видны снаружи
+_order_state: ContextVar[Optional[Dict]] = ContextVar('samal_order_state', default=None)
+
+
+def observe_step(backend: str, step: str, seconds: float) -> None:
+    """Записывает длительность шага заказа"""
+    if PROMETHEUS_AVAILABLE:
+        ORDER_STEP_SECONDS.labels(backend, step).observe(seconds)
+
+
+@contextmanager
+def order_step(backend: str, step: str) -> Iterator[None]:
+    """Замеряет шаг заказа (в том числе завершившийся исключением)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_step(backend, step, time.perf_counter() - started)
+
+
+def set_order_outcome(outcome: str) -> None:
+    """Причина неудачи текущего заказа (учитывается первая, до reset_order_outcome)"""
+    state = _order_state.get()
+    if state is not None:
+        state.setdefault('outcome', outcome)
+
+
+def reset_order_outcome() -> None:
+    """Сбрасывает причину неудачи перед повторной попыткой: итог заказа определит повтор"""
+    state = _order_state.get()
+    if state is not None:
+        state.pop('outcome', None)
+
+
+def set_order_backend(backend: str) -> None:
+    """Способ оформления текущего заказа, если он отличается от указанного в track_order"""
+    state = _order_state.get()
+    if state is not None:
+        state['backend'] = backend
+
+
+def _finish(state: Dict, result: Optional[Dict], elapsed: float) -> None:
+    if result and result.get('success'):
+        outcome = 'success'
+    elif result and result.get('site_unavailable'):
+        outcome = 'site_unavailable'
+    else:
+        outcome = state.get('outcome', 'error')
+    if isinstance(result, dict):
+        # По итогу backend_router отличает сбои способа оформления от ошибок в данных покупателя
+        result.setdefault('outcome', outcome)
+    if not PROMETHEUS_AVAILABLE:
+        return
+    ORDERS_TOTAL.labels(state['backend'], outcome).inc()
+    ORDER_STEP_SECONDS.labels(state['backend'], 'total').observe(elapsed)
+
+
+def track_order(backend: str) -> Callable:
+    """
+    Декоратор create_order/complete_checkout: считает итог заказа и общее время
+    и записывает итог в результат (result['outcome']).
+    Вложенные вызовы (create_order внутри submit) не учитываются повторно.
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _order_state.get() is not None:
+                    return await func(*args, **kwargs)
+                state = {'backend': backend}
+                token = _order_state.set(state)
+                started = time.perf_counter()
+                result = None
+                try:
+                    result = await func(*args, **kwargs)
+                    return result
+                finally:
+                    _order_state.reset(token)
+                    _finish(state, result, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _order_state.get() is not None:
+                return func(*args, **kwargs)
+            state = {'backend': backend}
+            token = _order_state.set(state)
+            started = time.perf_counter()
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                _order_state.reset(token)
+                _finish(state, result, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Кеши, счетчики которых отдаются в /metrics: имя -> stats()
+_caches: Dict[str, Callable[[], Dict]] = {}
+
+
+class _CacheCollector:
+    """Читает счетчики кешей при каждом запросе /metrics"""
+
+    def collect(self):
+        requests = CounterMetricFamily('samal_cache_requests', 'Обращения к кешам бота', labels=['cache', 'result'])
+        size = GaugeMetricFamily('samal_cache_size', 'Записей в кешах бота', labels=['cache'])
+        for cache, stats in list(_caches.items()):
+            values = stats()
+            requests.add_metric([cache, 'hit'], values['hits'])
+            requests.add_metric([cache, 'miss'], values['misses'])
+            size.add_metric([cache], values['size'])
+        yield requests
+        yield size
+
+
+class _GovernorCollector:
+    """Очереди бюджетов запросов к samal.kz (rate_governor.governor_stats) при каждом запросе /metrics"""
+
+    def collect(self):
+        in_flight = GaugeMetricFamily('samal_rate_budget_in_flight', 'Запросов к samal.kz в работе',
+                                      labels=['budget'])
+        waiting = GaugeMetricFamily('samal_rate_budget_waiting', 'Запросов к samal.kz в очереди бюджета',
+                                    labels=['budget'])
+        acquired = CounterMetricFamily('samal_rate_budget_acquired', 'Запросов, прошедших бюджет',
+                                       labels=['budget'])
+        wait = GaugeMetricFamily('samal_rate_budget_wait_seconds',
+                                 'Ожидание в очереди бюджета (последние запросы)', labels=['budget', 'stat'])
+        for name, stats in governor_stats().items():
+            in_flight.add_metric([name], stats['in_flight'])
+            waiting.add_metric([name], stats['waiting'])
+            acquired.add_metric([name], stats['acquired'])
+            for stat in ('avg', 'p50', 'p95', 'max'):
+                wait.add_metric([name, stat], stats[f'{stat}_wait_ms'] / 1000)
+        yield in_flight
+        yield waiting
+        yield acquired
+        yield wait
+
+
+if PROMETHEUS_AVAILABLE:
+    REGISTRY.register(_GovernorCollector())
+
+
+def register_cache_metrics(cache: str, stats: Callable[[], Dict]) -> None:
+    """
+    Отдает попадания, промахи и размер кеша в /metrics
+
+    Args:
+        cache: Имя кеша (метка cache)
+        stats: Функция, возвращающая {'hits', 'misses', 'size'}
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return
+    if not _caches:
+        REGISTRY.register(_CacheCollector())
+    _caches[cache] = stats
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> bool:
+    """
+    Запускает HTTP endpoint /metrics в фоновом потоке
+
+    Returns:
+        True, если endpoint запущен
+    """
+    if port <= 0:
+        return False
+    if not PROMETHEUS_AVAILABLE:
+        logger.error("prometheus_client не установлен, метрики недоступны (pip install prometheus-client)")
+        return False
+    try:
+        start_http_server(port, addr=host)
+    except OSError as e:
+        logger.error(f"Не удалось запустить endpoint метрик на {host}:{port}: {str(e)}")
+        return False
+    print(f"📈 Метрики: http://{host}:{port}/metrics")
+    return True
@@ -0,0 +1,364 @@
+"""
+Локальная замена samal.kz для нагрузочного тестирования и замеров задержек
+
+Сервер повторяет те части WooCommerce, которыми пользуется бот:
+    GET  /shop/?add-to-cart=<id>&quantity=<n>   - добавление в корзину
+    POST /?wc-ajax=add_to_cart                   - AJAX добавление в корзину
+    POST /?wc-ajax=remove_from_cart              - AJAX удаление из корзины
+    GET  /checkout/                              - страница checkout (шаблон checkout_page.html)
+    POST /?wc-ajax=checkout                      - отправка заказа (JSON с redirect)
+    POST /checkout/                              - отправка формы без JavaScript (браузер)
+    GET  /checkout/order-received/<id>/          - страница подтверждения
+    GET  /__mock/stats                           - счетчики сервера (JSON)
+
+Корзина и nonce привязаны к cookie сессии, как в WooCommerce; сессии без
+запросов дольше SESSION_IDLE_TIMEOUT удаляются. Можно задать
+задержку ответов, долю ошибок 503 и срок жизни nonce.
+
+Запуск:
+    python mock_samal_server.py --port 8081 --latency 80 --error-rate 0.02
+    SAMAL_BASE_URL=http://127.0.0.1:8081 python test_api.py
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkout_page.html')
+SESSION_COOKIE = 'wp_woocommerce_session_mock'
+# Адрес и nonce, сохраненные в шаблоне страницы checkout
+TEMPLATE_BASE_URL = 'https://samal.kz'
+NONCE_PATTERN = re.compile(r'(name="woocommerce-process-checkout-nonce" value=")[^"]*(")')
+FIRST_ORDER_ID = 100000
+# Сессия без запросов дольше этого срока удаляется (как истекшая сессия WooCommerce), сек
+SESSION_IDLE_TIMEOUT = 600
+# Больше сессий не храним: самые давно не использованные удаляются
+MAX_SESSIONS = 50000
+
+
+class MockSession:
+    """Сессия покупателя: корзина и nonce checkout"""
+
+    def __init__(self):
+        self.cart: Dict[int, int] = {}
+        self.nonce = secrets.token_hex(5)
+        self.nonce_issued_at = time.monotonic()
+        self.last_seen = self.nonce_issued_at
+
+
+class MockSamal:
+    """Состояние магазина (общее для всех потоков сервера)"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, checkout_latency_ms: float = 0,
+                 error_rate: float = 0, nonce_ttl: float = 0):
+        """
+        Args:
+            latency_ms: Средняя задержка каждого ответа
+            jitter_ms: Случайный разброс задержки (+/-)
+            checkout_latency_ms: Дополнительная задержка отправки заказа
+            error_rate: Доля запросов, на которые отвечаем 503
+            nonce_ttl: Через сколько секунд nonce перестает приниматься (0 - не истекает)
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.checkout_latency_ms = checkout_latency_ms
+        self.error_rate = error_rate
+        self.nonce_ttl = nonce_ttl
+        self.base_url = ''
+        self._lock = threading.Lock()
+        # Порядок - от давно не использованной сессии к последней
+        self._sessions: 'OrderedDict[str, MockSession]' = OrderedDict()
+        self._order_ids = itertools.count(FIRST_ORDER_ID)
+        self._counters: Dict[str, int] = {}
+        with open(TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+            self._template = f.read()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._counters, sessions=len(self._sessions))
+
+    def session(self, session_id: Optional[str]) -> Tuple[str, MockSession]:
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None:
+                session.last_seen = now
+                self._sessions.move_to_end(session_id)
+                return session_id, session
+            self._expire_sessions(now)
+            session_id = secrets.token_hex(16)
+            session = self._sessions[session_id] = MockSession()
+            return session_id, session
+
+    def _expire_sessions(self, now: float) -> None:
+        """Удаляет простаивающие сессии и лишние сверх MAX_SESSIONS (вызывается под self._lock)"""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < SESSION_IDLE_TIMEOUT and len(self._sessions) < MAX_SESSIONS:
+                break
+            del self._sessions[session_id]
+            self._counters['sessions_expired'] = self._counters.get('sessions_expired', 0) + 1
+
+    def delay(self, extra_ms: float = 0) -> None:
+        delay_ms = self.latency_ms + extra_ms
+        if self.jitter_ms:
+            delay_ms += random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def nonce_valid(self, session: MockSession, nonce: str) -> bool:
+        if nonce != session.nonce:
+            return False
+        return not self.nonce_ttl or time.monotonic() - session.nonce_issued_at < self.nonce_ttl
+
+    def next_order_id(self) -> int:
+        with self._lock:
+            return next(self._order_ids)
+
+    def checkout_html(self, session: MockSession) -> str:
+        html = self._template.replace(TEMPLATE_BASE_URL, self.base_url)
+        return NONCE_PATTERN.sub(lambda m: m.group(1) + session.nonce + m.group(2), html)
+
+
+class MockSamalHandler(BaseHTTPRequestHandler):
+    server_version = 'MockSamal/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def shop(self) -> MockSamal:
+        return self.server.shop
+
+    def log_message(self, format, *args) -> None:
+        logger.info(format % args)
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def _handle(self, method: str) -> None:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        body = self._read_body() if method == 'POST' else ''
+        form = {key: values[0] for key, values in parse_qs(body).items()}
+
+        if url.path == '/__mock/stats':
+            self._send_json(self.shop.stats())
+            return
+
+        self.shop.count('requests')
+        ajax = query.get('wc-ajax', [''])[0]
+        self.shop.delay(self.shop.checkout_latency_ms if ajax == 'checkout' else 0)
+        if self.shop.should_fail():
+            self.shop.count('errors_503')
+            self._send(503, 'Service Unavailable', 'text/plain')
+            return
+
+        session_id, session = self.shop.session(self._session_cookie())
+        self._session_id = session_id
+
+        if ajax == 'add_to_cart' and method == 'POST':
+            self._add_to_cart(session, form.get('product_id'), form.get('quantity'))
+            self._send_json({'fragments': {}, 'cart_hash': hashlib.md5(repr(session.cart).encode()).hexdigest()})
+        elif ajax == 'remove_from_cart' and method == 'POST':
+            removed = self._remove_from_cart(session, form.get('cart_item_key', ''))
+            self._send_json({'fragments': {}} if removed else {'success': False})
+        elif ajax == 'checkout' and method == 'POST':
+            self._send_json(self._checkout(session, form))
+        elif url.path.startswith('/checkout/order-received/'):
+            self._order_received(url.path)
+        elif url.path.rstrip('/') == '/checkout' and method == 'POST':
+            # Браузер без JavaScript сайта отправляет форму обычным POST
+            result = self._checkout(session, form)
+            if result['result'] == 'success':
+                self._redirect(result['redirect'])
+            else:
+                self._send(200, f"<html><body>{result['messages']}</body></html>")
+        elif url.path.rstrip('/') == '/checkout':
+            if not session.cart:
+                # WooCommerce не показывает checkout с пустой корзиной
+                self._redirect(f"{self.shop.base_url}/cart/")
+            else:
+                self.shop.count('checkout_pages')
+                self._send(200, self.shop.checkout_html(session))
+        elif url.path.rstrip('/') in ('/shop', '', '/cart'):
+            notice = ''
+            if 'add-to-cart' in query:
+                self._add_to_cart(session, query['add-to-cart'][0], query.get('quantity', ['1'])[0])
+                notice = '<div class="woocommerce-message">Товар добавлен в корзину</div>'
+            items = ''.join(f'<li>{pid} x {qty}</li>' for pid, qty in session.cart.items())
+            self._send(200, f'<html><body>{notice}<div class="widget_shopping_cart_content">'
+                            f'<ul>{items}</ul></div></body></html>')
+        else:
+            self._send(404, 'Not Found', 'text/plain')
+
+    def _add_to_cart(self, session: MockSession, product_id, quantity) -> None:
+        try:
+            product_id, quantity = int(product_id), max(1, int(quantity or 1))
+        except (TypeError, ValueError):
+            return
+        session.cart[product_id] = session.cart.get(product_id, 0) + quantity
+        self.shop.count('add_to_cart')
+
+    def _remove_from_cart(self, session: MockSession, cart_item_key: str) -> bool:
+        for product_id in list(session.cart):
+            if hashlib.md5(str(product_id).encode()).hexdigest() == cart_item_key:
+                del session.cart[product_id]
+                return True
+        return False
+
+    def _checkout(self, session: MockSession, form: Dict[str, str]) -> Dict:
+        self.shop.count('checkout_submits')
+        if not self.shop.nonce_valid(session, form.get('woocommerce-process-checkout-nonce', '')):
+            self.shop.count('checkout_nonce_rejected')
+            # Как WooCommerce: новый nonce выдается со следующей страницей checkout
+            session.nonce = secrets.token_hex(5)
+            session.nonce_issued_at = time.monotonic()
+            return {'result': 'failure', 'refresh': True, 'reload': False,
+                    'messages': '<ul class="woocommerce-error" role="alert"><li>Сессия истекла. '
+                                'Обновите страницу.</li></ul>'}
+        if not form.get('billing_phone', '').strip():
+            # Ошибка заполнения поля: nonce и корзина при этом остаются в силе
+            self.shop.count('checkout_invalid_fields')
+            return {'result': 'failure', 'refresh': False, 'reload': False,
+                    'messages': '<ul class="woocommerce-error" role="alert"><li><strong>Телефон</strong> '
+                                'является обязательным полем.</li></ul>'}
+        if not session.cart:
+            self.shop.count('checkout_empty_cart')
+            return {'result': 'failure', 'refresh': False, 'reload': False,
+                    'messages': '<ul class="woocommerce-error" role="alert"><li>Ваша корзина пуста.</li></ul>'}
+        order_id = self.shop.next_order_id()
+        session.cart.clear()
+        self.shop.count('orders')
+        return {'result': 'success',
+                'redirect': f"{self.shop.base_url}/checkout/order-received/{order_id}/?key=wc_order_{secrets.token_hex(6)}"}
+
+    def _order_received(self, path: str) -> None:
+        match = re.search(r'order-received/(\d+)', path)
+        if not match:
+            self._send(404, 'Not Found', 'text/plain')
+            return
+        order_id = match.group(1)
+        self._send(200, f'<html><body class="woocommerce-order-received">'
+                        f'<a href="{self.shop.base_url}/checkout/order-received/{order_id}/">Заказ</a>'
+                        f'<p>Номер заказа: <strong>{order_id}</strong></p></body></html>')
+
+    def _read_body(self) -> str:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8', errors='replace') if length else ''
+
+    def _session_cookie(self) -> Optional[str]:
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        return cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+
+    def _send_json(self, payload: Dict) -> None:
+        self._send(200, json.dumps(payload, ensure_ascii=False), 'application/json; charset=UTF-8')
+
+    def _redirect(self, location: str) -> None:
+        self._send(302, '', 'text/html', {'Location': location})
+
+    def _send(self, status: int, body: str, content_type: str = 'text/html; charset=UTF-8',
+              headers: Optional[Dict[str, str]] = None) -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        session_id = getattr(self, '_session_id', None)
+        if session_id:
+            self.send_header('Set-Cookie', f"{SESSION_COOKIE}={session_id}; Path=/; HttpOnly")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockSamalServer:
+    """
+    Сервер в фоновом потоке (для нагрузочного теста в том же процессе).
+
+    Использование:
+        server = MockSamalServer(MockSamal(latency_ms=50)).start()
+        os.environ['SAMAL_BASE_URL'] = server.base_url
+        ...
+        server.stop()
+    """
+
+    def __init__(self, shop: MockSamal, host: str = '127.0.0.1', port: int = 0):
+        self.shop = shop
+        self.httpd = ThreadingHTTPServer((host, port), MockSamalHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.shop = shop
+        host, port = self.httpd.server_address[:2]
+        self.base_url = f"http://{host}:{port}"
+        shop.base_url = self.base_url
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'MockSamalServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-samal', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_shop_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры поведения магазина (общие для сервера и нагрузочного теста)"""
+    parser.add_argument('--latency', type=float, default=50, help='Задержка ответа, мс')
+    parser.add_argument('--jitter', type=float, default=20, help='Разброс задержки, мс')
+    parser.add_argument('--checkout-latency', type=float, default=300, help='Доп. задержка отправки заказа, мс')
+    parser.add_argument('--error-rate', type=float, default=0, help='Доля ответов 503 (0..1)')
+    parser.add_argument('--nonce-ttl', type=float, default=0, help='Срок жизни nonce, сек (0 - бессрочно)')
+
+
+def shop_from_args(args: argparse.Namespace) -> MockSamal:
+    return MockSamal(latency_ms=args.latency, jitter_ms=args.jitter, checkout_latency_ms=args.checkout_latency,
+                     error_rate=args.error_rate, nonce_ttl=args.nonce_ttl)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Локальная замена samal.kz')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    add_shop_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockSamalServer(shop_from_args(args), args.host, args.port)
+    print(f"🧪 Mock samal.kz: {server.base_url}")
+    print(f"   SAMAL_BASE_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
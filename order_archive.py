@@ -0,0 +1,282 @@
+"""
+Архив HTML ответов заказов
+
+Вместо отдельного файла order_response_*.html на каждый заказ снимки ответа
+сжимаются и складываются в SQLite (таблица snapshots) с привязкой к локальному
+номеру заказа. Запись и сжатие выполняет фоновый поток, старые снимки
+удаляются по возрасту и общему размеру архива.
+
+Просмотр из командной строки:
+    python order_archive.py list [--order ID] [--limit N]
+    python order_archive.py show REF
+    python order_archive.py extract REF [-o файл.html]
+    python order_archive.py prune
+"""
+import argparse
+import atexit
+import datetime
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from config import ORDER_ARCHIVE_PATH, ORDER_ARCHIVE_MAX_MB, ORDER_ARCHIVE_MAX_AGE_DAYS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+COMPRESSION_LEVEL = 6
+QUEUE_SIZE = 1000
+# Проверять ограничения архива после каждых N записей
+PRUNE_EVERY = 50
+
+
+class OrderArchive:
+    """
+    Хранилище сжатых снимков ответов.
+
+    store() только кладет снимок в очередь и сразу возвращает его ссылку (ref),
+    сжатие и запись в SQLite выполняются в фоновом потоке.
+    """
+
+    def __init__(self, db_path: str = ORDER_ARCHIVE_PATH, max_bytes: int = ORDER_ARCHIVE_MAX_MB * 1024 * 1024,
+                 max_age_days: int = ORDER_ARCHIVE_MAX_AGE_DAYS):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._written = 0
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Создает подключение к базе архива"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ref TEXT UNIQUE,
+                local_order_id INTEGER,
+                kind TEXT,
+                note TEXT,
+                size INTEGER,
+                compressed_size INTEGER,
+                body BLOB,
+                created_at REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_snapshots_order ON snapshots (local_order_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_snapshots_created ON snapshots (created_at)')
+        return conn
+
+    def store(self, kind: str, body: str, header_lines: Optional[List[str]] = None,
+              local_order_id: Optional[int] = None) -> Optional[str]:
+        """
+        Ставит снимок ответа в очередь на запись
+
+        Args:
+            kind: Тип снимка (order_response, order_error, order_timeout, ...)
+            body: HTML/текст ответа
+            header_lines: Служебные строки (статусы, URL, заголовки)
+            local_order_id: Номер заказа в локальной базе бота
+
+        Returns:
+            Ссылка на снимок (ref) или None, если очередь переполнена
+        """
+        ref = f"{kind}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(self._counter)}"
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((ref, kind, body, header_lines or [], local_order_id, time.time()))
+        except queue.Full:
+            logger.error(f"Очередь архива переполнена, снимок {ref} не сохранен")
+            return None
+        return ref
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='order-archive', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self) -> None:
+        """Дописывает очередь и останавливает поток"""
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=5)
+            except queue.Full:
+                logger.error("Очередь архива переполнена при остановке")
+                return
+            self._thread.join(timeout=10)
+
+    def _run(self) -> None:
+        conn = self.get_connection()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                try:
+                    self._write(conn, item)
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить снимок {item[0]}: {str(e)}")
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, item) -> None:
+        ref, kind, body, header_lines, local_order_id, created_at = item
+        raw = body.encode('utf-8', errors='replace')
+        compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+        conn.execute('''
+            INSERT INTO snapshots (ref, local_order_id, kind, note, size, compressed_size, body, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (ref, local_order_id, kind, '\n'.join(header_lines), len(raw), len(compressed), compressed, created_at))
+        conn.commit()
+
+        self._written += 1
+        if self._written % PRUNE_EVERY == 0:
+            self.prune(conn)
+
+    def prune(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """
+        Удаляет снимки старше max_age_days и самые старые снимки сверх max_bytes
+
+        Returns:
+            Количество удаленных снимков
+        """
+        own_conn = conn is None
+        conn = conn or self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cutoff = time.time() - self.max_age_days * 86400
+            cursor.execute('DELETE FROM snapshots WHERE created_at < ?', (cutoff,))
+            deleted = cursor.rowcount
+
+            cursor.execute('SELECT COALESCE(SUM(compressed_size), 0) FROM snapshots')
+            total = cursor.fetchone()[0]
+            if total > self.max_bytes:
+                # Идем от самых старых, пока архив не уложится в лимит
+                excess = total - self.max_bytes
+                cursor.execute('SELECT id, compressed_size FROM snapshots ORDER BY created_at')
+                to_delete = []
+                for snapshot_id, size in cursor.fetchall():
+                    if excess <= 0:
+                        break
+                    to_delete.append((snapshot_id,))
+                    excess -= size
+                cursor.executemany('DELETE FROM snapshots WHERE id = ?', to_delete)
+                deleted += len(to_delete)
+            conn.commit()
+            return deleted
+        finally:
+            if own_conn:
+                conn.close()
+
+    def list_snapshots(self, local_order_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+        """Возвращает последние снимки (без содержимого)"""
+        conn = self.get_connection()
+        try:
+            query = 'SELECT ref, local_order_id, kind, size, compressed_size, created_at FROM snapshots'
+            params: list = []
+            if local_order_id is not None:
+                query += ' WHERE local_order_id = ?'
+                params.append(local_order_id)
+            query += ' ORDER BY created_at DESC LIMIT ?'
+            params.append(limit)
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        return [{
+            'ref': row[0],
+            'local_order_id': row[1],
+            'kind': row[2],
+            'size': row[3],
+            'compressed_size': row[4],
+            'created_at': datetime.datetime.fromtimestamp(row[5]).strftime('%Y-%m-%d %H:%M:%S'),
+        } for row in rows]
+
+    def get_html(self, ref: str) -> Optional[str]:
+        """
+        Возвращает снимок в виде HTML (служебные строки - в комментариях)
+
+        Args:
+            ref: Ссылка на снимок или номер локального заказа (последний снимок заказа)
+        """
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT note, body FROM snapshots WHERE ref = ?', (ref,)).fetchone()
+            if row is None and ref.isdigit():
+                row = conn.execute(
+                    'SELECT note, body FROM snapshots WHERE local_order_id = ? ORDER BY created_at DESC LIMIT 1',
+                    (int(ref),)
+                ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        note, body = row
+        html = zlib.decompress(body).decode('utf-8', errors='replace')
+        if note:
+            header = ''.join(f"<!-- {line} -->\n" for line in note.split('\n'))
+            html = header + '\n' + html
+        return html
+
+
+# Общий архив процесса
+order_archive = OrderArchive()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """CLI для просмотра архива"""
+    parser = argparse.ArgumentParser(description='Архив HTML ответов заказов Samal')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='Последние снимки')
+    list_parser.add_argument('--order', type=int, help='Локальный номер заказа')
+    list_parser.add_argument('--limit', type=int, default=20)
+
+    show_parser = subparsers.add_parser('show', help='Вывести снимок')
+    show_parser.add_argument('ref', help='Ссылка на снимок или номер заказа')
+
+    extract_parser = subparsers.add_parser('extract', help='Сохранить снимок в файл')
+    extract_parser.add_argument('ref', help='Ссылка на снимок или номер заказа')
+    extract_parser.add_argument('-o', '--output', help='Имя файла (по умолчанию <ref>.html)')
+
+    subparsers.add_parser('prune', help='Применить ограничения по возрасту и размеру')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for item in order_archive.list_snapshots(args.order, args.limit):
+            print(f"{item['created_at']}  {item['ref']}  заказ={item['local_order_id']}  "
+                  f"{item['size']} -> {item['compressed_size']} байт")
+        return 0
+
+    if args.command == 'prune':
+        print(f"Удалено снимков: {order_archive.prune()}")
+        return 0
+
+    html = order_archive.get_html(args.ref)
+    if html is None:
+        print(f"❌ Снимок {args.ref} не найден")
+        return 1
+    if args.command == 'show':
+        print(html)
+    else:
+        filename = args.output or f"{args.ref}.html"
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(html)
+        print(f"💾 Снимок сохранен в файл: {filename}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
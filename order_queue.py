@@ -0,0 +1,265 @@
+"""
+Фоновая отправка заказов из очереди в базе данных
+
+Бот только сохраняет заказ в таблицу order_jobs и сразу отвечает
+пользователю. Несколько асинхронных воркеров забирают задания под аренду
+(lease), оформляют заказ на samal.kz, обновляют статус в orders и
+присылают пользователю результат. Если бот упал посреди оформления,
+после перезапуска задание снова будет выдано, когда истечет аренда.
+Перед отправкой формы checkout задание отмечается в базе как отправленное:
+такое задание повторно не выдается, а пользователь получает просьбу
+проверить подтверждение от Samal (повтор мог бы создать дубликат заказа).
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from async_samal_api import AsyncSamalAPI
+from backend_router import BACKEND_BROWSER, BACKEND_HTTP, order_router
+from samal_api import checkout_submit_guard, normalize_order_items
+from config import ORDER_WORKERS, ORDER_JOB_LEASE, ORDER_QUEUE_POLL_INTERVAL, ORDER_JOB_MAX_ATTEMPTS
+from database import AsyncDatabase
+from resilience import error_outcome
+from session_pool import checkout_pool
+from speculative_checkout import SpeculativeCheckout
+from tracing import trace
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Уведомление пользователя: notify(job, result)
+NotifyCallback = Callable[[Dict, Dict], Awaitable[None]]
+
+
+class OrderWorkerPool:
+    """
+    Пул воркеров очереди заказов.
+
+    Использование:
+        await order_workers.start(db, notify)                 # при запуске бота
+        payload['speculative_key'] = order_workers.attach_speculative(spec)  # необязательно
+        order_id = await db.enqueue_order(..., payload=payload)
+        order_workers.wake()
+        await order_workers.stop()                            # при остановке бота
+    """
+
+    def __init__(self, workers: int = ORDER_WORKERS, lease_seconds: float = ORDER_JOB_LEASE,
+                 poll_interval: float = ORDER_QUEUE_POLL_INTERVAL, max_attempts: int = ORDER_JOB_MAX_ATTEMPTS):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.db: Optional[AsyncDatabase] = None
+        self._notify: Optional[NotifyCallback] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # Корзины, подготовленные на экране подтверждения (живут только в памяти процесса):
+        # ключ из payload заказа -> корзина
+        self._speculative: Dict[str, SpeculativeCheckout] = {}
+        self._speculative_ids = itertools.count(1)
+
+    async def start(self, db: AsyncDatabase, notify: NotifyCallback) -> None:
+        """Запускает воркеров"""
+        if self._tasks:
+            return
+        self.db = db
+        self._notify = notify
+        self._wakeup = asyncio.Event()
+        prefix = f"{os.getpid()}"
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{prefix}-{i}")) for i in range(max(1, self.workers))
+        ]
+
+    async def stop(self) -> None:
+        """Останавливает воркеров. Незавершенные задания подхватит следующий запуск"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for speculative in self._speculative.values():
+            await speculative.discard()
+        self._speculative.clear()
+
+    def wake(self) -> None:
+        """Сообщает воркерам, что в очереди появился заказ"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def attach_speculative(self, speculative: SpeculativeCheckout) -> str:
+        """
+        Передает воркерам корзину, подготовленную на экране подтверждения
+
+        Вызывается до enqueue_order: воркер может забрать заказ сразу после
+        записи в базу, и корзина к этому моменту уже должна быть доступна.
+
+        Returns:
+            Ключ, который нужно сохранить в payload заказа ('speculative_key')
+        """
+        key = f"{os.getpid()}-{next(self._speculative_ids)}"
+        self._speculative[key] = speculative
+        return key
+
+    async def detach_speculative(self, key: str) -> None:
+        """Выбрасывает корзину, если заказ так и не попал в очередь"""
+        speculative = self._speculative.pop(key, None)
+        if speculative:
+            await speculative.discard()
+
+    async def _wait_for_work(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _worker(self, worker_id: str) -> None:
+        while True:
+            try:
+                job = await self.db.claim_order_job(worker_id, self.lease_seconds, self.max_attempts)
+                if job is None:
+                    await self._notify_abandoned()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при получении заказа из очереди: {str(e)}")
+                job = None
+
+            if job is None:
+                await self._wait_for_work()
+                continue
+
+            await self._process(worker_id, job)
+
+    async def _process(self, worker_id: str, job: Dict) -> None:
+        trace('order_job_started', location='order_queue.py:_process',
+              order_id=job['order_id'], worker=worker_id, attempt=job['attempts'])
+        # Форма checkout отправляется, только пока задание в нашей аренде
+        guard = functools.partial(self.db.sync.mark_order_job_submitted, job['id'], worker_id)
+        with checkout_submit_guard(guard):
+            run = asyncio.create_task(self._run_order(job))
+        heartbeat = asyncio.create_task(self._keep_lease(worker_id, job['id']))
+        try:
+            await asyncio.wait({run, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            if not run.done():
+                # Аренда потеряна - задание мог забрать другой воркер
+                run.cancel()
+                try:
+                    await run
+                except (asyncio.CancelledError, Exception):
+                    pass
+                logger.error(f"Оформление заказа {job['order_id']} прервано: аренда задания потеряна")
+                return
+            result = run.result()
+        except asyncio.CancelledError:
+            # Бот останавливается - задание останется в аренде и будет выдано
+            # повторно (если форма checkout еще не отправлялась)
+            run.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при оформлении заказа {job['order_id']}: {str(e)}")
+            result = {'success': False, 'message': f'Произошла ошибка: {str(e)}', 'order_id': None}
+        finally:
+            heartbeat.cancel()
+
+        status = 'success' if result['success'] else 'failed'
+        try:
+            completed = await self.db.complete_order_job(
+                job['id'], job['order_id'], worker_id, status, None if result['success'] else result.get('message')
+            )
+        except Exception as e:
+            logger.error(f"Не удалось обновить статус заказа {job['order_id']}: {str(e)}")
+        else:
+            if not completed:
+                # Задание уже завершено без нас (fail_abandoned_order_jobs) - пользователь уведомлен
+                logger.error(f"Заказ {job['order_id']} завершен, но аренда задания потеряна")
+                return
+        trace('order_job_finished', location='order_queue.py:_process',
+              order_id=job['order_id'], worker=worker_id, status=status)
+
+        await self._send(job, result)
+
+    async def _keep_lease(self, worker_id: str, job_id: int) -> None:
+        """Продлевает аренду, пока заказ оформляется. Завершается, если аренда потеряна"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                extended = await self.db.extend_order_job_lease(job_id, worker_id, self.lease_seconds)
+                if not extended:
+                    logger.error(f"Аренда задания {job_id} потеряна")
+                    return
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду задания {job_id}: {str(e)}")
+
+    async def _run_order(self, job: Dict) -> Dict:
+        """Оформляет заказ на сайте способом, который выбрал order_router"""
+        backend = order_router.choose()
+        started = time.monotonic()
+        try:
+            result = await self._run_order_with(backend, job)
+        except Exception as e:
+            order_router.record(backend, {'success': False, 'outcome': error_outcome(e)},
+                                time.monotonic() - started)
+            raise
+        order_router.record(backend, result, time.monotonic() - started)
+        return result
+
+    async def _run_order_with(self, backend: str, job: Dict) -> Dict:
+        payload = job['payload']
+        order_id = job['order_id']
+        # Задания до появления корзины содержат один товар (product_id/quantity)
+        items = normalize_order_items(payload.get('product_id'), payload.get('quantity'), payload.get('items'))
+        user_data = payload['user_data']
+        order_items = [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in items]
+
+        # Ключ из другого процесса (бот перезапущен) просто не найдется
+        key = payload.get('speculative_key')
+        speculative = self._speculative.pop(key, None) if key else None
+        if speculative and backend == BACKEND_HTTP and speculative.matches(items):
+            # Корзина и nonce уже подготовлены на экране подтверждения
+            return await speculative.submit(user_data, order_id)
+        if speculative:
+            await speculative.discard()
+
+        if backend == BACKEND_BROWSER:
+            async with AsyncSamalAPI(local_order_id=order_id) as api:
+                return await api.create_order(user_data=user_data, use_browser=True, items=order_items)
+
+        # Берем подготовленную сессию checkout из пула (если есть) - тогда
+        # не нужно заново загружать страницы магазина и checkout
+        warm_session = checkout_pool.acquire()
+        async with AsyncSamalAPI(cookies=warm_session.cookies if warm_session else None,
+                                 local_order_id=order_id) as api:
+            return await api.create_order(
+                user_data=user_data,
+                warm_session=warm_session,
+                items=order_items
+            )
+
+    async def _notify_abandoned(self) -> None:
+        """Сообщает пользователям о заказах, прерванных слишком много раз"""
+        jobs = await self.db.fail_abandoned_order_jobs(self.max_attempts)
+        for job in jobs:
+            await self._send(job, {
+                'success': False,
+                'message': 'Оформление заказа прервалось. Проверьте, не пришло ли подтверждение '
+                           'от Samal, прежде чем заказывать снова.',
+                'order_id': None,
+            })
+
+    async def _send(self, job: Dict, result: Dict) -> None:
+        try:
+            await self._notify(job, result)
+        except Exception as e:
+            logger.error(f"Не удалось отправить результат заказа {job['order_id']}: {str(e)}")
+
+
+# Общий пул воркеров бота
+order_workers = OrderWorkerPool()
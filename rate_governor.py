@@ -0,0 +1,255 @@
+"""
+Ограничение частоты и параллельности запросов к samal.kz
+
+Все обращения к сайту (HTTP-клиенты и Selenium) проходят через один из
+двух общих бюджетов: загрузка страниц (GET магазина, checkout, AJAX корзины)
+и отправка заказа (POST checkout). У каждого бюджета свой token bucket
+(средняя частота + допустимый всплеск) и лимит одновременных запросов.
+При утреннем пике заказы ждут своей очереди вместо того, чтобы разом
+перегрузить сайт. Время ожидания в очереди собирается в статистику.
+
+Использование:
+    with page_budget:                  # синхронный код и потоки Selenium
+        response = session.get(url)
+    async with checkout_budget:        # асинхронный клиент
+        response = await client.post(url, data=form)
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config import (
+    SAMAL_PAGE_RATE,
+    SAMAL_PAGE_BURST,
+    SAMAL_PAGE_CONCURRENCY,
+    SAMAL_CHECKOUT_RATE,
+    SAMAL_CHECKOUT_BURST,
+    SAMAL_CHECKOUT_CONCURRENCY,
+)
+from tracing import trace
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+# Ожидания дольше этого пишутся в трассировку (секунды)
+SLOW_WAIT = 1.0
+
+
+class _SlotWaiter:
+    """Запрос, ждущий свободный слот: поток (threading.Event) или корутина (asyncio.Future)"""
+
+    __slots__ = ('loop', 'event', 'future', 'granted')
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        # Слот уже передан этому запросу в release()
+        self.granted = False
+
+    def wake(self) -> bool:
+        """Передает слот ожидающему. False, если его event loop уже закрыт"""
+        if self.event is not None:
+            self.granted = True
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            return False
+        self.granted = True
+        return True
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class RateBudget:
+    """
+    Token bucket + лимит параллельных запросов.
+
+    Потокобезопасен: один бюджет одновременно используют event loop бота
+    (async with) и потоки Selenium (with). Токены выдаются по очереди
+    резервирования, а слоты - через общую очередь ожидающих потоков и
+    корутин, поэтому запросы обслуживаются в порядке прихода.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int):
+        """
+        Args:
+            name: Название бюджета (для статистики)
+            rate: Запросов в секунду в среднем (0 - без ограничения)
+            burst: Сколько запросов можно отправить разом после простоя
+            max_concurrency: Макс. одновременных запросов (0 - без ограничения)
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._in_flight = 0
+        self._slot_waiters: Deque[_SlotWaiter] = deque()
+        self._waiting = 0
+        self._acquired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def _reserve_token(self) -> float:
+        """Резервирует токен и возвращает, сколько секунд ждать до его появления"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def _refund_token(self) -> None:
+        """Возвращает зарезервированный токен запроса, который так и не был отправлен"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def _enter_or_wait(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_SlotWaiter]:
+        """Занимает свободный слот (None) или ставит запрос в конец очереди ожидающих"""
+        with self._lock:
+            if self.max_concurrency <= 0 or (self._in_flight < self.max_concurrency and not self._slot_waiters):
+                self._in_flight += 1
+                return None
+            waiter = _SlotWaiter(loop)
+            self._slot_waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: _SlotWaiter) -> None:
+        """Ожидание слота отменено: убирает запрос из очереди или возвращает уже выданный слот"""
+        with self._lock:
+            if not waiter.granted:
+                self._slot_waiters.remove(waiter)
+                return
+        self.release()
+
+    def _record_wait(self, waited: float) -> None:
+        with self._lock:
+            self._waiting -= 1
+            self._acquired += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._waits.append(waited)
+        if waited >= SLOW_WAIT:
+            trace('rate_limit_wait', location='rate_governor.py:RateBudget',
+                  budget=self.name, wait_ms=int(waited * 1000))
+
+    def acquire(self) -> None:
+        """Ждет токен и свободный слот (блокирует поток)"""
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        delay = self._reserve_token()
+        if delay > 0:
+            time.sleep(delay)
+        waiter = self._enter_or_wait()
+        if waiter is not None:
+            waiter.event.wait()
+        self._record_wait(time.monotonic() - started)
+
+    async def aacquire(self) -> None:
+        """Ждет токен и свободный слот, не блокируя event loop"""
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            delay = self._reserve_token()
+            try:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                waiter = self._enter_or_wait(asyncio.get_running_loop())
+                if waiter is not None:
+                    try:
+                        await waiter.future
+                    except asyncio.CancelledError:
+                        self._abandon(waiter)
+                        raise
+            except asyncio.CancelledError:
+                # Запрос так и не отправлен - токен достанется следующим
+                self._refund_token()
+                raise
+        except BaseException:
+            with self._lock:
+                self._waiting -= 1
+            raise
+        self._record_wait(time.monotonic() - started)
+
+    def release(self) -> None:
+        """Освобождает слот: передает его первому ожидающему или возвращает в бюджет"""
+        with self._lock:
+            while self._slot_waiters:
+                if self._slot_waiters.popleft().wake():
+                    return
+            self._in_flight -= 1
+
+    def __enter__(self) -> 'RateBudget':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    async def __aenter__(self) -> 'RateBudget':
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    def stats(self) -> Dict:
+        """
+        Статистика бюджета
+
+        Returns:
+            Словарь: in_flight, waiting, acquired и время ожидания в очереди
+            (avg/p50/p95/max, миллисекунды)
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+            acquired = self._acquired
+            result = {
+                'name': self.name,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'acquired': acquired,
+                'avg_wait_ms': round(self._total_wait / acquired * 1000, 1) if acquired else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 1),
+            }
+        result['p50_wait_ms'] = round(_percentile(waits, 0.50) * 1000, 1)
+        result['p95_wait_ms'] = round(_percentile(waits, 0.95) * 1000, 1)
+        return result
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+# Общие бюджеты процесса
+page_budget = RateBudget('page', SAMAL_PAGE_RATE, SAMAL_PAGE_BURST, SAMAL_PAGE_CONCURRENCY)
+checkout_budget = RateBudget('checkout', SAMAL_CHECKOUT_RATE, SAMAL_CHECKOUT_BURST, SAMAL_CHECKOUT_CONCURRENCY)
+
+
+def governor_stats() -> Dict[str, Dict]:
+    """Статистика всех бюджетов"""
+    return {budget.name: budget.stats() for budget in (page_budget, checkout_budget)}
@@ -0,0 +1,250 @@
+"""
+Повторы запросов и circuit breaker для обращений к samal.kz
+
+Идемпотентные шаги (GET страницы магазина, checkout, order-received)
+повторяются с экспоненциальной задержкой и случайным разбросом. Все
+запросы, включая отправку заказа, учитываются общим circuit breaker:
+после серии сбоев подряд он "размыкается", и запросы сразу завершаются
+ошибкой CircuitOpenError, пока не пройдет пауза. После паузы пропускается
+один пробный запрос - если он успешен, breaker снова замыкается.
+Каждая попытка также проходит через бюджет частоты запросов (rate_governor).
+
+Использование:
+    response = call_with_retry(session.get, url)                  # requests
+    response = await acall_with_retry(client.get, url)            # httpx
+    response = call_with_retry(session.post, url, data=form, attempts=1, budget=checkout_budget)
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import httpx
+import requests
+
+from config import (
+    SAMAL_RETRY_ATTEMPTS,
+    SAMAL_RETRY_BASE_DELAY,
+    SAMAL_RETRY_MAX_DELAY,
+    SAMAL_BREAKER_FAILURE_THRESHOLD,
+    SAMAL_BREAKER_RESET_TIMEOUT,
+)
+from rate_governor import RateBudget, page_budget
+from tracing import trace
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Ответы, после которых запрос имеет смысл повторить (сайт перегружен или недоступен)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Сайт считается недоступным - запрос не отправлялся"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"samal.kz временно недоступен, повтор через {int(retry_after)} с")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Потокобезопасный circuit breaker (используется и потоками Selenium,
+    и event loop бота).
+    """
+
+    def __init__(self, failure_threshold: int = SAMAL_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = SAMAL_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == STATE_OPEN and self._reset_due():
+                return STATE_HALF_OPEN
+            return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """True, если запросы сейчас отклоняются без обращения к сайту"""
+        with self._lock:
+            if self._state == STATE_OPEN:
+                return not self._reset_due()
+            return self._state == STATE_HALF_OPEN and self._probe_in_flight
+
+    def retry_after(self) -> float:
+        """Через сколько секунд breaker пропустит пробный запрос"""
+        with self._lock:
+            if self._state != STATE_OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def _reset_due(self) -> bool:
+        return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def before_call(self) -> None:
+        """
+        Проверяет, можно ли отправить запрос
+
+        Raises:
+            CircuitOpenError: breaker разомкнут
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return
+            if self._state == STATE_OPEN:
+                if not self._reset_due():
+                    raise CircuitOpenError(self._opened_at + self.reset_timeout - time.monotonic())
+                self._state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+            # Полуоткрытое состояние: пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.reset_timeout)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                trace('circuit_closed', location='resilience.py:CircuitBreaker')
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def abandon_probe(self) -> None:
+        """Запрос отменен без результата - пробный запрос можно отправить снова"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != STATE_OPEN:
+                    logger.error(f"samal.kz недоступен: {self._failures} ошибок подряд, запросы приостановлены")
+                    trace('circuit_opened', level='warning', location='resilience.py:CircuitBreaker',
+                          failures=self._failures)
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+
+def backoff_delay(attempt: int, base_delay: float = SAMAL_RETRY_BASE_DELAY,
+                  max_delay: float = SAMAL_RETRY_MAX_DELAY) -> float:
+    """Задержка перед повтором номер attempt (0, 1, ...): экспонента с полным случайным разбросом"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def error_outcome(error: Exception) -> str:
+    """
+    Итог заказа (для metrics.set_order_outcome) по исключению запроса
+
+    Returns:
+        'timeout', 'transport_error' (соединение оборвано, DNS, TLS) или 'error'
+    """
+    if isinstance(error, (httpx.TimeoutException, requests.Timeout, asyncio.TimeoutError, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (httpx.TransportError, requests.ConnectionError, ConnectionError)):
+        return 'transport_error'
+    return 'error'
+
+
+def _is_retryable_response(response) -> bool:
+    return getattr(response, 'status_code', None) in RETRYABLE_STATUS_CODES
+
+
+def call_with_retry(func: Callable, *args, attempts: int = SAMAL_RETRY_ATTEMPTS,
+                    breaker: Optional[CircuitBreaker] = None, budget: RateBudget = page_budget, **kwargs):
+    """
+    Вызывает HTTP-запрос (requests) с повторами и учетом circuit breaker
+
+    Args:
+        func: Функция запроса (session.get, session.post, ...)
+        attempts: Сколько всего попыток (1 - без повторов, для неидемпотентных запросов)
+        breaker: Circuit breaker (по умолчанию общий для samal.kz)
+        budget: Бюджет частоты запросов (страницы или отправка заказа)
+
+    Returns:
+        Ответ последней попытки
+
+    Raises:
+        CircuitOpenError: breaker разомкнут
+        Exception: ошибка последней попытки
+    """
+    breaker = breaker or samal_breaker
+    for attempt in range(attempts):
+        breaker.before_call()
+        try:
+            with budget:
+                response = func(*args, **kwargs)
+        except Exception as e:
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                raise
+            trace('request_retry', level='debug', location='resilience.py:call_with_retry',
+                  attempt=attempt + 1, error=str(e))
+        else:
+            if not _is_retryable_response(response):
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                return response
+            trace('request_retry', level='debug', location='resilience.py:call_with_retry',
+                  attempt=attempt + 1, status=response.status_code)
+            response.close()
+        time.sleep(backoff_delay(attempt))
+
+
+async def acall_with_retry(func: Callable, *args, attempts: int = SAMAL_RETRY_ATTEMPTS,
+                           breaker: Optional[CircuitBreaker] = None, budget: RateBudget = page_budget, **kwargs):
+    """Асинхронная версия call_with_retry (client.get, client.post, client.send)"""
+    breaker = breaker or samal_breaker
+    for attempt in range(attempts):
+        breaker.before_call()
+        try:
+            async with budget:
+                response = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            breaker.abandon_probe()
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                raise
+            trace('request_retry', level='debug', location='resilience.py:acall_with_retry',
+                  attempt=attempt + 1, error=str(e))
+        else:
+            if not _is_retryable_response(response):
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                return response
+            trace('request_retry', level='debug', location='resilience.py:acall_with_retry',
+                  attempt=attempt + 1, status=response.status_code)
+            await response.aclose()
+        await asyncio.sleep(backoff_delay(attempt))
+
+
+# Общий breaker для всех обращений к samal.kz
+samal_breaker = CircuitBreaker()
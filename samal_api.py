@@ -7,20 +7,31 @@ import time
 import json
 import datetime
 import re
-import os
-import subprocess
-from typing import Dict, Optional
-from config import SAMAL_BASE_URL, SAMAL_SHOP_URL, SAMAL_CHECKOUT_URL
+import hashlib
+import math
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from config import (
+    SAMAL_BASE_URL, SAMAL_SHOP_URL, SAMAL_CHECKOUT_URL,
+    ORDER_FAST_COMPLETION, ORDER_VERIFY_RECEIVED_PAGE,
+)
+from browser_pool import BrowserPoolTimeout, browser_pool
+from checkout_parser import CheckoutPageFields, parse_checkout_chunks
+from http_transport import get_shared_adapter
+from metrics import order_step, observe_step, set_order_backend, set_order_outcome, track_order
+from order_archive import order_archive
+from rate_governor import checkout_budget, page_budget
+from resilience import CircuitOpenError, call_with_retry, error_outcome, samal_breaker
+from tracing import trace, trace_enabled
 
 # Импорты для Selenium (опционально, только если используется браузер)
 try:
-    from selenium import webdriver
     from selenium.webdriver.common.by import By
     from selenium.webdriver.support.ui import WebDriverWait
     from selenium.webdriver.support import expected_conditions as EC
-    from selenium.webdriver.chrome.service import Service
-    from selenium.webdriver.chrome.options import Options
-    from selenium.common.exceptions import TimeoutException, NoSuchElementException
+    from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
     SELENIUM_AVAILABLE = True
 except ImportError:
     SELENIUM_AVAILABLE = False
@@ -30,63 +41,166 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
 
-class SamalAPI:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-        })
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36'
+
+# Заголовки браузера, общие для синхронного и асинхронного клиентов
+DEFAULT_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+}
+
+# Размер куска при потоковой загрузке страницы checkout
+CHECKOUT_CHUNK_SIZE = 16 * 1024
+# Сколько байт остатка страницы дочитывать, чтобы вернуть соединение в пул
+DRAIN_LIMIT = 512 * 1024
+
+# AJAX endpoint WooCommerce, который вызывает кнопка "Подтвердить заказ"
+CHECKOUT_AJAX_URL = f"{SAMAL_BASE_URL}/?wc-ajax=checkout"
+# AJAX endpoints корзины WooCommerce (отвечают коротким JSON вместо целой страницы)
+ADD_TO_CART_AJAX_URL = f"{SAMAL_BASE_URL}/?wc-ajax=add_to_cart"
+REMOVE_FROM_CART_AJAX_URL = f"{SAMAL_BASE_URL}/?wc-ajax=remove_from_cart"
+CHECKOUT_AJAX_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Origin': SAMAL_BASE_URL,
+    'Referer': SAMAL_CHECKOUT_URL,
+    'X-Requested-With': 'XMLHttpRequest',  # Важно: указываем, что это AJAX-запрос
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+}
+
+# Сообщения WooCommerce об устаревшем nonce или сессии: форму можно отправить
+# повторно со свежим nonce. Ошибки заполнения полей (телефон, адрес) сюда не
+# относятся - повтор вернул бы ту же ошибку
+STALE_CHECKOUT_PATTERN = re.compile(
+    r'nonce|session has expired|unable to process your order|сесси[яи] истекл|не удалось обработать (ваш )?заказ',
+    re.IGNORECASE,
+)
+
+# Уведомления WooCommerce об ошибке (корзина, checkout)
+WOOCOMMERCE_ERROR_SELECTOR = ".woocommerce-error, .woocommerce-notice--error"
+# Признаки того, что страница магазина обработала add-to-cart
+CART_READY_SELECTOR = ".woocommerce-message, .woocommerce-error, .cart-contents, .widget_shopping_cart_content"
+# Сколько ждать отклика корзины и результата заказа в браузере (секунды)
+BROWSER_CART_TIMEOUT = 10
+BROWSER_ORDER_TIMEOUT = 30
+
+# Ждет в браузере результат отправки заказа без опроса страницы из Python:
+# MutationObserver срабатывает, когда WooCommerce вставляет уведомление об
+# ошибке. При редиректе на order-received страница выгружается, и Selenium
+# прерывает скрипт - это обрабатывается на стороне Python.
+WAIT_FOR_CHECKOUT_RESULT_JS = '''
+const done = arguments[arguments.length - 1];
+const selector = arguments[0];
+const check = () => {
+    if (window.location.href.indexOf('order-received') !== -1) return 'received';
+    const error = document.querySelector(selector);
+    if (error && error.textContent.trim()) return 'error';
+    return null;
+};
+const initial = check();
+if (initial) { done(initial); return; }
+const observer = new MutationObserver(() => {
+    const result = check();
+    if (result) { observer.disconnect(); done(result); }
+});
+observer.observe(document.documentElement, {childList: true, subtree: true, characterData: true});
+window.addEventListener('beforeunload', () => { observer.disconnect(); done('navigating'); });
+'''
+
+
+def archive_order_html(kind: str, body: str, header_lines: Optional[list] = None,
+                       local_order_id: Optional[int] = None) -> Optional[str]:
+    """
+    Сохраняет снимок ответа в сжатый архив (запись выполняется в фоне)
     
-    def add_to_cart(self, product_id: int, quantity: int = 2) -> bool:
-        """
-        Добавляет товар в корзину
+    Args:
+        kind: Тип снимка (order_response, order_error, ...)
+        body: HTML содержимое
+        header_lines: Служебные строки (статусы, URL, заголовки)
+        local_order_id: Номер заказа в локальной базе бота
         
-        Args:
-            product_id: ID товара на сайте
-            quantity: Количество товара
-            
-        Returns:
-            True если успешно, False если ошибка
-        """
-        try:
-            # Получаем главную страницу для установки cookies
-            init_response = self.session.get(SAMAL_SHOP_URL)
-            
-            # Добавляем товар в корзину
-            url = f"{SAMAL_SHOP_URL}?add-to-cart={product_id}&quantity={quantity}"
-            response = self.session.get(url, allow_redirects=True)
-            
-            success = response.status_code == 200
-            if not success:
-                logger.error(f"Ошибка добавления в корзину. Статус: {response.status_code}")
-            
-            return success
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении в корзину: {str(e)}")
-            return False
+    Returns:
+        Ссылка на снимок или None, если сохранить не удалось
+    """
+    ref = order_archive.store(kind, body, header_lines, local_order_id)
+    if ref:
+        print(f"💾 Снимок ответа сохранен в архив: {ref}")
+    return ref
+
+
+def normalize_order_items(product_id: Optional[int] = None, quantity: Optional[int] = None,
+                          items: Optional[List[Dict]] = None) -> List[Tuple[int, int]]:
+    """
+    Приводит товары заказа к списку пар (product_id, quantity)
     
-    def get_checkout_page(self) -> Optional[str]:
-        """
-        Получает HTML страницы оформления заказа
+    Args:
+        product_id: ID товара (заказ из одного товара)
+        quantity: Количество
+        items: Товары корзины: [{'product_id': 224, 'quantity': 2}, ...]
         
-        Returns:
-            HTML содержимое страницы или None
-        """
-        try:
-            response = self.session.get(SAMAL_CHECKOUT_URL)
-            
-            if response.status_code == 200:
-                return response.text
-            else:
-                logger.error(f"Ошибка получения checkout. Статус: {response.status_code}")
-                return None
-        except Exception as e:
-            logger.error(f"Ошибка при получении страницы checkout: {str(e)}")
-            return None
+    Returns:
+        Список (product_id, quantity)
+    """
+    if items:
+        return [(int(item['product_id']), int(item['quantity'])) for item in items]
+    if product_id is None or quantity is None:
+        raise ValueError("Не указаны товары заказа")
+    return [(product_id, quantity)]
+
+
+def site_unavailable_result(retry_after: float) -> Dict:
+    """Результат заказа, когда circuit breaker считает сайт недоступным"""
+    minutes = max(1, math.ceil(retry_after / 60))
+    return {
+        'success': False,
+        'message': f'Сайт samal.kz сейчас не отвечает. Попробуйте через {minutes} мин.',
+        'order_id': None,
+        'site_unavailable': True,
+    }
+
+
+class CheckoutSubmitRefused(Exception):
+    """Отправка формы checkout запрещена (задание очереди заказов потеряло аренду)"""
+
+
+# Проверка перед отправкой формы checkout (ставит воркер очереди заказов):
+# отмечает задание как отправленное и возвращает False, если отправлять нельзя
+_submit_guard: ContextVar[Optional[Callable[[], bool]]] = ContextVar('samal_submit_guard', default=None)
+
+
+@contextmanager
+def checkout_submit_guard(guard: Callable[[], bool]) -> Iterator[None]:
+    """
+    Вызывать guard() перед каждой отправкой формы checkout внутри блока
+    
+    Задачи asyncio и asyncio.to_thread, созданные внутри блока, наследуют проверку.
+    """
+    token = _submit_guard.set(guard)
+    try:
+        yield
+    finally:
+        _submit_guard.reset(token)
+
+
+def confirm_checkout_submit() -> None:
+    """
+    Вызывается прямо перед отправкой формы checkout
+    
+    Raises:
+        CheckoutSubmitRefused: Проверка запретила отправку
+    """
+    guard = _submit_guard.get()
+    if guard is not None and not guard():
+        raise CheckoutSubmitRefused("Заказ уже обрабатывается другим воркером, форма не отправлена")
+
+
+class CheckoutPageMixin:
+    """
+    Разбор страниц WooCommerce и подготовка данных checkout.
+    Не выполняет сетевых запросов, поэтому общий для SamalAPI и AsyncSamalAPI.
+    """
     
     def extract_nonce(self, html: str) -> Optional[str]:
         """
@@ -124,23 +238,7 @@ class SamalAPI:
         Returns:
             Значение способа оплаты (например, 'cheque') или None
         """
-        # #region agent log
-        import json
-        log_data = {
-            "sessionId": "debug-session",
-            "runId": "run1",
-            "hypothesisId": "A",
-            "location": "samal_api.py:extract_payment_method",
-            "message": "Начало извлечения payment_method",
-            "data": {"html_length": len(html)},
-            "timestamp": int(time.time() * 1000)
-        }
-        try:
-            with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-        except:
-            pass
-        # #endregion
+        trace('payment_method_extract_start', level='debug', location='samal_api.py:extract_payment_method', html_length=len(html))
         
         try:
             # Гипотеза A: Ищем скрытое поле с payment_method
@@ -148,106 +246,31 @@ class SamalAPI:
             match = re.search(r'name=["\']payment_method["\'][^>]*value=["\']([^"\']+)["\'][^>]*checked', html, re.IGNORECASE)
             if match:
                 payment_method = match.group(1)
-                # #region agent log
-                log_data = {
-                    "sessionId": "debug-session",
-                    "runId": "run1",
-                    "hypothesisId": "A",
-                    "location": "samal_api.py:extract_payment_method",
-                    "message": "Найден payment_method через checked radio",
-                    "data": {"payment_method": payment_method},
-                    "timestamp": int(time.time() * 1000)
-                }
-                try:
-                    with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                        f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-                except:
-                    pass
-                # #endregion
+                trace('payment_method_found', level='debug', location='samal_api.py:extract_payment_method', hypothesis='A', source='checked_radio', payment_method=payment_method)
                 return payment_method
             
             # Гипотеза B: Ищем первый доступный способ оплаты (radio без checked)
             match = re.search(r'name=["\']payment_method["\'][^>]*value=["\']([^"\']+)["\']', html, re.IGNORECASE)
             if match:
                 payment_method = match.group(1)
-                # #region agent log
-                log_data = {
-                    "sessionId": "debug-session",
-                    "runId": "run1",
-                    "hypothesisId": "B",
-                    "location": "samal_api.py:extract_payment_method",
-                    "message": "Найден payment_method через первый radio",
-                    "data": {"payment_method": payment_method},
-                    "timestamp": int(time.time() * 1000)
-                }
-                try:
-                    with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                        f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-                except:
-                    pass
-                # #endregion
+                trace('payment_method_found', level='debug', location='samal_api.py:extract_payment_method', hypothesis='B', source='first_radio', payment_method=payment_method)
                 return payment_method
             
             # Гипотеза C: Ищем в JavaScript данных (data-payment-method или в скриптах)
             match = re.search(r'payment[_-]?method["\']?\s*[:=]\s*["\']([^"\']+)["\']', html, re.IGNORECASE)
             if match:
                 payment_method = match.group(1)
-                # #region agent log
-                log_data = {
-                    "sessionId": "debug-session",
-                    "runId": "run1",
-                    "hypothesisId": "C",
-                    "location": "samal_api.py:extract_payment_method",
-                    "message": "Найден payment_method через JavaScript",
-                    "data": {"payment_method": payment_method},
-                    "timestamp": int(time.time() * 1000)
-                }
-                try:
-                    with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                        f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-                except:
-                    pass
-                # #endregion
+                trace('payment_method_found', level='debug', location='samal_api.py:extract_payment_method', hypothesis='C', source='javascript', payment_method=payment_method)
                 return payment_method
             
             # Гипотеза D: По умолчанию используем 'cheque' (Чековые платежи)
             # Это стандартный способ оплаты для WooCommerce при доставке
-            # #region agent log
-            log_data = {
-                "sessionId": "debug-session",
-                "runId": "run1",
-                "hypothesisId": "D",
-                "location": "samal_api.py:extract_payment_method",
-                "message": "Используем значение по умолчанию cheque",
-                "data": {"payment_method": "cheque", "reason": "Не найден в HTML"},
-                "timestamp": int(time.time() * 1000)
-            }
-            try:
-                with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-            except:
-                pass
-            # #endregion
+            trace('payment_method_default', level='debug', location='samal_api.py:extract_payment_method', hypothesis='D', payment_method='cheque', reason='Не найден в HTML')
             return 'cheque'  # Значение по умолчанию для "Чековые платежи"
             
         except Exception as e:
             logger.error(f"Ошибка при извлечении payment_method: {str(e)}")
-            # #region agent log
-            log_data = {
-                "sessionId": "debug-session",
-                "runId": "run1",
-                "hypothesisId": "E",
-                "location": "samal_api.py:extract_payment_method",
-                "message": "Ошибка при извлечении, используем cheque по умолчанию",
-                "data": {"error": str(e), "payment_method": "cheque"},
-                "timestamp": int(time.time() * 1000)
-            }
-            try:
-                with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-            except:
-                pass
-            # #endregion
+            trace('payment_method_error', level='error', location='samal_api.py:extract_payment_method', hypothesis='E', error=str(e), payment_method='cheque')
             return 'cheque'  # Fallback значение
     
     def extract_order_id(self, html: str, location_header: Optional[str] = None) -> Optional[int]:
@@ -302,7 +325,293 @@ class SamalAPI:
         print("❌ Order ID не найден в ответе")
         return None
     
-    def place_order(self, user_data: Dict, use_browser: bool = False, product_id: Optional[int] = None, quantity: Optional[int] = None) -> Dict:
+    def extract_order_id_from_url(self, url: Optional[str]) -> Optional[int]:
+        """
+        Извлекает ID заказа из URL страницы подтверждения (.../order-received/<id>/)
+        
+        Returns:
+            ID заказа или None
+        """
+        if not url:
+            return None
+        match = re.search(r'order-received/(\d+)', url)
+        return int(match.group(1)) if match else None
+    
+    def build_checkout_form(self, user_data: Dict, nonce: str, payment_method: Optional[str] = None,
+                            hidden_fields: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        Формирует данные формы checkout для AJAX-запроса
+        
+        Args:
+            user_data: Данные пользователя (first_name, phone, address, comment)
+            nonce: woocommerce-process-checkout-nonce
+            payment_method: Способ оплаты (по умолчанию 'cheque')
+            hidden_fields: Скрытые поля формы со страницы checkout (если известны)
+            
+        Returns:
+            Словарь с полями формы
+        """
+        form_data = dict(hidden_fields) if hidden_fields else {}
+        form_data.update({
+            # WooCommerce Order Attribution (скрытые поля)
+            'wc_order_attribution_source_type': 'organic',
+            'wc_order_attribution_referrer': 'https://www.google.com/',
+            'wc_order_attribution_utm_campaign': '(none)',
+            'wc_order_attribution_utm_source': 'google',
+            'wc_order_attribution_utm_medium': 'organic',
+            'wc_order_attribution_utm_content': '(none)',
+            'wc_order_attribution_utm_id': '(none)',
+            'wc_order_attribution_utm_term': '(none)',
+            'wc_order_attribution_utm_source_platform': '(none)',
+            'wc_order_attribution_utm_creative_format': '(none)',
+            'wc_order_attribution_utm_marketing_tactic': '(none)',
+            'wc_order_attribution_session_entry': f'{SAMAL_BASE_URL}/',
+            'wc_order_attribution_session_start_time': '2025-10-20 20:11:05',
+            'wc_order_attribution_session_pages': '11',
+            'wc_order_attribution_session_count': '1',
+            'wc_order_attribution_user_agent': USER_AGENT,
+            
+            # Основные данные
+            'billing_first_name': user_data.get('first_name', ''),
+            'billing_address_1': user_data.get('address', ''),
+            'billing_phone': user_data.get('phone', ''),
+            'comments': user_data.get('comment', ''),
+            'delivery': '',  # Пустое поле согласно форме
+            'order_comments': 'Доставка осуществляется только по г. Алматы',
+            
+            # WooCommerce данные
+            'woocommerce-process-checkout-nonce': nonce,
+            '_wp_http_referer': '/checkout/',
+            'woocommerce_checkout_place_order': '1',  # Значение кнопки "Подтвердить заказ"
+            'payment_method': payment_method if payment_method else 'cheque',  # Способ оплаты
+        })
+        return form_data
+    
+    def parse_checkout_response(self, response_text: str, content_type: str) -> Optional[str]:
+        """
+        Разбирает ответ AJAX endpoint checkout и возвращает URL редиректа
+        
+        Args:
+            response_text: Текст ответа
+            content_type: Значение заголовка Content-Type
+            
+        Returns:
+            URL страницы подтверждения заказа или None
+        """
+        if 'application/json' not in content_type.lower() and not response_text.strip().startswith('{'):
+            return None
+        
+        print("📄 Ответ в формате JSON, парсю...")
+        try:
+            json_response = json.loads(response_text)
+        except json.JSONDecodeError as e:
+            print(f"⚠️  Не удалось распарсить JSON: {str(e)}")
+            print(f"   Текст ответа (первые 500 символов): {response_text[:500]}")
+            return None
+        
+        print(f"   JSON ответ: {json.dumps(json_response, ensure_ascii=False, indent=2)[:500]}")
+        
+        # WooCommerce возвращает redirect в поле 'redirect' или 'data.redirect'
+        if 'redirect' in json_response:
+            return json_response['redirect']
+        if 'data' in json_response and isinstance(json_response['data'], dict) and 'redirect' in json_response['data']:
+            return json_response['data']['redirect']
+        if 'messages' in json_response or 'fragments' in json_response:
+            # Возможно, есть ошибки валидации
+            print("⚠️  Возможны ошибки валидации в ответе")
+            if 'messages' in json_response:
+                print(f"   Сообщения: {json_response['messages']}")
+        return None
+    
+    def fast_completion_result(self, order_id: int) -> Dict:
+        """Результат заказа, завершенного сразу по номеру из ответа checkout"""
+        print(f"✅ Номер заказа получен из ответа checkout: {order_id}")
+        return {
+            'success': True,
+            'message': f'✅ Заказ успешно оформлен!\nНомер заказа: {order_id}\n',
+            'order_id': order_id
+        }
+    
+    def check_order_received_page(self, html: str, final_url: str, expected_order_id: int) -> bool:
+        """
+        Проверяет, что страница order-received подтверждает заказ
+        
+        Returns:
+            True если номер заказа на странице совпадает с ожидаемым
+        """
+        order_id = self.extract_order_id(html, final_url)
+        if order_id != expected_order_id:
+            logger.error(f"Страница подтверждения не подтвердила заказ {expected_order_id}: найдено {order_id}")
+            return False
+        return True
+    
+    def is_checkout_rejected(self, response_text: str) -> bool:
+        """
+        Проверяет, что WooCommerce отклонил checkout ({"result": "failure"}).
+        В этом случае заказ точно не создан и запрос можно повторить.
+        """
+        try:
+            json_response = json.loads(response_text)
+        except (json.JSONDecodeError, TypeError):
+            return False
+        return isinstance(json_response, dict) and json_response.get('result') == 'failure'
+    
+    def is_checkout_stale(self, response_text: str) -> bool:
+        """
+        Проверяет, что checkout отклонен из-за устаревшего nonce или сессии:
+        WooCommerce просит обновить checkout (refresh/reload) или сообщает об
+        ошибке nonce. Только такой отказ имеет смысл повторять со свежим nonce.
+        """
+        try:
+            json_response = json.loads(response_text)
+        except (json.JSONDecodeError, TypeError):
+            return False
+        if not isinstance(json_response, dict) or json_response.get('result') != 'failure':
+            return False
+        if json_response.get('refresh') or json_response.get('reload'):
+            return True
+        messages = json_response.get('messages')
+        return isinstance(messages, str) and bool(STALE_CHECKOUT_PATTERN.search(messages))
+    
+    def cart_item_key(self, product_id: int) -> str:
+        """
+        Возвращает ключ позиции корзины WooCommerce для простого товара
+        (WC_Cart::generate_cart_id: md5 от product_id без вариаций)
+        """
+        return hashlib.md5(str(product_id).encode()).hexdigest()
+    
+    def absolute_url(self, location: str) -> str:
+        """Делает URL из Location header абсолютным"""
+        if location.startswith('/'):
+            return f"{SAMAL_BASE_URL}{location}"
+        if location.startswith('http'):
+            return location
+        return f"{SAMAL_BASE_URL}/{location}"
+
+
+class SamalAPI(CheckoutPageMixin):
+    def __init__(self, local_order_id: Optional[int] = None):
+        # Номер заказа в локальной базе - по нему снимки ответов ищутся в архиве
+        self.local_order_id = local_order_id
+        # Своя сессия (cookies и корзина) для каждого заказа,
+        # но соединения берутся из общего пула
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = get_shared_adapter()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def add_to_cart(self, product_id: int, quantity: int = 2) -> bool:
+        """
+        Добавляет товар в корзину
+        
+        Args:
+            product_id: ID товара на сайте
+            quantity: Количество товара
+            
+        Returns:
+            True если успешно, False если ошибка
+        """
+        return self.add_items_to_cart([(product_id, quantity)])
+    
+    def add_items_to_cart(self, items: List[Tuple[int, int]]) -> bool:
+        """
+        Добавляет несколько товаров в корзину одной сессии
+        
+        Args:
+            items: Список (product_id, quantity)
+            
+        Returns:
+            True если все товары добавлены, False если ошибка
+        """
+        try:
+            # Получаем главную страницу для установки cookies (идемпотентно - с повторами)
+            with order_step('requests', 'shop_get'):
+                init_response = call_with_retry(self.session.get, SAMAL_SHOP_URL)
+            
+            for product_id, quantity in items:
+                # Добавляем товар в корзину (повтор мог бы добавить товар дважды)
+                url = f"{SAMAL_SHOP_URL}?add-to-cart={product_id}&quantity={quantity}"
+                with order_step('requests', 'add_to_cart'):
+                    response = call_with_retry(self.session.get, url, allow_redirects=True, attempts=1)
+                
+                if response.status_code != 200:
+                    logger.error(f"Ошибка добавления в корзину товара {product_id}. Статус: {response.status_code}")
+                    return False
+            
+            return True
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении в корзину: {str(e)}")
+            set_order_outcome(error_outcome(e))
+            return False
+    
+    def get_checkout_page(self) -> Optional[str]:
+        """
+        Получает HTML страницы оформления заказа
+        
+        Returns:
+            HTML содержимое страницы или None
+        """
+        try:
+            with order_step('requests', 'checkout_page'):
+                response = call_with_retry(self.session.get, SAMAL_CHECKOUT_URL)
+            
+            if response.status_code == 200:
+                return response.text
+            else:
+                logger.error(f"Ошибка получения checkout. Статус: {response.status_code}")
+                return None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы checkout: {str(e)}")
+            return None
+    
+    def fetch_checkout_fields(self) -> Optional[CheckoutPageFields]:
+        """
+        Загружает страницу checkout потоком и за один проход извлекает nonce,
+        способ оплаты и скрытые поля формы (тот же разбор, что у AsyncSamalAPI).
+        Разбор останавливается на </form>, остаток страницы не декодируется.
+        
+        Returns:
+            CheckoutPageFields с nonce или None
+        """
+        try:
+            with order_step('requests', 'checkout_page'):
+                response = call_with_retry(self.session.get, SAMAL_CHECKOUT_URL, stream=True)
+                try:
+                    if response.status_code != 200:
+                        logger.error(f"Ошибка получения checkout. Статус: {response.status_code}")
+                        set_order_outcome('checkout_page_failed')
+                        return None
+                    # Без charset в заголовке requests считает страницу latin-1, а сайт отдает UTF-8
+                    encoding = response.encoding if 'charset' in response.headers.get('Content-Type', '') else 'utf-8'
+                    chunks = response.iter_content(CHECKOUT_CHUNK_SIZE)
+                    fields = parse_checkout_chunks(chunks, encoding or 'utf-8')
+                    drained = 0
+                    for chunk in chunks:
+                        drained += len(chunk)
+                        if drained > DRAIN_LIMIT:
+                            break
+                finally:
+                    response.close()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы checkout: {str(e)}")
+            set_order_outcome('checkout_page_failed')
+            return None
+        
+        if not fields.nonce:
+            logger.error("Не удалось извлечь nonce из HTML")
+            set_order_outcome('nonce_missing')
+            return None
+        return fields
+    
+    def place_order(self, user_data: Dict, use_browser: bool = False, product_id: Optional[int] = None, quantity: Optional[int] = None,
+                    items: Optional[List[Tuple[int, int]]] = None) -> Dict:
         """
         Оформляет заказ на сайте
         
@@ -313,12 +622,13 @@ class SamalAPI:
                 - address: Адрес
                 - comment: Комментарий
             use_browser: Если True, использует реальный браузер (Selenium), иначе HTTP-запросы
+            items: Товары (product_id, quantity), которые браузер добавит в корзину
                 
         Returns:
             Словарь с результатом: {'success': bool, 'message': str, 'order_id': int или None}
         """
         if use_browser and SELENIUM_AVAILABLE:
-            return self._place_order_with_browser(user_data, product_id=product_id, quantity=quantity)
+            return self._place_order_with_browser(user_data, product_id=product_id, quantity=quantity, items=items)
         else:
             if use_browser and not SELENIUM_AVAILABLE:
                 print("⚠️  Selenium не установлен, использую HTTP-запросы")
@@ -340,417 +650,297 @@ class SamalAPI:
             # Открываем страницу товара или добавляем через URL
             add_to_cart_url = f"{SAMAL_SHOP_URL}?add-to-cart={product_id}&quantity={quantity}"
             print(f"🛒 Добавляю товар {product_id} в корзину (количество: {quantity})...")
-            driver.get(add_to_cart_url)
-            time.sleep(2)  # Даем время на добавление в корзину
+            with page_budget:
+                driver.get(add_to_cart_url)
+            # driver.get возвращается после загрузки страницы, то есть товар уже
+            # обработан сервером - ждем только уведомление магазина или виджет корзины
+            try:
+                WebDriverWait(driver, BROWSER_CART_TIMEOUT).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, CART_READY_SELECTOR))
+                )
+            except TimeoutException:
+                print("⚠️  Страница магазина не показала корзину, продолжаю")
+            errors = driver.find_elements(By.CSS_SELECTOR, WOOCOMMERCE_ERROR_SELECTOR)
+            if errors:
+                print(f"⚠️  Магазин не добавил товар: {errors[0].text}")
+                return False
             print("✅ Товар добавлен в корзину")
             return True
         except Exception as e:
             print(f"⚠️  Ошибка при добавлении товара в корзину: {str(e)}")
             return False
     
-    def _place_order_with_browser(self, user_data: Dict, product_id: Optional[int] = None, quantity: Optional[int] = None) -> Dict:
+    def _wait_for_checkout_result(self, driver, timeout: float) -> str:
         """
-        Оформляет заказ используя реальный браузер (Selenium)
-        Браузер будет видимым, чтобы можно было следить за процессом
+        Ждет результат отправки заказа: редирект на order-received или уведомление об ошибке
+        
+        Args:
+            driver: WebDriver экземпляр
+            timeout: Сколько ждать (секунды)
+            
+        Returns:
+            'received', 'error' или 'timeout'
         """
-        driver = None
+        deadline = time.monotonic() + timeout
+        driver.set_script_timeout(timeout)
         try:
-            print("🌐 Запускаю браузер для оформления заказа...")
-            
-            # Настройка Chrome с видимым окном
-            chrome_options = Options()
-            # НЕ используем headless режим - браузер будет видимым
-            # chrome_options.add_argument('--headless')  # Закомментировано для видимости
-            chrome_options.add_argument('--no-sandbox')
-            chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-            chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            chrome_options.add_experimental_option('useAutomationExtension', False)
-            
-            # Создаем драйвер (webdriver-manager автоматически скачает нужный драйвер)
-            driver = None
-            try:
-                # Сначала пробуем использовать системный ChromeDriver (если установлен через Homebrew)
+            outcome = driver.execute_async_script(WAIT_FOR_CHECKOUT_RESULT_JS, WOOCOMMERCE_ERROR_SELECTOR)
+        except TimeoutException:
+            return 'timeout'
+        except WebDriverException:
+            # Страница выгрузилась во время ожидания - это редирект
+            outcome = 'navigating'
+        if outcome in ('received', 'error'):
+            return outcome
+        
+        # Редирект начался: проверяем адрес новой страницы (без выгрузки всего HTML)
+        remaining = max(1.0, deadline - time.monotonic())
+        try:
+            WebDriverWait(driver, remaining).until(EC.any_of(
+                EC.url_contains('order-received'),
+                EC.presence_of_element_located((By.CSS_SELECTOR, WOOCOMMERCE_ERROR_SELECTOR)),
+            ))
+        except TimeoutException:
+            return 'timeout'
+        return 'received' if 'order-received' in driver.current_url else 'error'
+    
+    def _place_order_with_browser(self, user_data: Dict, product_id: Optional[int] = None, quantity: Optional[int] = None,
+                                  items: Optional[List[Tuple[int, int]]] = None) -> Dict:
+        """
+        Оформляет заказ используя реальный браузер (Selenium).
+        Браузер берется из общего пула и после заказа возвращается в него.
+        """
+        if not items and product_id and quantity:
+            items = [(product_id, quantity)]
+        set_order_backend('browser')
+        try:
+            print("🌐 Беру браузер из пула...")
+            acquire_started = time.perf_counter()
+            with browser_pool.driver() as driver:
+                observe_step('browser', 'browser_acquire', time.perf_counter() - acquire_started)
                 try:
-                    result = subprocess.run(['which', 'chromedriver'], capture_output=True, text=True)
-                    if result.returncode == 0:
-                        chromedriver_path = result.stdout.strip()
-                        print(f"✅ Найден системный ChromeDriver: {chromedriver_path}")
-                        service = Service(chromedriver_path)
-                        driver = webdriver.Chrome(service=service, options=chrome_options)
-                    else:
-                        raise FileNotFoundError("ChromeDriver не найден в PATH")
-                except (FileNotFoundError, Exception) as e:
-                    # Если системный не найден, пробуем webdriver-manager
+                    return self._checkout_in_browser(driver, user_data, items or [])
+                except TimeoutException as e:
+                    set_order_outcome('timeout')
+                    error_msg = f"Превышено время ожидания: {str(e)}"
+                    print(f"❌ {error_msg}")
+                    # Сохраняем текущее состояние страницы
                     try:
-                        from webdriver_manager.chrome import ChromeDriverManager  # type: ignore
-                        driver_path = ChromeDriverManager().install()
-                        # Проверяем, что это файл, а не директория
-                        if os.path.isdir(driver_path):
-                            # Ищем chromedriver внутри директории
-                            chromedriver_executable = os.path.join(driver_path, 'chromedriver')
-                            if not os.path.exists(chromedriver_executable):
-                                # Пробуем найти в поддиректориях
-                                for root, dirs, files in os.walk(driver_path):
-                                    if 'chromedriver' in files:
-                                        chromedriver_executable = os.path.join(root, 'chromedriver')
-                                        break
-                            if os.path.exists(chromedriver_executable):
-                                # Делаем файл исполняемым (на macOS/Linux)
-                                os.chmod(chromedriver_executable, 0o755)
-                                service = Service(chromedriver_executable)
-                                driver = webdriver.Chrome(service=service, options=chrome_options)
-                            else:
-                                raise FileNotFoundError(f"Исполняемый файл chromedriver не найден в {driver_path}")
-                        else:
-                            # Это уже файл
-                            os.chmod(driver_path, 0o755)
-                            service = Service(driver_path)
-                            driver = webdriver.Chrome(service=service, options=chrome_options)
-                    except ImportError:
-                        # Если webdriver-manager не установлен, пробуем без указания пути
-                        print("⚠️  webdriver-manager не установлен, пробую использовать ChromeDriver из PATH")
-                        driver = webdriver.Chrome(options=chrome_options)
-            except Exception as e:
-                error_msg = str(e)
-                print(f"⚠️  Ошибка при создании драйвера: {error_msg}")
-                print("\n💡 Решения:")
-                print("   1. Установите ChromeDriver через Homebrew: brew install chromedriver")
-                print("   2. Или установите webdriver-manager: pip install webdriver-manager")
-                print("   3. Или скачайте ChromeDriver вручную с https://chromedriver.chromium.org/")
-                raise Exception(f"Не удалось создать WebDriver: {error_msg}")
-            
-            driver.maximize_window()
-            print("✅ Браузер запущен и готов к работе")
-            
-            # Шаг 1: Добавляем товар в корзину (если указаны product_id и quantity)
-            if product_id and quantity:
-                if not self._add_to_cart_with_browser(driver, product_id, quantity):
+                        snapshot_ref = archive_order_html(
+                            'order_timeout', driver.page_source, [f"URL: {driver.current_url}"], self.local_order_id
+                        )
+                        error_msg += f"\n💾 Снимок ответа: {snapshot_ref}"
+                    except Exception:
+                        pass
+                    return {
+                        'success': False,
+                        'message': error_msg,
+                        'order_id': None
+                    }
+        except BrowserPoolTimeout as e:
+            set_order_outcome('browser_busy')
+            return {
+                'success': False,
+                'message': str(e),
+                'order_id': None
+            }
+        except Exception as e:
+            set_order_outcome('browser_error')
+            error_msg = f"Ошибка при оформлении заказа через браузер: {str(e)}"
+            print(f"❌ {error_msg}")
+            logger.error(error_msg, exc_info=True)
+            return {
+                'success': False,
+                'message': error_msg,
+                'order_id': None
+            }
+    
+    def _checkout_in_browser(self, driver, user_data: Dict, items: List[Tuple[int, int]]) -> Dict:
+        """
+        Шаги заказа в браузере: корзина, заполнение формы, отправка и результат
+        
+        Args:
+            driver: WebDriver из пула (cookies уже очищены)
+            user_data: Данные пользователя
+            items: Список (product_id, quantity)
+        """
+        print("✅ Браузер готов к работе")
+        
+        # Шаг 1: Добавляем товары в корзину
+        with order_step('browser', 'add_to_cart'):
+            for item_product_id, item_quantity in items:
+                if not self._add_to_cart_with_browser(driver, item_product_id, item_quantity):
+                    set_order_outcome('cart_failed')
                     return {
                         'success': False,
                         'message': 'Не удалось добавить товар в корзину через браузер',
                         'order_id': None
                     }
-            
-            # Шаг 2: Открываем страницу checkout
-            print(f"📄 Открываю страницу оформления заказа: {SAMAL_CHECKOUT_URL}")
-            driver.get(SAMAL_CHECKOUT_URL)
-            
-            # Ждем загрузки страницы
-            wait = WebDriverWait(driver, 30)
-            print("⏳ Ожидаю загрузки формы...")
+        
+        # Шаг 2: Открываем страницу checkout
+        print(f"📄 Открываю страницу оформления заказа: {SAMAL_CHECKOUT_URL}")
+        wait = WebDriverWait(driver, 30)
+        with order_step('browser', 'checkout_page'):
+            with page_budget:
+                driver.get(SAMAL_CHECKOUT_URL)
             
             # Ждем появления формы checkout
+            print("⏳ Ожидаю загрузки формы...")
             wait.until(EC.presence_of_element_located((By.ID, "billing_first_name")))
-            print("✅ Форма загружена")
-            
-            # Шаг 3: Заполняем форму
-            print("📝 Заполняю форму заказа...")
-            
-            # Имя
-            name_field = driver.find_element(By.ID, "billing_first_name")
-            name_field.clear()
-            name_field.send_keys(user_data.get('first_name', ''))
-            print(f"   ✓ Имя: {user_data.get('first_name', '')}")
-            
-            # Адрес
-            address_field = driver.find_element(By.ID, "billing_address_1")
-            address_field.clear()
-            address_field.send_keys(user_data.get('address', ''))
-            print(f"   ✓ Адрес: {user_data.get('address', '')}")
-            
-            # Телефон
-            phone_field = driver.find_element(By.ID, "billing_phone")
-            phone_field.clear()
-            phone_field.send_keys(user_data.get('phone', ''))
-            print(f"   ✓ Телефон: {user_data.get('phone', '')}")
-            
-            # Комментарий (если есть поле)
-            try:
-                comment_field = driver.find_element(By.ID, "order_comments")
-                comment_field.clear()
-                comment_text = user_data.get('comment', '')
-                if comment_text:
-                    comment_field.send_keys(comment_text)
-                    print(f"   ✓ Комментарий: {comment_text}")
-            except NoSuchElementException:
-                print("   ⚠️  Поле комментария не найдено, пропускаю")
-            
-            # Небольшая задержка для визуализации
-            time.sleep(1)
-            
-            # Шаг 4: Нажимаем кнопку "Подтвердить заказ"
-            print("🔘 Нажимаю кнопку 'Подтвердить заказ'...")
-            submit_button = wait.until(EC.element_to_be_clickable((By.ID, "place_order")))
-            submit_button.click()
+        print("✅ Форма загружена")
+        
+        # Шаг 3: Заполняем форму
+        print("📝 Заполняю форму заказа...")
+        fill_started = time.perf_counter()
+        
+        # Имя
+        name_field = driver.find_element(By.ID, "billing_first_name")
+        name_field.clear()
+        name_field.send_keys(user_data.get('first_name', ''))
+        print(f"   ✓ Имя: {user_data.get('first_name', '')}")
+        
+        # Адрес
+        address_field = driver.find_element(By.ID, "billing_address_1")
+        address_field.clear()
+        address_field.send_keys(user_data.get('address', ''))
+        print(f"   ✓ Адрес: {user_data.get('address', '')}")
+        
+        # Телефон
+        phone_field = driver.find_element(By.ID, "billing_phone")
+        phone_field.clear()
+        phone_field.send_keys(user_data.get('phone', ''))
+        print(f"   ✓ Телефон: {user_data.get('phone', '')}")
+        
+        # Комментарий (если есть поле)
+        try:
+            comment_field = driver.find_element(By.ID, "order_comments")
+            comment_field.clear()
+            comment_text = user_data.get('comment', '')
+            if comment_text:
+                comment_field.send_keys(comment_text)
+                print(f"   ✓ Комментарий: {comment_text}")
+        except NoSuchElementException:
+            print("   ⚠️  Поле комментария не найдено, пропускаю")
+        
+        # Шаг 4: Нажимаем кнопку "Подтвердить заказ"
+        print("🔘 Нажимаю кнопку 'Подтвердить заказ'...")
+        submit_button = wait.until(EC.element_to_be_clickable((By.ID, "place_order")))
+        observe_step('browser', 'fill_form', time.perf_counter() - fill_started)
+        confirm_checkout_submit()
+        with order_step('browser', 'checkout_submit'):
+            with checkout_budget:
+                submit_button.click()
             print("✅ Кнопка нажата, ожидаю обработку заказа...")
             
-            # Шаг 5: Ждем редиректа на страницу подтверждения или появления результата
+            # Шаг 5: Ждем редиректа на страницу подтверждения или появления ошибки
             # WooCommerce обычно редиректит на order-received страницу
             print("⏳ Ожидаю редирект на страницу подтверждения...")
-            
-            # Ждем либо изменения URL (редирект), либо появления сообщения об ошибке
-            max_wait_time = 30
-            start_time = time.time()
-            
-            while time.time() - start_time < max_wait_time:
-                current_url = driver.current_url
-                
-                # Проверяем, произошел ли редирект на страницу подтверждения
-                if 'order-received' in current_url or 'order-received' in driver.page_source:
-                    print(f"✅ Редирект на страницу подтверждения: {current_url}")
-                    break
-                
-                # Проверяем наличие ошибок
-                try:
-                    error_elements = driver.find_elements(By.CSS_SELECTOR, ".woocommerce-error, .woocommerce-notice--error")
-                    if error_elements:
-                        error_text = error_elements[0].text
-                        print(f"❌ Обнаружена ошибка: {error_text}")
-                        # Сохраняем HTML для анализа
-                        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"order_error_{timestamp}.html"
-                        with open(filename, 'w', encoding='utf-8') as f:
-                            f.write(driver.page_source)
-                        return {
-                            'success': False,
-                            'message': f'Ошибка при оформлении заказа: {error_text}\nHTML сохранен в {filename}',
-                            'order_id': None
-                        }
-                except:
-                    pass
-                
-                time.sleep(0.5)
-            else:
-                print("⚠️  Превышено время ожидания редиректа")
-            
-            # Шаг 6: Извлекаем order_id из URL или HTML
-            final_url = driver.current_url
-            page_source = driver.page_source
-            
-            print(f"📄 Финальный URL: {final_url}")
-            print(f"📄 Размер HTML: {len(page_source)} символов")
-            
-            # Сохраняем HTML в файл
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"order_response_{timestamp}.html"
-            try:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(f"<!-- Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} -->\n")
-                    f.write(f"<!-- URL: {final_url} -->\n\n")
-                    f.write(page_source)
-                print(f"💾 HTML ответ сохранен в файл: {filename}")
-            except Exception as e:
-                print(f"⚠️  Не удалось сохранить HTML ответ: {str(e)}")
-                filename = None
-            
-            # Извлекаем order_id
-            order_id = self.extract_order_id(page_source, final_url)
-            
-            # Формируем ответ
-            response_info = f"\n📡 Информация о заказе:\n"
-            response_info += f"URL: {final_url}\n"
-            if filename:
-                response_info += f"💾 HTML сохранен в файл: {filename}\n"
-            
-            if order_id:
-                message = f'✅ Заказ успешно оформлен!\nНомер заказа: {order_id}\n' + response_info
-                return {
-                    'success': True,
-                    'message': message,
-                    'order_id': order_id
-                }
-            else:
-                message = f'❌ Не удалось получить номер заказа.\n'
-                message += f'URL: {final_url}\n'
-                message += f'Проверьте файл {filename if filename else "браузер"} для деталей.\n'
-                message += response_info
-                return {
-                    'success': False,
-                    'message': message,
-                    'order_id': None
-                }
-                
-        except TimeoutException as e:
-            error_msg = f"Превышено время ожидания: {str(e)}"
-            print(f"❌ {error_msg}")
-            if driver:
-                # Сохраняем текущее состояние страницы
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"order_timeout_{timestamp}.html"
-                try:
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        f.write(driver.page_source)
-                    error_msg += f"\n💾 HTML сохранен в файл: {filename}"
-                except:
-                    pass
+            outcome = self._wait_for_checkout_result(driver, BROWSER_ORDER_TIMEOUT)
+        if outcome == 'received':
+            print(f"✅ Редирект на страницу подтверждения: {driver.current_url}")
+        elif outcome == 'error':
+            set_order_outcome('checkout_rejected')
+            error_elements = driver.find_elements(By.CSS_SELECTOR, WOOCOMMERCE_ERROR_SELECTOR)
+            error_text = error_elements[0].text if error_elements else ''
+            print(f"❌ Обнаружена ошибка: {error_text}")
+            # Сохраняем HTML для анализа
+            snapshot_ref = archive_order_html(
+                'order_error', driver.page_source, [f"URL: {driver.current_url}"], self.local_order_id
+            )
             return {
                 'success': False,
-                'message': error_msg,
+                'message': f'Ошибка при оформлении заказа: {error_text}\nСнимок ответа: {snapshot_ref}',
                 'order_id': None
             }
-        except Exception as e:
-            error_msg = f"Ошибка при оформлении заказа через браузер: {str(e)}"
-            print(f"❌ {error_msg}")
-            logger.error(error_msg, exc_info=True)
+        else:
+            set_order_outcome('timeout')
+            print("⚠️  Превышено время ожидания редиректа")
+        
+        # Шаг 6: Извлекаем order_id из URL или HTML
+        final_url = driver.current_url
+        page_source = driver.page_source
+        
+        print(f"📄 Финальный URL: {final_url}")
+        print(f"📄 Размер HTML: {len(page_source)} символов")
+        
+        # Сохраняем HTML в архив
+        snapshot_ref = archive_order_html('order_response', page_source, [
+            f"Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"URL: {final_url}",
+        ], self.local_order_id)
+        
+        # Извлекаем order_id
+        order_id = self.extract_order_id(page_source, final_url)
+        
+        # Формируем ответ
+        response_info = f"\n📡 Информация о заказе:\n"
+        response_info += f"URL: {final_url}\n"
+        if snapshot_ref:
+            response_info += f"💾 Снимок ответа: {snapshot_ref}\n"
+        
+        if order_id:
+            message = f'✅ Заказ успешно оформлен!\nНомер заказа: {order_id}\n' + response_info
+            return {
+                'success': True,
+                'message': message,
+                'order_id': order_id
+            }
+        else:
+            set_order_outcome('order_id_missing')
+            message = f'❌ Не удалось получить номер заказа.\n'
+            message += f'URL: {final_url}\n'
+            message += f'Проверьте снимок {snapshot_ref if snapshot_ref else "в браузере"} для деталей.\n'
+            message += response_info
             return {
                 'success': False,
-                'message': error_msg,
+                'message': message,
                 'order_id': None
             }
-        finally:
-            # НЕ закрываем браузер автоматически, чтобы пользователь мог видеть результат
-            # Пользователь может закрыть его вручную или мы можем добавить опцию для этого
-            print("ℹ️  Браузер остается открытым для просмотра результата.")
-            print("   Закройте его вручную когда закончите просмотр.")
-            # Если нужно автоматически закрывать, раскомментируйте:
-            # if driver:
-            #     input("Нажмите Enter чтобы закрыть браузер...")
-            #     driver.quit()
     
     def _place_order_with_requests(self, user_data: Dict) -> Dict:
         """
         Оформляет заказ используя HTTP-запросы (старый метод)
         """
         try:
-            # Получаем страницу checkout для получения nonce
-            checkout_html = self.get_checkout_page()
-            if not checkout_html:
-                return {'success': False, 'message': 'Не удалось загрузить страницу оформления заказа', 'order_id': None}
-            
-            # Извлекаем nonce
-            nonce = self.extract_nonce(checkout_html)
-            if not nonce:
+            # Получаем nonce, способ оплаты и скрытые поля со страницы checkout
+            fields = self.fetch_checkout_fields()
+            if fields is None:
                 return {'success': False, 'message': 'Не удалось получить nonce для оформления заказа', 'order_id': None}
-            
-            # Извлекаем способ оплаты
-            payment_method = self.extract_payment_method(checkout_html)
-            # #region agent log
-            import json
-            log_data = {
-                "sessionId": "debug-session",
-                "runId": "run1",
-                "hypothesisId": "A",
-                "location": "samal_api.py:_place_order_with_requests",
-                "message": "Извлечен payment_method из HTML",
-                "data": {"payment_method": payment_method, "nonce": nonce[:10] + "..." if nonce else None},
-                "timestamp": int(time.time() * 1000)
-            }
-            try:
-                with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-            except:
-                pass
-            # #endregion
+            nonce = fields.nonce
+            payment_method = fields.payment_method
+            if trace_enabled('debug'):
+                trace('payment_method_extracted', level='debug', location='samal_api.py:_place_order_with_requests', payment_method=payment_method, nonce=nonce[:10] + '...' if nonce else None)
             
             # Подготавливаем данные формы
-            form_data = {
-                # WooCommerce Order Attribution (скрытые поля)
-                'wc_order_attribution_source_type': 'organic',
-                'wc_order_attribution_referrer': 'https://www.google.com/',
-                'wc_order_attribution_utm_campaign': '(none)',
-                'wc_order_attribution_utm_source': 'google',
-                'wc_order_attribution_utm_medium': 'organic',
-                'wc_order_attribution_utm_content': '(none)',
-                'wc_order_attribution_utm_id': '(none)',
-                'wc_order_attribution_utm_term': '(none)',
-                'wc_order_attribution_utm_source_platform': '(none)',
-                'wc_order_attribution_utm_creative_format': '(none)',
-                'wc_order_attribution_utm_marketing_tactic': '(none)',
-                'wc_order_attribution_session_entry': 'https://samal.kz/',
-                'wc_order_attribution_session_start_time': '2025-10-20 20:11:05',
-                'wc_order_attribution_session_pages': '11',
-                'wc_order_attribution_session_count': '1',
-                'wc_order_attribution_user_agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36',
-                
-                # Основные данные
-                'billing_first_name': user_data.get('first_name', ''),
-                'billing_address_1': user_data.get('address', ''),
-                'billing_phone': user_data.get('phone', ''),
-                'comments': user_data.get('comment', ''),
-                'delivery': '',  # Пустое поле согласно форме
-                'order_comments': 'Доставка осуществляется только по г. Алматы',
-                
-                # WooCommerce данные
-                'woocommerce-process-checkout-nonce': nonce,
-                '_wp_http_referer': '/checkout/',
-                'woocommerce_checkout_place_order': '1',  # Значение кнопки "Подтвердить заказ"
-                'payment_method': payment_method if payment_method else 'cheque',  # Способ оплаты
-            }
+            form_data = self.build_checkout_form(user_data, nonce, payment_method, fields.hidden_fields)
             
-            # #region agent log
-            log_data = {
-                "sessionId": "debug-session",
-                "runId": "run1",
-                "hypothesisId": "A",
-                "location": "samal_api.py:_place_order_with_requests",
-                "message": "Данные формы перед отправкой",
-                "data": {
-                    "form_keys": list(form_data.keys()),
-                    "payment_method": form_data.get('payment_method'),
-                    "has_payment_method": 'payment_method' in form_data
-                },
-                "timestamp": int(time.time() * 1000)
-            }
-            try:
-                with open('/Users/elnurtazhimbetov/Desktop/Study/SamalTelegramBot/.cursor/debug.log', 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(log_data, ensure_ascii=False) + '\n')
-            except:
-                pass
-            # #endregion
+            if trace_enabled('debug'):
+                trace('checkout_form_prepared', level='debug', location='samal_api.py:_place_order_with_requests', form_keys=list(form_data.keys()), payment_method=form_data.get('payment_method'))
             
             # Эмулируем AJAX-запрос браузера на кнопку "Подтвердить заказ"
             # WooCommerce использует AJAX endpoint для обработки checkout
-            ajax_url = f"{SAMAL_BASE_URL}/?wc-ajax=checkout"
-            
-            headers = {
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'Origin': SAMAL_BASE_URL,
-                'Referer': SAMAL_CHECKOUT_URL,
-                'X-Requested-With': 'XMLHttpRequest',  # Важно: указываем, что это AJAX-запрос
-                'Accept': 'application/json, text/javascript, */*; q=0.01',
-            }
-            
-            print(f"📤 Отправляю AJAX-запрос на: {ajax_url}")
+            print(f"📤 Отправляю AJAX-запрос на: {CHECKOUT_AJAX_URL}")
             print(f"   Эмулирую нажатие кнопки 'Подтвердить заказ' (id=place_order)")
+            confirm_checkout_submit()
             
-            response = self.session.post(
-                ajax_url,
-                data=form_data,
-                headers=headers,
-                allow_redirects=False
-            )
+            # Отправку заказа не повторяем: заказ мог быть создан, даже если ответ не пришел
+            with order_step('requests', 'checkout_post'):
+                response = call_with_retry(
+                    self.session.post,
+                    CHECKOUT_AJAX_URL,
+                    data=form_data,
+                    headers=CHECKOUT_AJAX_HEADERS,
+                    allow_redirects=False,
+                    attempts=1,
+                    budget=checkout_budget
+                )
             
             print(f"📡 Ответ получен. Status: {response.status_code}")
             print(f"   Content-Type: {response.headers.get('Content-Type', 'не указан')}")
             
             # WooCommerce AJAX endpoint возвращает JSON с redirect URL или ошибками
             final_url = None
-            redirect_from_json = None
-            
-            # Проверяем, является ли ответ JSON
-            content_type = response.headers.get('Content-Type', '').lower()
-            response_text = response.text
-            
-            if 'application/json' in content_type or response_text.strip().startswith('{'):
-                print("📄 Ответ в формате JSON, парсю...")
-                try:
-                    json_response = json.loads(response_text)
-                    print(f"   JSON ответ: {json.dumps(json_response, ensure_ascii=False, indent=2)[:500]}")
-                    
-                    # WooCommerce возвращает redirect в поле 'redirect' или 'data.redirect'
-                    if 'redirect' in json_response:
-                        redirect_from_json = json_response['redirect']
-                    elif 'data' in json_response and isinstance(json_response['data'], dict) and 'redirect' in json_response['data']:
-                        redirect_from_json = json_response['data']['redirect']
-                    elif 'messages' in json_response or 'fragments' in json_response:
-                        # Возможно, есть ошибки валидации
-                        print("⚠️  Возможны ошибки валидации в ответе")
-                        if 'messages' in json_response:
-                            print(f"   Сообщения: {json_response['messages']}")
-                except json.JSONDecodeError as e:
-                    print(f"⚠️  Не удалось распарсить JSON: {str(e)}")
-                    print(f"   Текст ответа (первые 500 символов): {response_text[:500]}")
+            redirect_from_json = self.parse_checkout_response(response.text, response.headers.get('Content-Type', ''))
             
             # Определяем финальный URL для редиректа
             # Приоритет: 1) JSON redirect, 2) Location header, 3) текущий URL
@@ -758,27 +948,40 @@ class SamalAPI:
                 final_url = redirect_from_json
                 print(f"📍 Редирект из JSON: {final_url}")
             elif 'Location' in response.headers:
-                location = response.headers['Location']
-                # Если относительный URL, делаем его абсолютным
-                if location.startswith('/'):
-                    final_url = f"{SAMAL_BASE_URL}{location}"
-                elif location.startswith('http'):
-                    final_url = location
-                else:
-                    final_url = f"{SAMAL_BASE_URL}/{location}"
+                final_url = self.absolute_url(response.headers['Location'])
                 print(f"📍 Редирект из Location header: {final_url}")
+            trace('checkout_response', location='samal_api.py:_place_order_with_requests',
+                  status=response.status_code, redirect=final_url)
+            
+            # Быстрое завершение: номер заказа уже есть в redirect (order-received/<id>)
+            fast_order_id = self.extract_order_id_from_url(final_url) if ORDER_FAST_COMPLETION else None
+            if fast_order_id:
+                archive_order_html('order_response', response.text, [
+                    f"Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                    f"Status Code: {response.status_code}",
+                    f"Redirect: {final_url}",
+                ], self.local_order_id)
+                if ORDER_VERIFY_RECEIVED_PAGE:
+                    threading.Thread(
+                        target=self._verify_order_received,
+                        args=(final_url, fast_order_id),
+                        daemon=True,
+                    ).start()
+                return self.fast_completion_result(fast_order_id)
             
             # Ждем небольшую задержку для обработки на сервере
             if final_url:
                 print("⏳ Ожидаю обработку заказа на сервере (2 секунды)...")
-                time.sleep(2)
+                with order_step('requests', 'redirect_wait'):
+                    time.sleep(2)
             
             # Делаем запрос на финальную страницу подтверждения заказа
             final_response = response
             if final_url:
                 print(f"🔄 Запрашиваю финальную страницу подтверждения: {final_url}")
                 try:
-                    final_response = self.session.get(final_url, allow_redirects=True, timeout=30)
+                    with order_step('requests', 'order_received_get'):
+                        final_response = call_with_retry(self.session.get, final_url, allow_redirects=True, timeout=30)
                     print(f"✅ Финальная страница получена. Status: {final_response.status_code}")
                     print(f"   URL: {final_response.url}")
                 except Exception as e:
@@ -788,24 +991,15 @@ class SamalAPI:
                 print("⚠️  Редирект не найден в ответе. Возможно, заказ не был создан или есть ошибки.")
             
             # Сохраняем полный HTML ответ в файл
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"order_response_{timestamp}.html"
-            try:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(f"<!-- Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} -->\n")
-                    f.write(f"<!-- Первый Status Code: {response.status_code} -->\n")
-                    f.write(f"<!-- Финальный Status Code: {final_response.status_code} -->\n")
-                    f.write(f"<!-- Первый URL: {response.url} -->\n")
-                    f.write(f"<!-- Финальный URL: {final_response.url} -->\n")
-                    f.write(f"<!-- Headers:\n")
-                    for key, value in final_response.headers.items():
-                        f.write(f"  {key}: {value}\n")
-                    f.write(f"-->\n\n")
-                    f.write(final_response.text)
-                print(f"💾 HTML ответ сохранен в файл: {filename}")
-            except Exception as e:
-                print(f"⚠️  Не удалось сохранить HTML ответ: {str(e)}")
-                filename = None  # Если не удалось сохранить, устанавливаем None
+            header_lines = [
+                f"Response от {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                f"Первый Status Code: {response.status_code}",
+                f"Финальный Status Code: {final_response.status_code}",
+                f"Первый URL: {response.url}",
+                f"Финальный URL: {final_response.url}",
+                "Headers:\n" + "".join(f"  {key}: {value}\n" for key, value in final_response.headers.items()),
+            ]
+            snapshot_ref = archive_order_html('order_response', final_response.text, header_lines, self.local_order_id)
             
             # Выводим полный response в терминал
             print("\n" + "="*80)
@@ -835,15 +1029,15 @@ class SamalAPI:
             if 'Location' in response.headers:
                 response_info += f"Редирект: {response.headers['Location']}\n"
             
-            if filename:
-                response_info += f"\n💾 Полный HTML ответ сохранен в файл: {filename}\n"
+            if snapshot_ref:
+                response_info += f"\n💾 Полный HTML ответ сохранен в архив: {snapshot_ref}\n"
             response_info += f"Размер ответа: {len(final_response.text)} символов"
             
             # Берем первые 500 символов текста для сообщения пользователю
             response_text_short = final_response.text[:500] if len(final_response.text) > 500 else final_response.text
             response_info += f"\n\nТекст ответа (первые 500 символов):\n{response_text_short}"
             if len(final_response.text) > 500:
-                response_info += f"\n... (полный ответ в файле {filename})"
+                response_info += f"\n... (полный ответ в снимке {snapshot_ref})"
             
             # Извлекаем order ID из финального ответа
             location_header = final_response.headers.get('Location', None) or response.headers.get('Location', None)
@@ -859,10 +1053,11 @@ class SamalAPI:
                 }
             else:
                 # Даже если статус код 200/302/303, но order_id не найден - это ошибка
+                set_order_outcome('checkout_rejected' if self.is_checkout_rejected(response.text) else 'order_id_missing')
                 logger.error(f"Order ID не найден в ответе. Статус: {response.status_code}")
                 message = f'❌ Не удалось получить номер заказа.\n'
                 message += f'Статус ответа: {response.status_code}\n'
-                message += f'Возможно заказ не был создан. Проверьте файл {filename if filename else "ответ"} для деталей.\n'
+                message += f'Возможно заказ не был создан. Проверьте снимок {snapshot_ref if snapshot_ref else "ответа"} для деталей.\n'
                 message += response_info
                 return {
                     'success': False,
@@ -870,15 +1065,31 @@ class SamalAPI:
                     'order_id': None
                 }
                 
+        except CircuitOpenError as e:
+            return site_unavailable_result(e.retry_after)
         except Exception as e:
             logger.error(f"Ошибка при оформлении заказа: {str(e)}")
+            set_order_outcome(error_outcome(e))
             return {
                 'success': False,
                 'message': f'Произошла ошибка: {str(e)}',
                 'order_id': None
             }
     
-    def create_order(self, product_id: int, quantity: int, user_data: Dict, use_browser: bool = False) -> Dict:
+    def _verify_order_received(self, final_url: str, order_id: int) -> None:
+        """Фоновая проверка страницы order-received после быстрого завершения"""
+        try:
+            final_response = call_with_retry(self.session.get, final_url, allow_redirects=True, timeout=30)
+            if not self.check_order_received_page(final_response.text, str(final_response.url), order_id):
+                archive_order_html('order_unverified', final_response.text, [f"URL: {final_response.url}"],
+                                   self.local_order_id)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке страницы подтверждения заказа {order_id}: {str(e)}")
+    
+    @track_order('requests')
+    def create_order(self, product_id: Optional[int] = None, quantity: Optional[int] = None,
+                     user_data: Optional[Dict] = None, use_browser: bool = False,
+                     items: Optional[List[Dict]] = None) -> Dict:
         """
         Полный цикл создания заказа: добавление в корзину + оформление
         
@@ -887,22 +1098,34 @@ class SamalAPI:
             quantity: Количество
             user_data: Данные пользователя
             use_browser: Если True, использует реальный браузер для оформления заказа
+            items: Несколько товаров в одном заказе вместо product_id/quantity:
+                [{'product_id': 224, 'quantity': 2}, {'product_id': 226, 'quantity': 2}]
             
         Returns:
             Результат оформления заказа
         """
+        cart_items = normalize_order_items(product_id, quantity, items)
+        
+        # Пока сайт недоступен, не заставляем пользователя ждать таймаутов
+        if samal_breaker.is_open:
+            return site_unavailable_result(samal_breaker.retry_after())
+        
         if use_browser and SELENIUM_AVAILABLE:
-            # Если используем браузер, добавляем товар в корзину тоже через браузер
+            # Если используем браузер, добавляем товары в корзину тоже через браузер
             # (внутри place_order)
-            return self.place_order(user_data, use_browser=True, product_id=product_id, quantity=quantity)
+            return self.place_order(user_data, use_browser=True, items=cart_items)
         else:
-            # Если используем HTTP, добавляем товар в корзину через HTTP
-            if not self.add_to_cart(product_id, quantity):
+            # Если используем HTTP, добавляем все товары в корзину одной сессии
+            try:
+                added = self.add_items_to_cart(cart_items)
+            except CircuitOpenError as e:
+                return site_unavailable_result(e.retry_after)
+            if not added:
+                set_order_outcome('cart_failed')
                 return {
                     'success': False,
                     'message': 'Не удалось добавить товар в корзину',
                     'order_id': None
                 }
-            # Оформляем заказ через HTTP
+            # Оформляем заказ через HTTP (одна отправка формы на всю корзину)
             return self.place_order(user_data, use_browser=False)
-
@@ -0,0 +1,123 @@
+"""
+Пул заранее подготовленных сессий checkout WooCommerce
+
+Фоновая задача держит несколько анонимных сессий samal.kz с cookies,
+nonce и способом оплаты. Заказ забирает готовую сессию и сразу отправляет
+форму, не загружая страницу магазина и страницу checkout.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Optional
+
+from async_samal_api import AsyncSamalAPI, WarmSession
+from config import CHECKOUT_POOL_SIZE, CHECKOUT_POOL_NONCE_TTL, CHECKOUT_POOL_REFRESH_INTERVAL
+from resilience import samal_breaker
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Не выдаем сессию, если nonce истекает раньше, чем через столько секунд
+FRESHNESS_MARGIN = 300
+# Пауза после неудачной подготовки сессии (секунды)
+WARM_FAILURE_BACKOFF = 30
+
+
+class CheckoutSessionPool:
+    """
+    Пул подготовленных сессий checkout.
+
+    Использование:
+        await checkout_pool.start()        # при запуске бота
+        warm = checkout_pool.acquire()     # None, если готовых сессий нет
+        await checkout_pool.stop()         # при остановке бота
+    """
+
+    def __init__(self, size: int = CHECKOUT_POOL_SIZE, ttl: int = CHECKOUT_POOL_NONCE_TTL,
+                 refresh_interval: int = CHECKOUT_POOL_REFRESH_INTERVAL):
+        self.size = size
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._sessions: Deque[WarmSession] = deque()
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def start(self) -> None:
+        """Запускает фоновое заполнение пула"""
+        if not self.enabled or self._task is not None:
+            return
+        self._refill_needed = asyncio.Event()
+        self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу и очищает пул"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._sessions.clear()
+
+    def acquire(self) -> Optional[WarmSession]:
+        """
+        Забирает готовую сессию из пула
+
+        Returns:
+            WarmSession или None, если свежих сессий нет
+        """
+        while self._sessions:
+            session = self._sessions.popleft()
+            if session.is_fresh(FRESHNESS_MARGIN):
+                self._request_refill()
+                return session
+        self._request_refill()
+        return None
+
+    def _request_refill(self) -> None:
+        if self._refill_needed is not None:
+            self._refill_needed.set()
+
+    def _drop_expired(self) -> None:
+        self._sessions = deque(s for s in self._sessions if s.is_fresh(FRESHNESS_MARGIN))
+
+    async def _warm_one(self) -> Optional[WarmSession]:
+        async with AsyncSamalAPI() as api:
+            return await api.warm_session(self.ttl)
+
+    async def _maintain(self) -> None:
+        """Фоновый цикл: выбрасывает устаревшие сессии и готовит новые"""
+        while True:
+            self._refill_needed.clear()
+            try:
+                self._drop_expired()
+                # Пока сайт недоступен, не тратим пробные запросы breaker на пул
+                while len(self._sessions) < self.size and not samal_breaker.is_open:
+                    session = await self._warm_one()
+                    if session is None:
+                        logger.error("Не удалось подготовить сессию checkout для пула")
+                        await asyncio.sleep(WARM_FAILURE_BACKOFF)
+                        break
+                    self._sessions.append(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при заполнении пула сессий: {str(e)}")
+                await asyncio.sleep(WARM_FAILURE_BACKOFF)
+
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Общий пул для всего процесса бота
+checkout_pool = CheckoutSessionPool()
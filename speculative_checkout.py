@@ -0,0 +1,85 @@
+"""
+Упреждающая подготовка заказа, пока пользователь смотрит экран подтверждения
+
+Как только бот показал "📋 Подтверждение заказа", в фоне добавляется товар
+в корзину и получается nonce. После нажатия "✅ Подтвердить заказ" остается
+только отправить форму, а при отмене подготовленная сессия выбрасывается.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from async_samal_api import AsyncSamalAPI, PreparedCheckout
+from resilience import CircuitOpenError
+from samal_api import site_unavailable_result
+from session_pool import checkout_pool
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+
+class SpeculativeCheckout:
+    """
+    Фоновая подготовка корзины для одного заказа.
+
+    Создавать внутри работающего event loop:
+        spec = SpeculativeCheckout([(product_id, quantity), ...])
+        result = await spec.submit(user_data)   # или await spec.discard()
+    """
+
+    def __init__(self, items: List[Tuple[int, int]]):
+        self.items = list(items)
+        warm_session = checkout_pool.acquire()
+        self.api = AsyncSamalAPI(cookies=warm_session.cookies if warm_session else None)
+        self._task: asyncio.Task = asyncio.create_task(
+            self.api.prepare_checkout(self.items, warm_session)
+        )
+        self._closed = False
+
+    def matches(self, items: List[Tuple[int, int]]) -> bool:
+        """True, если подготовлена корзина с теми же товарами и количеством"""
+        return not self._closed and self.items == list(items)
+
+    async def submit(self, user_data: Dict, local_order_id: Optional[int] = None) -> Dict:
+        """
+        Дожидается подготовки и отправляет форму checkout
+
+        Args:
+            user_data: Данные пользователя
+            local_order_id: Номер заказа в локальной базе (для архива снимков ответа)
+
+        Returns:
+            Результат оформления заказа
+        """
+        self.api.local_order_id = local_order_id
+        try:
+            prepared: Optional[PreparedCheckout] = await self._task
+            if prepared is None:
+                # Подготовка не удалась - корзина в неизвестном состоянии, начинаем заново
+                async with AsyncSamalAPI(local_order_id=local_order_id) as api:
+                    return await api.create_order(user_data=user_data, items=[
+                        {'product_id': product_id, 'quantity': quantity} for product_id, quantity in self.items
+                    ])
+            return await self.api.complete_checkout(user_data, prepared)
+        except CircuitOpenError as e:
+            return site_unavailable_result(e.retry_after)
+        finally:
+            await self._close()
+
+    async def discard(self) -> None:
+        """Отменяет подготовку и выбрасывает сессию (корзина на сайте остается брошенной)"""
+        if not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await self._close()
+
+    async def _close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            try:
+                await self.api.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии клиента: {str(e)}")
@@ -0,0 +1,58 @@
+"""
+Общие фикстуры тестов
+
+Настройки бота читаются при импорте config, поэтому mock samal.kz
+запускается и переменные окружения задаются здесь - до импорта модулей
+бота в тестах. Запросы идут только на локальный mock, файлы (архив
+снимков, трассировка, база) пишутся во временный каталог.
+"""
+import os
+import tempfile
+
+import pytest
+
+from mock_samal_server import MockSamal, MockSamalServer
+
+_TEMP_DIR = tempfile.mkdtemp(prefix='samal_tests_')
+_server = MockSamalServer(MockSamal()).start()
+
+os.environ.update({
+    'SAMAL_BASE_URL': _server.base_url,
+    'SAMAL_PAGE_RATE': '0',
+    'SAMAL_PAGE_CONCURRENCY': '0',
+    'SAMAL_CHECKOUT_RATE': '0',
+    'SAMAL_CHECKOUT_CONCURRENCY': '0',
+    'SAMAL_RETRY_BASE_DELAY': '0.01',
+    'SAMAL_RETRY_MAX_DELAY': '0.05',
+    # Общий breaker не должен размыкаться от ошибок, которые тесты вызывают намеренно
+    'SAMAL_BREAKER_FAILURE_THRESHOLD': '0',
+    'ORDER_ARCHIVE_PATH': os.path.join(_TEMP_DIR, 'order_archive.db'),
+    'DATABASE_PATH': os.path.join(_TEMP_DIR, 'samal_bot.db'),
+    'CHROMEDRIVER_CACHE_PATH': os.path.join(_TEMP_DIR, 'chromedriver_cache.json'),
+    'TRACE_LEVEL': 'off',
+    'TRACE_DIR': os.path.join(_TEMP_DIR, 'traces'),
+})
+
+
+@pytest.fixture(scope='session')
+def mock_shop() -> MockSamal:
+    """Состояние mock samal.kz (счетчики общие для всех тестов - сравнивайте разницу)"""
+    return _server.shop
+
+
+@pytest.fixture
+def user_data():
+    return {'first_name': 'Тест', 'phone': '+77001234567', 'address': 'Алматы, ул. Абая 1', 'comment': ''}
+
+
+@pytest.fixture
+def db(tmp_path):
+    from database import Database
+
+    database = Database(str(tmp_path / 'bot.db'))
+    yield database
+    database.close()
+
+
+def pytest_unconfigure(config):
+    _server.stop()
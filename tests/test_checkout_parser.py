@@ -0,0 +1,109 @@
+"""Потоковый разбор формы checkout (checkout_parser)"""
+import os
+
+import pytest
+
+from checkout_parser import DEFAULT_PAYMENT_METHOD, CheckoutFormParser, parse_checkout_chunks
+
+PAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'checkout_page.html')
+NONCE_TAG = b'<input type="hidden" id="woocommerce-process-checkout-nonce"'
+
+FORM = (
+    '<html><body><form class="search"><input type="hidden" name="s" value="outside"></form>'
+    '<form name="checkout" method="post" class="checkout woocommerce-checkout" action="/checkout/">'
+    '<input type="text" name="billing_phone" value="">'
+    '<input type="radio" name="payment_method" value="bacs">'
+    '<input type="radio" name="payment_method" value="cod" checked="checked">'
+    '<input type="hidden" name="woocommerce-process-checkout-nonce" value="abc123"/>'
+    '<input type="hidden" name="_wp_http_referer" value="/checkout/?a=1&amp;b=2">'
+    '</form><input type="hidden" name="after_form" value="x"></body></html>'
+).encode('utf-8')
+
+
+@pytest.fixture(scope='module')
+def page() -> bytes:
+    with open(PAGE_PATH, 'rb') as f:
+        return f.read()
+
+
+def split(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def test_real_checkout_page(page):
+    fields = parse_checkout_chunks(split(page, 16 * 1024))
+
+    assert fields.nonce == '8638a8487d'
+    assert fields.hidden_fields == {'woocommerce-process-checkout-nonce': '8638a8487d',
+                                    '_wp_http_referer': '/checkout/'}
+    # На странице нет способа оплаты - как и регулярные выражения, берем значение по умолчанию
+    assert fields.payment_method == DEFAULT_PAYMENT_METHOD
+
+
+def test_form_fields():
+    fields = parse_checkout_chunks([FORM])
+
+    assert fields.nonce == 'abc123'
+    assert fields.payment_method == 'cod'
+    assert fields.hidden_fields == {'woocommerce-process-checkout-nonce': 'abc123',
+                                    '_wp_http_referer': '/checkout/?a=1&b=2'}
+
+
+def test_first_payment_method_without_checked():
+    fields = parse_checkout_chunks([FORM.replace(b' checked="checked"', b'')])
+
+    assert fields.payment_method == 'bacs'
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64, 1000])
+def test_small_chunks(size):
+    assert parse_checkout_chunks(split(FORM, size)) == parse_checkout_chunks([FORM])
+
+
+def test_chunk_split_inside_tag(page):
+    expected = parse_checkout_chunks([page])
+    nonce_at = page.index(NONCE_TAG)
+    form_at = page.index(b'<form name="checkout"')
+    form_end = page.index(b'</form>')
+    # Граница куска внутри тега формы, тега nonce и закрывающего </form>
+    for offset in [form_at + 3, form_at + 60, nonce_at + 1, nonce_at + 40, nonce_at + 100, form_end + 3]:
+        assert parse_checkout_chunks([page[:offset], page[offset:]]) == expected, offset
+
+
+def test_missing_nonce(page):
+    start = page.index(NONCE_TAG)
+    end = page.index(b'>', start) + 1
+    fields = parse_checkout_chunks(split(page[:start] + page[end:], 16 * 1024))
+
+    assert fields.nonce is None
+    assert 'woocommerce-process-checkout-nonce' not in fields.hidden_fields
+    assert fields.hidden_fields == {'_wp_http_referer': '/checkout/'}
+
+
+def test_no_checkout_form():
+    fields = parse_checkout_chunks([b'<html><body><form class="search"></form></body></html>'])
+
+    assert fields.nonce is None
+    assert fields.hidden_fields == {}
+
+
+def test_stops_after_form(page):
+    parser = CheckoutFormParser()
+    chunks = split(page, 16 * 1024)
+    fed = 0
+    for chunk in chunks:
+        parser.feed_bytes(chunk)
+        fed += 1
+        if parser.done:
+            break
+
+    assert parser.done
+    assert fed < len(chunks)
+    assert parser.close_fields().nonce == '8638a8487d'
+
+
+def test_encoding():
+    body = ('<form class="woocommerce-checkout"><input type="hidden" name="note" value="Вода">'
+            '</form>').encode('cp1251')
+
+    assert parse_checkout_chunks([body], 'cp1251').hidden_fields == {'note': 'Вода'}
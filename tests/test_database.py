@@ -0,0 +1,164 @@
+"""SQLite: профили, кеш после commit, история заказов и group commit (database)"""
+import asyncio
+import threading
+
+import pytest
+
+from database import AsyncDatabase, GroupCommitWriter
+
+
+def test_save_user_creates_and_updates_only_given_fields(db):
+    db.save_user(1, phone='+77001112233', address='Абая 1', first_name='Айгуль')
+    db.save_user(1, address='Абая 2')
+    db.save_user(1)
+
+    user = db._load_user(1)
+    assert user['phone'] == '+77001112233'
+    assert user['address'] == 'Абая 2'
+    assert user['first_name'] == 'Айгуль'
+    assert user['comment'] == ''
+
+
+def test_save_user_without_fields_creates_empty_profile(db):
+    db.save_user(2)
+
+    assert db.get_user(2) == {'chat_id': 2, 'phone': '', 'contact_phone': '', 'address': '',
+                              'first_name': '', 'comment': ''}
+
+
+def test_cache_updated_only_after_commit(db):
+    db.save_user(1, phone='old')
+    assert db.user_cache.get(1) == (True, db._load_user(1))
+
+    with db.transaction():
+        db.save_user(1, phone='new')
+        # Внутри транзакции кеш сброшен: другие потоки читают закоммиченную версию
+        assert db.user_cache.get(1)[0] is False
+        seen = {}
+        reader = threading.Thread(target=lambda: seen.update(user=db.get_user(1)))
+        reader.start()
+        reader.join()
+        assert seen['user']['phone'] == 'old'
+
+    found, user = db.user_cache.get(1)
+    assert found
+    assert user['phone'] == 'new'
+
+
+def test_rolled_back_write_does_not_reach_cache(db):
+    db.save_user(1, phone='old')
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.save_user(1, phone='new')
+            raise RuntimeError('откат')
+
+    assert db.get_user(1)['phone'] == 'old'
+    assert db._load_user(1)['phone'] == 'old'
+
+
+def test_delete_user_clears_cache(db):
+    db.save_user(1, phone='+77001112233')
+    db.save_order(1, 224, 'Товар', 1, 1000)
+
+    db.delete_user(1)
+
+    assert db.user_cache.get(1) == (True, None)
+    assert db.get_user(1) is None
+    assert db.get_user_orders(1) == []
+
+
+def test_order_history_pages_by_position(db):
+    # Заказы одной секунды отличаются только id - позиция учитывает оба поля
+    ids = [db.save_order(1, 224, f'Товар {i}', 1, 100 * i) for i in range(7)]
+    db.save_order(2, 224, 'Чужой заказ', 1, 100)
+
+    pages = []
+    cursor = None
+    while True:
+        orders, cursor = db.get_order_history(1, limit=3, before=cursor)
+        pages.append([order['id'] for order in orders])
+        if cursor is None:
+            break
+
+    assert pages == [ids[6:3:-1], ids[3:0:-1], ids[:1]]
+
+
+def test_order_history_exact_page(db):
+    for i in range(3):
+        db.save_order(1, 224, f'Товар {i}', 1, 100)
+
+    orders, cursor = db.get_order_history(1, limit=3)
+
+    assert len(orders) == 3
+    assert cursor is None
+
+
+def test_enqueue_order_saves_items(db):
+    items = [
+        {'product_id': 224, 'product_name': 'Первый', 'quantity': 2, 'price': 500},
+        {'product_id': 226, 'product_name': 'Второй', 'quantity': 1, 'price': 700},
+    ]
+
+    order_id = db.enqueue_order(1, 224, 'Первый и еще 1', 3, 1700, {'items': []}, items)
+
+    assert db.get_order_items(order_id) == [
+        {'product_id': 224, 'product_name': 'Первый', 'quantity': 2, 'price': 500},
+        {'product_id': 226, 'product_name': 'Второй', 'quantity': 1, 'price': 700},
+    ]
+    assert db.get_user_orders(1)[0]['status'] == 'pending'
+
+
+def test_group_commit_batches_writes(db):
+    writer = GroupCommitWriter(db, window=0.05)
+    try:
+        futures = [writer.submit(db.save_order, chat_id, 224, 'Товар', 1, 100) for chat_id in range(10)]
+        order_ids = [future.result(timeout=5) for future in futures]
+    finally:
+        writer.shutdown()
+
+    assert len(set(order_ids)) == 10
+    assert writer.writes == 10
+    assert writer.batches < 10
+    assert all(len(db.get_user_orders(chat_id)) == 1 for chat_id in range(10))
+
+
+def test_group_commit_failure_affects_only_its_author(db):
+    def failing():
+        with db.transaction():
+            db.save_user(3, phone='3')
+            raise ValueError('неверные данные')
+
+    writer = GroupCommitWriter(db, window=0.05)
+    try:
+        first = writer.submit(db.save_user, 1, phone='1')
+        broken = writer.submit(failing)
+        last = writer.submit(db.save_user, 2, phone='2')
+        first.result(timeout=5)
+        last.result(timeout=5)
+        with pytest.raises(ValueError):
+            broken.result(timeout=5)
+    finally:
+        writer.shutdown()
+
+    assert db._load_user(1)['phone'] == '1'
+    assert db._load_user(2)['phone'] == '2'
+    assert db._load_user(3) is None
+
+
+def test_async_database_with_group_commit(db):
+    async def run():
+        adb = AsyncDatabase(db, readers=2, group_commit_ms=20)
+        try:
+            await asyncio.gather(*(adb.save_user(chat_id, phone=str(chat_id)) for chat_id in range(5)))
+            db.user_cache.clear()
+            users = await asyncio.gather(*(adb.get_user(chat_id) for chat_id in range(5)))
+            history = await adb.get_order_history(1)
+        finally:
+            await adb.close()
+        return users, history
+
+    users, history = asyncio.run(run())
+
+    assert [user['phone'] for user in users] == ['0', '1', '2', '3', '4']
+    assert history == ([], None)
@@ -0,0 +1,107 @@
+"""Очередь заказов: аренда заданий и воркеры (database, order_queue)"""
+import asyncio
+import time
+
+from database import AsyncDatabase
+from order_queue import OrderWorkerPool
+
+MAX_ATTEMPTS = 3
+
+
+def enqueue(db, user_data, chat_id: int = 1) -> int:
+    payload = {'items': [{'product_id': 224, 'quantity': 1}], 'user_data': user_data}
+    return db.enqueue_order(chat_id, 224, 'Товар', 1, 1000, payload)
+
+
+def expire_leases(db) -> None:
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE order_jobs SET lease_expires_at = ? WHERE status = 'running'", (time.time() - 1,))
+
+
+def job_status(db, job_id: int) -> str:
+    return db.get_connection().execute('SELECT status FROM order_jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+
+def test_job_is_leased_to_one_worker(db, user_data):
+    order_id = enqueue(db, user_data)
+
+    job = db.claim_order_job('w1', 60, MAX_ATTEMPTS)
+
+    assert job['order_id'] == order_id
+    assert job['attempts'] == 1
+    assert job['payload']['user_data'] == user_data
+    assert db.claim_order_job('w2', 60, MAX_ATTEMPTS) is None
+
+
+def test_expired_lease_is_reclaimed(db, user_data):
+    enqueue(db, user_data)
+    job = db.claim_order_job('w1', 60, MAX_ATTEMPTS)
+    expire_leases(db)
+
+    reclaimed = db.claim_order_job('w2', 60, MAX_ATTEMPTS)
+
+    assert reclaimed['id'] == job['id']
+    assert reclaimed['attempts'] == 2
+    # Прежний воркер больше не может ни продлить, ни отправить, ни завершить заказ
+    assert db.extend_order_job_lease(job['id'], 'w1', 60) is False
+    assert db.mark_order_job_submitted(job['id'], 'w1') is False
+    assert db.complete_order_job(job['id'], job['order_id'], 'w1', 'failed', 'ошибка') is False
+    assert db.complete_order_job(job['id'], job['order_id'], 'w2', 'success') is True
+    assert job_status(db, job['id']) == 'done'
+    assert db.get_user_orders(1)[0]['status'] == 'success'
+
+
+def test_submitted_job_is_not_reclaimed(db, user_data):
+    enqueue(db, user_data)
+    job = db.claim_order_job('w1', 60, MAX_ATTEMPTS)
+    assert db.mark_order_job_submitted(job['id'], 'w1') is True
+    expire_leases(db)
+
+    assert db.claim_order_job('w2', 60, MAX_ATTEMPTS) is None
+    abandoned = db.fail_abandoned_order_jobs(MAX_ATTEMPTS)
+
+    assert [j['id'] for j in abandoned] == [job['id']]
+    assert job_status(db, job['id']) == 'failed'
+    assert db.get_user_orders(1)[0]['status'] == 'failed'
+
+
+def test_job_abandoned_after_max_attempts(db, user_data):
+    enqueue(db, user_data)
+    for attempt in range(MAX_ATTEMPTS):
+        assert db.claim_order_job(f'w{attempt}', 60, MAX_ATTEMPTS) is not None
+        expire_leases(db)
+
+    assert db.claim_order_job('w-last', 60, MAX_ATTEMPTS) is None
+    assert len(db.fail_abandoned_order_jobs(MAX_ATTEMPTS)) == 1
+    assert db.fail_abandoned_order_jobs(MAX_ATTEMPTS) == []
+
+
+def test_worker_pool_places_queued_order(db, mock_shop, user_data):
+    async def run():
+        adb = AsyncDatabase(db, readers=1, group_commit_ms=0)
+        pool = OrderWorkerPool(workers=1, lease_seconds=30, poll_interval=0.05, max_attempts=MAX_ATTEMPTS)
+        results = asyncio.Queue()
+
+        async def notify(job, result):
+            await results.put((job, result))
+
+        await pool.start(adb, notify)
+        try:
+            order_id = enqueue(db, user_data)
+            pool.wake()
+            job, result = await asyncio.wait_for(results.get(), timeout=30)
+        finally:
+            await pool.stop()
+            await adb.close()
+        return order_id, job, result
+
+    orders_before = mock_shop.stats().get('orders', 0)
+
+    order_id, job, result = asyncio.run(run())
+
+    assert job['order_id'] == order_id
+    assert result['success'] is True
+    assert mock_shop.stats()['orders'] == orders_before + 1
+    assert job_status(db, job['id']) == 'done'
+    row = db.get_connection().execute('SELECT submitted_at FROM order_jobs WHERE id = ?', (job['id'],)).fetchone()
+    assert row[0] is not None
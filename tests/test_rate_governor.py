@@ -0,0 +1,171 @@
+"""Очередь бюджета запросов (rate_governor.RateBudget)"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_governor import RateBudget
+
+
+async def wait_queued(budget: RateBudget, count: int) -> None:
+    """Ждет, пока в очереди слотов окажется count запросов"""
+    for _ in range(200):
+        if len(budget._slot_waiters) >= count:
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError(f"В очереди {len(budget._slot_waiters)} запросов вместо {count}")
+
+
+def test_async_waiters_served_in_arrival_order():
+    async def run():
+        budget = RateBudget('test', rate=0, burst=1, max_concurrency=1)
+        served = []
+
+        async def request(i):
+            async with budget:
+                served.append(i)
+                await asyncio.sleep(0.001)
+
+        await budget.aacquire()
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.create_task(request(i)))
+            await wait_queued(budget, i + 1)
+        budget.release()
+        await asyncio.gather(*tasks)
+        return served, budget.stats()
+
+    served, stats = asyncio.run(run())
+
+    assert served == [0, 1, 2, 3, 4]
+    assert stats['in_flight'] == 0
+    assert stats['waiting'] == 0
+    assert stats['acquired'] == 6
+
+
+def test_threads_and_coroutines_share_one_queue():
+    budget = RateBudget('test', rate=0, burst=1, max_concurrency=1)
+    served = []
+
+    def thread_request():
+        with budget:
+            served.append('thread')
+
+    async def run():
+        await budget.aacquire()
+        thread = threading.Thread(target=thread_request)
+        thread.start()
+        await wait_queued(budget, 1)
+
+        async def request():
+            async with budget:
+                served.append('coroutine')
+
+        task = asyncio.create_task(request())
+        await wait_queued(budget, 2)
+        budget.release()
+        await task
+        await asyncio.to_thread(thread.join)
+
+    asyncio.run(run())
+
+    assert served == ['thread', 'coroutine']
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        budget = RateBudget('test', rate=0, burst=1, max_concurrency=1)
+        served = []
+
+        async def request(i):
+            async with budget:
+                served.append(i)
+
+        await budget.aacquire()
+        first = asyncio.create_task(request(1))
+        await wait_queued(budget, 1)
+        second = asyncio.create_task(request(2))
+        await wait_queued(budget, 2)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert len(budget._slot_waiters) == 1
+
+        budget.release()
+        await second
+        return served, budget.stats()
+
+    served, stats = asyncio.run(run())
+
+    assert served == [2]
+    assert stats['in_flight'] == 0
+    assert stats['waiting'] == 0
+
+
+def test_slot_granted_to_cancelled_waiter_passes_on():
+    async def run():
+        budget = RateBudget('test', rate=0, burst=1, max_concurrency=1)
+        served = []
+
+        async def request(i):
+            async with budget:
+                served.append(i)
+
+        await budget.aacquire()
+        first = asyncio.create_task(request(1))
+        await wait_queued(budget, 1)
+        second = asyncio.create_task(request(2))
+        await wait_queued(budget, 2)
+
+        # Слот уже передан первому, но отмена пришла раньше, чем он проснулся
+        budget.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await second
+        return served, budget.stats()
+
+    served, stats = asyncio.run(run())
+
+    assert served == [2]
+    assert stats['in_flight'] == 0
+
+
+def test_token_bucket_limits_rate():
+    budget = RateBudget('test', rate=20, burst=2, max_concurrency=0)
+
+    started = time.monotonic()
+    for _ in range(4):
+        with budget:
+            pass
+    elapsed = time.monotonic() - started
+
+    # Два запроса - из запаса, еще два ждут по 1/20 с
+    assert elapsed >= 0.09
+    assert budget.stats()['acquired'] == 4
+
+
+def test_cancelled_request_refunds_token():
+    async def run():
+        budget = RateBudget('test', rate=2, burst=1, max_concurrency=0)
+        await budget.aacquire()
+        budget.release()
+
+        waiting = asyncio.create_task(budget.aacquire())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        # Токен отмененного запроса вернулся: следующий ждет около 0.5 с, а не 1 с
+        started = time.monotonic()
+        await budget.aacquire()
+        budget.release()
+        return time.monotonic() - started, budget.stats()
+
+    waited, stats = asyncio.run(run())
+
+    assert waited < 0.75
+    assert stats['waiting'] == 0
@@ -0,0 +1,156 @@
+"""Circuit breaker и повторы запросов (resilience)"""
+import time
+
+import httpx
+import pytest
+import requests
+
+from rate_governor import RateBudget
+from resilience import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    call_with_retry,
+    error_outcome,
+)
+
+RESET_TIMEOUT = 0.05
+
+
+@pytest.fixture
+def breaker() -> CircuitBreaker:
+    return CircuitBreaker(failure_threshold=2, reset_timeout=RESET_TIMEOUT)
+
+
+@pytest.fixture
+def budget() -> RateBudget:
+    return RateBudget('test', rate=0, burst=1, max_concurrency=0)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_failures(breaker):
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    breaker.record_failure()
+
+    assert breaker.state == STATE_OPEN
+    assert breaker.is_open
+    assert 0 < breaker.retry_after() <= RESET_TIMEOUT
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_resets_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == STATE_CLOSED
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    open_breaker(breaker)
+    time.sleep(RESET_TIMEOUT)
+
+    assert breaker.state == STATE_HALF_OPEN
+    breaker.before_call()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_opens_again(breaker):
+    open_breaker(breaker)
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_abandoned_probe_can_be_sent_again(breaker):
+    open_breaker(breaker)
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_call()
+
+    breaker.abandon_probe()
+
+    breaker.before_call()
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker(failure_threshold=0, reset_timeout=RESET_TIMEOUT)
+    for _ in range(10):
+        breaker.record_failure()
+
+    assert breaker.state == STATE_CLOSED
+    breaker.before_call()
+
+
+def test_retry_on_unavailable_response(breaker, budget):
+    unavailable = FakeResponse(503)
+    responses = [unavailable, FakeResponse(200)]
+
+    response = call_with_retry(lambda: responses.pop(0), attempts=3, breaker=breaker, budget=budget)
+
+    assert response.status_code == 200
+    assert unavailable.closed
+    assert breaker.state == STATE_CLOSED
+
+
+def test_retry_returns_last_response_when_attempts_run_out(breaker, budget):
+    responses = [FakeResponse(502), FakeResponse(503)]
+
+    response = call_with_retry(lambda: responses.pop(0), attempts=2, breaker=breaker, budget=budget)
+
+    assert response.status_code == 503
+    assert not response.closed
+    assert breaker.state == STATE_OPEN
+
+
+def test_retry_raises_last_error_and_counts_failures(breaker, budget):
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise requests.ConnectionError('connection refused')
+
+    with pytest.raises(requests.ConnectionError):
+        call_with_retry(failing, attempts=2, breaker=breaker, budget=budget)
+
+    assert len(calls) == 2
+    assert breaker.state == STATE_OPEN
+
+
+@pytest.mark.parametrize('error, outcome', [
+    (httpx.ReadTimeout('timeout'), 'timeout'),
+    (requests.Timeout(), 'timeout'),
+    (httpx.ConnectError('refused'), 'transport_error'),
+    (requests.ConnectionError(), 'transport_error'),
+    (ValueError('bad data'), 'error'),
+])
+def test_error_outcome(error, outcome):
+    assert error_outcome(error) == outcome
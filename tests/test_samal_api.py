@@ -0,0 +1,87 @@
+"""Оформление заказа через AsyncSamalAPI и SamalAPI на mock samal.kz"""
+import asyncio
+
+from async_samal_api import AsyncSamalAPI, PreparedCheckout
+from checkout_parser import NONCE_FIELD
+from samal_api import SamalAPI
+
+
+def counters(shop, *names):
+    stats = shop.stats()
+    return {name: stats.get(name, 0) for name in names}
+
+
+async def create_order(**kwargs):
+    async with AsyncSamalAPI() as api:
+        return await api.create_order(**kwargs)
+
+
+def test_async_create_order(mock_shop, user_data):
+    before = counters(mock_shop, 'orders', 'checkout_submits')
+
+    result = asyncio.run(create_order(product_id=224, quantity=2, user_data=user_data))
+
+    assert result['success'] is True
+    assert isinstance(result['order_id'], int)
+    assert result['outcome'] == 'success'
+    after = counters(mock_shop, 'orders', 'checkout_submits')
+    assert after['orders'] == before['orders'] + 1
+    assert after['checkout_submits'] == before['checkout_submits'] + 1
+
+
+def test_async_create_order_several_items(mock_shop, user_data):
+    before = counters(mock_shop, 'add_to_cart')
+
+    result = asyncio.run(create_order(user_data=user_data, items=[
+        {'product_id': 224, 'quantity': 1}, {'product_id': 226, 'quantity': 3},
+    ]))
+
+    assert result['success'] is True
+    assert counters(mock_shop, 'add_to_cart')['add_to_cart'] == before['add_to_cart'] + 2
+
+
+def test_async_invalid_field_is_not_resubmitted(mock_shop, user_data):
+    before = counters(mock_shop, 'checkout_submits', 'checkout_invalid_fields')
+
+    result = asyncio.run(create_order(product_id=224, quantity=1, user_data=dict(user_data, phone='')))
+
+    assert result['success'] is False
+    assert result['outcome'] == 'checkout_rejected'
+    after = counters(mock_shop, 'checkout_submits', 'checkout_invalid_fields')
+    assert after['checkout_submits'] == before['checkout_submits'] + 1
+    assert after['checkout_invalid_fields'] == before['checkout_invalid_fields'] + 1
+
+
+def test_async_stale_prepared_nonce_is_refreshed(mock_shop, user_data):
+    async def run():
+        async with AsyncSamalAPI() as api:
+            prepared = await api.prepare_checkout([(224, 1)])
+            stale = PreparedCheckout('0000000000', prepared.payment_method,
+                                     dict(prepared.hidden_fields, **{NONCE_FIELD: '0000000000'}))
+            return await api.complete_checkout(user_data, stale)
+
+    before = counters(mock_shop, 'orders', 'checkout_nonce_rejected')
+
+    result = asyncio.run(run())
+
+    assert result['success'] is True
+    after = counters(mock_shop, 'orders', 'checkout_nonce_rejected')
+    assert after['checkout_nonce_rejected'] == before['checkout_nonce_rejected'] + 1
+    assert after['orders'] == before['orders'] + 1
+
+
+def test_sync_create_order(mock_shop, user_data):
+    before = counters(mock_shop, 'orders')
+
+    result = SamalAPI().create_order(product_id=224, quantity=1, user_data=user_data)
+
+    assert result['success'] is True
+    assert isinstance(result['order_id'], int)
+    assert counters(mock_shop, 'orders')['orders'] == before['orders'] + 1
+
+
+def test_sync_invalid_field(mock_shop, user_data):
+    result = SamalAPI().create_order(product_id=224, quantity=1, user_data=dict(user_data, phone=''))
+
+    assert result['success'] is False
+    assert result['outcome'] == 'checkout_rejected'
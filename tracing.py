@@ -0,0 +1,200 @@
+"""
+Структурированная трассировка событий заказа
+
+Код на пути заказа только кладет событие в очередь в памяти (без файлового
+I/O и сериализации). Фоновый поток пачками пишет события в JSONL файлы с
+ротацией по размеру. Уровень и доля записываемых событий настраиваются.
+
+Использование:
+    from tracing import trace, trace_enabled
+    trace('payment_method_found', level='debug', location='samal_api.py:extract_payment_method',
+          payment_method='cheque')
+
+    # Данные, которые дорого готовить, - только если событие будет записано
+    if trace_enabled('debug'):
+        trace('checkout_form_prepared', level='debug', form_keys=list(form_data.keys()))
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import (
+    TRACE_LEVEL,
+    TRACE_SAMPLE_RATE,
+    TRACE_DIR,
+    TRACE_MAX_BYTES,
+    TRACE_BACKUP_COUNT,
+    TRACE_FLUSH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'off': 100}
+
+# Максимум событий в очереди; при переполнении новые события отбрасываются
+QUEUE_SIZE = 10000
+# Максимум событий в одной пачке записи
+BATCH_SIZE = 500
+TRACE_FILENAME = 'trace.jsonl'
+
+
+class TraceWriter:
+    """
+    Очередь событий и фоновый поток, который пишет их в файлы
+    <directory>/trace.jsonl, trace.jsonl.1, ... trace.jsonl.<backup_count>
+    """
+
+    def __init__(self, directory: str = TRACE_DIR, level: str = TRACE_LEVEL,
+                 sample_rate: float = TRACE_SAMPLE_RATE, max_bytes: int = TRACE_MAX_BYTES,
+                 backup_count: int = TRACE_BACKUP_COUNT, flush_interval: float = TRACE_FLUSH_INTERVAL):
+        self.directory = directory
+        self.min_level = LEVELS.get(level.lower(), LEVELS['info'])
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, TRACE_FILENAME)
+
+    def enabled_for(self, level: str) -> bool:
+        """True, если события этого уровня записываются"""
+        return LEVELS.get(level, LEVELS['info']) >= self.min_level
+
+    def emit(self, event: str, level: str = 'info', location: Optional[str] = None, **data) -> None:
+        """
+        Кладет событие в очередь (не блокирует вызывающий код)
+
+        Args:
+            event: Название события
+            level: debug | info | warning | error
+            location: Место в коде (файл:функция)
+            **data: Данные события (должны сериализоваться в JSON)
+        """
+        if not self.enabled_for(level):
+            return
+        # Ошибки пишем всегда, остальное - с заданной вероятностью
+        if level != 'error' and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if self._thread is None:
+            self._start()
+
+        record = {
+            'ts': int(time.time() * 1000),
+            'level': level,
+            'event': event,
+            'thread': threading.current_thread().name,
+        }
+        if location:
+            record['location'] = location
+        if data:
+            record['data'] = data
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # emit вызывают многие потоки, += без блокировки теряет отброшенные события
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self) -> None:
+        """Дописывает оставшиеся события и останавливает поток"""
+        if self._thread is not None and self._thread.is_alive():
+            self._stopping.set()
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = self._take_batch(timeout=self.flush_interval)
+            if batch:
+                self._write(batch)
+        # Остаток очереди при остановке
+        batch = self._take_batch(timeout=0)
+        while batch:
+            self._write(batch)
+            batch = self._take_batch(timeout=0)
+
+    def _take_batch(self, timeout: float) -> List[Dict]:
+        batch = []
+        try:
+            if timeout > 0:
+                batch.append(self._queue.get(timeout=timeout))
+            else:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict]) -> None:
+        lines = []
+        for record in batch:
+            try:
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            except Exception:
+                continue
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.append(json.dumps({
+                'ts': int(time.time() * 1000), 'level': 'warning',
+                'event': 'trace_events_dropped', 'data': {'count': dropped},
+            }))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                size = f.tell()
+            if size >= self.max_bytes:
+                self._rotate()
+        except Exception as e:
+            logger.error(f"Не удалось записать трассировку: {str(e)}")
+
+    def _rotate(self) -> None:
+        """trace.jsonl -> trace.jsonl.1 -> ... -> trace.jsonl.<backup_count>"""
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+# Общий writer процесса
+_writer = TraceWriter()
+
+
+def trace(event: str, level: str = 'info', location: Optional[str] = None, **data) -> None:
+    """Записывает событие трассировки (см. TraceWriter.emit)"""
+    _writer.emit(event, level, location, **data)
+
+
+def trace_enabled(level: str = 'debug') -> bool:
+    """Позволяет не готовить дорогие данные для событий, которые не будут записаны"""
+    return _writer.enabled_for(level)